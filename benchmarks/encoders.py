@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark of the encoding of parameters (LCX, GVX, LCX_array)
+
+run from the repository's root directory:
+python3 -m benchmarks.encoders
+"""
+
+import random
+import timeit
+
+import ev3.utils
+
+VALUES = [random.randint(-100, 100) for _ in range(1000)]
+OFFSETS = [random.randint(0, 1000) for _ in range(1000)]
+
+
+def lcx_chain() -> bytes:
+    """the former way: if-chain and struct.pack per value"""
+    return b''.join([ev3.utils._lcx(value) for value in VALUES])
+
+
+def lcx_table() -> bytes:
+    return b''.join([ev3.utils.LCX(value) for value in VALUES])
+
+
+def gvx_chain() -> bytes:
+    return b''.join([ev3.utils._var(value, 0x60, 0xe0) for value in OFFSETS])
+
+
+def gvx_table() -> bytes:
+    return b''.join([ev3.utils.GVX(value) for value in OFFSETS])
+
+
+def main(number: int = 1000) -> None:
+    cases = [
+        ('LCX chain', lcx_chain),
+        ('LCX table', lcx_table),
+        ('GVX chain', gvx_chain),
+        ('GVX table', gvx_table),
+    ]
+    try:
+        import numpy
+    except ImportError:
+        print('numpy is not installed, LCX_array is skipped')
+    else:
+        array = numpy.array(VALUES)
+        assert ev3.utils.LCX_array(array) == lcx_chain()
+        cases.append(('LCX_array', lambda: ev3.utils.LCX_array(array)))
+    for name, func in cases:
+        best = min(timeit.repeat(func, number=number, repeat=5))
+        print('{:<12} {:8.3f} us per 1000 values'.format(
+            name, 1e6 * best / number))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Benchmarks of round trips, throughput, file transfer and task timing,
+against a real brick or the emulator, results as JSON
+
+run from the repository's root directory:
+python3 -m benchmarks.suite --transport emulator --latency 10 -o result.json
+python3 -m benchmarks.suite --transport usb --quick
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import threading
+import time
+import typing
+
+import ev3
+import ev3_file
+import task
+from ev3.emulator import Emulator
+from ev3.transport import LoopbackTransport
+
+DIRECTORY = '../prjs/benchmark/'
+
+
+def percentiles(values: typing.List[float]) -> dict:
+    """
+    summary of a list of durations (sec.): number, mean and percentiles
+    """
+    ordered = sorted(values)
+    if not ordered:
+        return {'n': 0}
+
+    def rank(fraction: float) -> float:
+        # nearest rank
+        pos = max(0, min(len(ordered) - 1,
+                         int(round(fraction * len(ordered) + 0.5)) - 1))
+        return ordered[pos]
+
+    return {
+        'n': len(ordered),
+        'mean': sum(ordered) / len(ordered),
+        'min': ordered[0],
+        'p50': rank(0.5),
+        'p90': rank(0.9),
+        'p99': rank(0.99),
+        'max': ordered[-1],
+    }
+
+
+def rtt(ev3_obj: ev3.EV3, mode: str, number: int) -> dict:
+    """
+    round trip of single direct commands in sync_mode mode
+    """
+    ev3_obj.sync_mode = mode
+    times = []
+    for _ in range(number):
+        start = time.perf_counter()
+        if mode == ev3.SYNC:
+            ev3_obj.send_direct_cmd(ev3.opNop)
+        elif mode == ev3.ASYNC:
+            counter = ev3_obj.send_direct_cmd(ev3.opNop, global_mem=4)
+            ev3_obj.wait_for_reply(counter)
+        else:
+            ev3_obj.send_direct_cmd(ev3.opNop, global_mem=4)
+        times.append(time.perf_counter() - start)
+    ev3_obj.sync_mode = ev3.STD
+    return percentiles(times)
+
+
+def no_reply_throughput(ev3_obj: ev3.EV3, number: int) -> dict:
+    """
+    commands without reply per second, a final command with reply
+    makes sure, the brick has processed all of them
+    """
+    start = time.perf_counter()
+    for _ in range(number):
+        ev3_obj.send_direct_cmd(ev3.opNop)
+    sent = time.perf_counter() - start
+    ev3_obj.send_direct_cmd(ev3.opNop, global_mem=1)
+    total = time.perf_counter() - start
+    return {
+        'n': number,
+        'send_per_sec': number / sent,
+        'processed_per_sec': number / total,
+    }
+
+
+def mixed_load(ev3_obj: ev3.EV3, threads: int, duration: float) -> dict:
+    """
+    threads, that share the connection and alternate commands
+    with and without reply for duration seconds
+    """
+    times = []
+    counts = []
+    lock = threading.Lock()
+    end = time.perf_counter() + duration
+
+    def worker() -> None:
+        own = ev3.EV3(ev3_obj=ev3_obj)
+        own_times = []
+        num = 0
+        while time.perf_counter() < end:
+            own.send_direct_cmd(ev3.opNop)
+            start = time.perf_counter()
+            own.send_direct_cmd(ev3.opNop, global_mem=4)
+            own_times.append(time.perf_counter() - start)
+            num += 2
+        with lock:
+            times.extend(own_times)
+            counts.append(num)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return {
+        'threads': threads,
+        'commands_per_sec': sum(counts) / elapsed,
+        'rtt': percentiles(times),
+    }
+
+
+def file_transfer(file_system: ev3_file.FileSystem,
+                  sizes: typing.List[int]) -> list:
+    """
+    MB/s of write_file and read_file per file size
+    """
+    result = []
+    for size in sizes:
+        data = bytes(range(256)) * (size // 256) + bytes(size % 256)
+        path = DIRECTORY + 'transfer_{}.bin'.format(size)
+        start = time.perf_counter()
+        file_system.write_file(path, data)
+        written = time.perf_counter() - start
+        start = time.perf_counter()
+        read = file_system.read_file(path)
+        elapsed = time.perf_counter() - start
+        assert read == data, 'read_file returned other data'
+        file_system.del_file(path)
+        result.append({
+            'bytes': size,
+            'write_mb_per_sec': size / written / 1e6,
+            'read_mb_per_sec': size / elapsed / 1e6,
+        })
+    return result
+
+
+def list_dir_latency(file_system: ev3_file.FileSystem,
+                     counts: typing.List[int], number: int) -> list:
+    """
+    latency of list_dir dependent from the number of files
+    """
+    result = []
+    path = DIRECTORY + 'list'
+    created = 0
+    file_system.create_dir(path)
+    for count in counts:
+        while created < count:
+            file_system.write_file(
+                '{}/file_{:04d}.txt'.format(path, created), b'x')
+            created += 1
+        times = []
+        for _ in range(number):
+            start = time.perf_counter()
+            listing = file_system.list_dir(path)
+            times.append(time.perf_counter() - start)
+        assert len(listing['files']) == count, 'list_dir missed files'
+        result.append({'files': count, 'latency': percentiles(times)})
+    for num in range(created):
+        file_system.del_file('{}/file_{:04d}.txt'.format(path, num))
+    file_system.del_dir(path)
+    return result
+
+
+def task_jitter(ev3_obj: ev3.EV3, interval: float, number: int) -> dict:
+    """
+    deviation of the calls of a task.Periodic from its interval,
+    each call sends a command without reply
+    """
+    stamps = []
+
+    def tick() -> None:
+        stamps.append(time.perf_counter())
+        ev3_obj.send_direct_cmd(ev3.opNop)
+
+    periodic = task.Periodic(interval, tick, num=number)
+    periodic.start()
+    periodic.join()
+    deviations = [abs(later - earlier - interval)
+                  for earlier, later in zip(stamps, stamps[1:])]
+    return {'interval': interval, 'deviation': percentiles(deviations)}
+
+
+def connect(args: argparse.Namespace) -> typing.Tuple[ev3.EV3, Emulator]:
+    """
+    EV3 object of the chosen transport (and the emulator, if there is one)
+    """
+    if args.transport == 'emulator':
+        emulator = Emulator(port=args.port,
+                            latency=args.latency / 1000,
+                            jitter=args.jitter / 1000,
+                            beacon=('127.0.0.1', 3015),
+                            beacon_interval=0.1).start()
+        return ev3.EV3(protocol=ev3.WIFI), emulator
+    if args.transport == 'loopback':
+        emulator = Emulator(port=args.port)
+        transport = LoopbackTransport(emulator.handle)
+        return ev3.EV3(transport=transport), emulator
+    protocol = {'usb': ev3.USB, 'wifi': ev3.WIFI}[args.transport]
+    return ev3.EV3(protocol=protocol, host=args.host), None
+
+
+def revision() -> str:
+    """
+    git revision of the code (None outside of a repository)
+    """
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            check=True).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+BENCHMARKS = ('rtt', 'no_reply', 'mixed', 'transfer', 'list_dir', 'jitter')
+
+
+def run(ev3_obj: ev3.EV3, only: typing.List[str], quick: bool) -> dict:
+    """
+    run the benchmarks named in only, returns their results
+    """
+    scale = 0.1 if quick else 1
+    number = max(10, int(200 * scale))
+    file_system = ev3_file.FileSystem(ev3_obj=ev3_obj)
+    results = {}
+    if 'rtt' in only:
+        results['rtt'] = {
+            mode: rtt(ev3_obj, mode, number)
+            for mode in (ev3.STD, ev3.SYNC, ev3.ASYNC)
+        }
+    if 'no_reply' in only:
+        results['no_reply'] = no_reply_throughput(ev3_obj, 5 * number)
+    if 'mixed' in only:
+        results['mixed'] = [
+            mixed_load(ev3_obj, threads, 5 * scale)
+            for threads in (1, 4, 8)
+        ]
+    if 'transfer' in only or 'list_dir' in only:
+        file_system.create_dir(DIRECTORY)
+    if 'transfer' in only:
+        sizes = [1000, 10000, 100000] + ([] if quick else [1000000])
+        results['transfer'] = file_transfer(file_system, sizes)
+    if 'list_dir' in only:
+        counts = [0, 10, 50] + ([] if quick else [100, 200])
+        results['list_dir'] = list_dir_latency(
+            file_system, counts, max(3, int(20 * scale)))
+    if 'transfer' in only or 'list_dir' in only:
+        file_system.del_dir(DIRECTORY)
+    if 'jitter' in only:
+        results['jitter'] = task_jitter(ev3_obj, 0.01, number)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Benchmarks of the EV3 communication')
+    parser.add_argument('--transport', default='emulator',
+                        choices=['emulator', 'loopback', 'usb', 'wifi'],
+                        help='emulator (tcp), loopback (in-process) '
+                        'or a real brick (default: emulator)')
+    parser.add_argument('--host',
+                        help='mac-address of the brick (usb, wifi)')
+    parser.add_argument('--port', type=int, default=5555,
+                        help='tcp port of the emulator (default: 5555)')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='latency of the emulator in ms')
+    parser.add_argument('--jitter', type=float, default=0,
+                        help='jitter of the emulator in ms')
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS,
+                        default=list(BENCHMARKS),
+                        help='run some of the benchmarks')
+    parser.add_argument('--quick', action='store_true',
+                        help='less repetitions and smaller files')
+    parser.add_argument('-o', '--output',
+                        help='JSON file of the results (default: stdout)')
+    args = parser.parse_args()
+
+    ev3_obj, emulator = connect(args)
+    try:
+        results = run(ev3_obj, args.only, args.quick)
+    finally:
+        if emulator:
+            emulator.stop()
+    document = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'revision': revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'transport': args.transport,
+            'latency_ms': args.latency,
+            'jitter_ms': args.jitter,
+            'quick': args.quick,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(document, file, indent=2)
+    else:
+        json.dump(document, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark of the host side cost to send a direct command via USB
+
+run from the repository's root directory:
+python3 -m benchmarks.usb_send
+"""
+
+import struct
+import timeit
+
+import ev3
+import ev3.utils
+from ev3.transport import HidTransport
+
+OPS = b''.join([
+    ev3.opOutput_Step_Sync,
+    ev3.utils.LCX(0),      # LAYER
+    ev3.utils.LCX(9),      # NOS
+    ev3.utils.LCX(50),     # SPEED
+    ev3.utils.LCX(-20),    # TURN
+    ev3.utils.LCX(0),      # STEPS
+    ev3.utils.LCX(0),      # BRAKE
+    ev3.opOutput_Start,
+    ev3.utils.LCX(0),      # LAYER
+    ev3.utils.LCX(9)       # NOS
+])
+
+
+class NullDevice:
+    """hid device, that converts the report like hidapi, but sends nothing"""
+
+    def write(self, buff) -> int:
+        return len(bytes(buff))
+
+
+def send_join_list(device, msg_cnt: int) -> None:
+    """the former way: join the frame, then build a list of ints"""
+    cmd = b''.join([
+        struct.pack('<HH', len(OPS) + 5, msg_cnt),
+        ev3.DIRECT_COMMAND_NO_REPLY,
+        struct.pack('<H', 0),
+        OPS
+    ])
+    device.write(list(cmd) + [0] * 100)
+
+
+def main(number: int = 100000) -> None:
+    device = NullDevice()
+    transport = HidTransport(device)
+    cases = [
+        ('join + list', lambda: send_join_list(device, 42)),
+        ('HidTransport', lambda: transport.send_direct(
+            OPS, 42, ev3.DIRECT_COMMAND_NO_REPLY, 0)),
+    ]
+    for name, func in cases:
+        best = min(timeit.repeat(func, number=number, repeat=5))
+        print('{:<13} {:8.3f} us per command'.format(
+            name, 1e6 * best / number))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,64 +1,85 @@
-import socket
+import collections
+import contextlib
+import numbers
 import struct
-import re
-import threading
+import typing
 import time
-import datetime
-import hid
 
 from . import (
     constants as const,
     error,
+    trace,
 )
+from .batch import Batch
+from .discovery import Beacon, Discovery  # noqa: F401
+from .receiver import ReplyStore
+from .reconnect import Outage, Reconnect
+from .rtt import RttEstimator
+from .sender import (
+    Credits,
+    frame_priority,
+    priority_of,
+    SUPERSEDED,
+    TIMED_OUT
+)
+from .session import Session
+from .metrics import Metrics
+from .template import CommandTemplate
+from .trace import TraceBuffer
+from .transport import (
+    Transport,
+    SocketTransport,
+    TcpTransport,
+    HidTransport,
+)
+from .transport import UnixTransport, LoopbackTransport  # noqa: F401
 
 from .constants import *  # noqa
 
+_COUNTER = struct.Struct('<H')
+
 
 class EV3:
     """Object to communicate with a LEGO EV3 using direct commands"""
 
-    _msg_cnt = 41
-    _lock = threading.Lock()
-    _foreign = {}
-
-    def __init__(self, protocol: str = None, host: str = None, ev3_obj=None):
+    def __init__(self, protocol: str = None, host: str = None, ev3_obj=None,
+                 transport: Transport = None):
         """Establish a connection to a LEGO EV3 device
 
-        Keyword Arguments (either protocol and host or ev3_obj):
+        Keyword Arguments (either protocol and host, ev3_obj or transport):
         protocol: None, 'Bluetooth', 'Usb' or 'Wifi'
         host: None or mac-address of the LEGO EV3 (f.i. '00:16:53:42:2B:99')
         ev3_obj: None or an existing EV3 object (its connections will be used)
+        transport: None or an established connection
+                   (f.i. LoopbackTransport, UnixTransport)
         """
-        assert ev3_obj or protocol, \
-            'Either protocol or ev3_obj needs to be given'
+        assert ev3_obj or protocol or transport, \
+            'Either protocol, ev3_obj or transport needs to be given'
         if ev3_obj:
             assert isinstance(ev3_obj, EV3), \
                 'ev3_obj needs to be instance of EV3'
-            self._protocol = ev3_obj._protocol
-            self._device = ev3_obj._device
-            self._socket = ev3_obj._socket
+            self._session = ev3_obj._session
         else:
-            assert protocol in [const.BLUETOOTH, const.WIFI, const.USB], \
-                'Protocol ' + protocol + 'is not valid'
-            self._protocol = protocol
-            self._device = None
-            self._socket = None
-            if protocol == const.BLUETOOTH:
-                assert host, 'protocol ' + protocol + ' needs argument host'
-                self._connect_bluetooth(host)
-            elif protocol == const.WIFI:
-                self._connect_wifi(host)
+            if transport:
+                assert isinstance(transport, Transport), \
+                    'transport needs to be instance of Transport'
             else:
-                self._connect_usb(host)
+                assert protocol in [const.BLUETOOTH, const.WIFI, const.USB], \
+                    'Protocol ' + protocol + 'is not valid'
+                if protocol == const.BLUETOOTH:
+                    assert host, \
+                        'protocol ' + protocol + ' needs argument host'
+                    transport = self._connect_bluetooth(host)
+                elif protocol == const.WIFI:
+                    transport = TcpTransport.open(host)
+                else:
+                    transport = HidTransport.open(host)
+            self._session = Session(transport)
+        self._protocol = self._session.protocol
         self._verbosity = 0
         self._sync_mode = const.STD
-
-    def __del__(self):
-        """
-        closes the connection to the LEGO EV3
-        """
-        if isinstance(self._socket, socket.socket):
-            self._socket.close()
+        self._timeout = None
+        self._idempotent = False
 
     @property
     def sync_mode(self) -> str:
@@ -104,89 +125,211 @@ class EV3:
             "allowed verbosity values are: 0, 1 or 2"
         self._verbosity = value
 
-    def _connect_bluetooth(self, host: str) -> int:
+    @property
+    def timeout(self) -> float:
+        """
+        default timeout of sends and waits in sec. (None: wait forever),
+        a call, that exceeds it, raises CmdTimeoutError
+        """
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, value: float):
+        assert value is None or isinstance(value, numbers.Number), \
+            "timeout needs to be a number"
+        assert value is None or value > 0, \
+            "timeout needs to be positive"
+        self._timeout = value
+
+    @property
+    def idempotent(self) -> bool:
+        """
+        flag, that the commands of this object may be executed twice
+        (f.i. reading sensors or absolute movements). After a reconnect,
+        they are sent again, while others raise ConnectionLostError.
+        Use EV3(ev3_obj=...) for an object with another flag.
+        """
+        return self._idempotent
+
+    @idempotent.setter
+    def idempotent(self, value: bool):
+        assert isinstance(value, bool), \
+            "idempotent needs to be of type bool"
+        self._idempotent = value
+
+    @property
+    def reconnect(self) -> Reconnect:
+        """
+        policy of the connection after a break (None: the connection
+        dies, which is the default). The session, its counters and
+        parked replies survive a reconnect, f.i.
+
+          ev3_obj.reconnect = ev3.Reconnect(attempts=20, delay=0.05)
+        """
+        return self._session.reconnect
+
+    @reconnect.setter
+    def reconnect(self, value: Reconnect):
+        assert value is None or isinstance(value, Reconnect), \
+            "reconnect needs to be of type Reconnect"
+        self._session.reconnect = value
+
+    @property
+    def credits(self) -> Credits:
+        """
+        flow control of the direct commands without reply
+        (None: no limit, which is the default). Commands wait,
+        while the brick's queue is full, f.i. for teleop:
+
+          ev3_obj.credits = ev3.Credits(target=0.05)
+        """
+        return self._session.credits
+
+    @credits.setter
+    def credits(self, value: Credits):
+        assert value is None or isinstance(value, Credits), \
+            "credits needs to be of type Credits"
+        self._session.credits = value
+
+    @property
+    def rtt(self) -> RttEstimator:
+        """
+        live estimate of the round trip time of the connection
+        (smoothed srtt, its deviation rttvar and rto), measured from
+        the replies, f.i. ev3_obj.rtt.srtt
+        """
+        return self._session.rtt
+
+    @property
+    def outages(self) -> typing.List[Outage]:
+        """
+        the last breaks of the connection with their durations
+        """
+        return self._session.receiver.outages
+
+    @property
+    def reply_store(self) -> ReplyStore:
+        """
+        replies, that arrived before anybody waited for them
+        (shared by all EV3 objects of the same connection).
+        Its capacity and max_age limit the memory, evicted and orphaned
+        count the replies, that were dropped uncollected.
+        """
+        return self._session.receiver.store
+
+    @property
+    def metrics(self) -> Metrics:
+        """
+        counters and latency histograms of the connection, split by
+        command type and opcode (None: no counting).
+        metrics.snapshot() returns a dict, metrics.prometheus() text
+        and metrics.serve(port) serves the text via http.
+        """
+        return self._session.metrics
+
+    @metrics.setter
+    def metrics(self, value: Metrics):
+        assert value is None or isinstance(value, Metrics), \
+            "metrics needs to be of type Metrics"
+        self._session.metrics = value
+
+    @property
+    def trace(self) -> TraceBuffer:
+        """
+        ring buffer, that records the raw frames of the connection with
+        their timestamps (None: no recording). Unlike verbosity, it doesn't
+        format anything while sending, trace.dump() renders the frames.
+        """
+        return self._session.trace
+
+    @trace.setter
+    def trace(self, value: TraceBuffer):
+        assert value is None or isinstance(value, TraceBuffer), \
+            "trace needs to be of type TraceBuffer"
+        self._session.trace = value
+
+    @contextlib.contextmanager
+    def batch(self) -> typing.Iterator[Batch]:
+        """Collect operations and send them as few direct commands
+
+        While the batch is active, send_direct_cmd of all EV3 objects, that
+        share this connection, queues operations without reply (and returns
+        None). A command with reply and send_system_cmd flush the queue
+        first, in the same direct command, if it fits.
+        Leaving the block flushes the rest (unless an exception occurred).
+        Nested blocks join the outer batch.
+
+        Returns:
+        the batch, its add method queues operations with global memory
+        and returns a handle, that gets their slice of the reply
+
+          with ev3_obj.batch() as batch:
+              jukebox.change_color(ev3.LED_RED)
+              vehicle.stop()
+              pos = batch.add(
+                  lambda offset: b''.join([
+                      ev3.opInput_Device,
+                      ev3.GET_RAW,
+                      ev3.utils.LCX(0),    # LAYER
+                      ev3.utils.LCX(1),    # NO
+                      ev3.utils.GVX(offset)
+                  ]),
+                  global_mem=4
+              )
+          print(struct.unpack('<i', pos.data)[0])
+        """
+        local = self._session.local
+        outer = getattr(local, 'batch', None)
+        if outer is not None:
+            yield outer
+            return
+        local.batch = Batch(self)
+        try:
+            yield local.batch
+        except BaseException:
+            local.batch = None
+            raise
+        batch = local.batch
+        local.batch = None
+        batch.flush()
+
+    def _connect_bluetooth(self, host: str) -> SocketTransport:
         """
         Create a socket, that holds a bluetooth-connection to an EV3
         """
-        # self._socket = bluetooth.BluetoothSocket(bluetooth.RFCOMM)
-        # self._socket.bind((host, 0))
+        # sock = bluetooth.BluetoothSocket(bluetooth.RFCOMM)
+        # sock.bind((host, 0))
         raise NotImplementedError("Bluetooth isn't yet implemented")
 
-    def _connect_wifi(self, host: str) -> int:
-        """
-        Create a socket, that holds a wifi-connection to an EV3
-        """
-
-        # listen on port 3015 for a UDP broadcast from the EV3
-        UDPSock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        UDPSock.bind(('', 3015))
-        data, addr = UDPSock.recvfrom(67)
-
-        # pick serial number, port, name and protocol
-        # from the broadcast message
-        matcher = re.search(r'Serial-Number: (\w*)\s\n'
-                            + r'Port: (\d{4,4})\s\n'
-                            + r'Name: (\w+)\s\n'
-                            + r'Protocol: (\w+)\s\n',
-                            data.decode('utf-8'))
-        serial_number = matcher.group(1)
-        port = matcher.group(2)
-        name = matcher.group(3)
-        protocol = matcher.group(4)
-
-        # test if correct mac-addr
-        if host and serial_number.upper() != host.replace(':', '').upper():
-            self._socket = None
-            raise ValueError('found ev3 but not ' + host)
-
-        # Send an UDP message back to the EV3
-        # to make it accept a TCP/IP connection
-        UDPSock.sendto(' '.encode('utf-8'), (addr[0], int(port)))
-        UDPSock.close()
-
-        # Establish a TCP/IP connection with EV3s address and port
-        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self._socket.connect((addr[0], int(port)))
-
-        # Send an unlock message to the EV3 over TCP/IP
-        msg = 'GET /target?sn=' + serial_number + 'VMTP1.0\n' + \
-              'Protocol: ' + protocol
-        self._socket.send(msg.encode('utf-8'))
-        reply = self._socket.recv(16).decode('utf-8')
-        if not reply.startswith('Accept:EV340'):
-            raise RuntimeError('No wifi connection to ' + name
-                               + ' established')
-
-    def _connect_usb(self, host: str) -> int:
-        """Create a device, that holds an usb-connection to an EV3"""
-        ev3_devices = [h for h in hid.enumerate()
-                       if h['vendor_id'] == const.ID_VENDOR_LEGO]
-
-        found_host = None
-        for dev in ev3_devices:
-            if found_host:
-                raise ValueError('found multiple ev3 but no argument'
-                                 'host was set')
-            if host:
-                mac_addr = dev['serial_number']
-                if mac_addr.upper() == host.replace(':', '').upper():
-                    found_host = dev
-                    break
-            else:
-                found_host = dev
-        if not found_host:
-            raise RuntimeError("Lego EV3 not found")
-
-        self._device = hid.device()
-        self._device.open(const.ID_VENDOR_LEGO, const.ID_PRODUCT_EV3,
-                          found_host['serial_number'])
+    def _next_counter(self) -> int:
+        """
+        returns the next message counter (range [1 - 65535])
+        """
+        return self._session.next_counter()
 
-        # initial read
-        self._device.set_nonblocking(1)
-        self._device.read(1024)
+    def _deadline(self, timeout: float) -> float:
+        """
+        absolute deadline of a call (None: no deadline)
+        """
+        if timeout is None:
+            timeout = self._timeout
+        if timeout is None:
+            return None
+        return time.monotonic() + timeout
+
+    @staticmethod
+    def _remaining(deadline: float) -> float:
+        """
+        seconds until deadline (None: no deadline)
+        """
+        if deadline is None:
+            return None
+        return max(0, deadline - time.monotonic())
 
     def send_direct_cmd(self, ops: bytes, local_mem: int = 0,
-                        global_mem: int = 0) -> bytes:
+                        global_mem: int = 0, timeout: float = None,
+                        priority: str = None,
+                        mailbox: typing.Hashable = None) -> bytes:
         """Send a direct command to the LEGO EV3
 
         Arguments:
@@ -200,119 +343,299 @@ class EV3:
         Keyword Arguments:
         local_mem: size of the local memory
         global_mem: size of the global memory
+        timeout: maximum seconds for sending and waiting for the reply
+                 (None: the connection's default timeout)
+        priority: HIGH (written before all waiting commands) or NORMAL
+                  (None: HIGH, if ops start with opOutput_Stop)
+        mailbox: key (f.i. the output ports), a newer command with the
+                 same key replaces this one, while it waits for its turn
 
         Returns:
           sync_mode is STD: reply (if global_mem > 0) or message counter
           sync_mode is ASYNC: message counter
           sync_mode is SYNC: reply of the LEGO EV3
+          inside of batch: reply or None (operations without reply)
+          superseded by a newer command of the mailbox: None
         """
+        assert priority in (None, const.HIGH, const.NORMAL), \
+            "priority needs to be HIGH or NORMAL"
+        batch = getattr(self._session.local, 'batch', None)
+        if batch is not None:
+            return batch.send_direct_cmd(ops, local_mem, global_mem)
         if global_mem > 0 or self._sync_mode == const.SYNC:
             cmd_type = const.DIRECT_COMMAND_REPLY
         else:
             cmd_type = const.DIRECT_COMMAND_NO_REPLY
-        self._lock.acquire()
-        if self._msg_cnt < 65535:
-            self._msg_cnt += 1
+        deadline = self._deadline(timeout)
+        counter = self._send_direct(ops, cmd_type, local_mem, global_mem,
+                                    deadline, priority, mailbox)
+        if counter is None:
+            return None
+        if (cmd_type == const.DIRECT_COMMAND_NO_REPLY
+                or self._sync_mode == const.ASYNC):
+            return counter
+        else:
+            return self.wait_for_reply(counter, self._remaining(deadline))
+
+    def send_many(self, ops_list: list, local_mem: int = 0,
+                  global_mem: int = 0, window: int = 8,
+                  timeout: float = None) -> list:
+        """Send direct commands back to back and collect their replies later
+
+        All commands are sent as DIRECT_COMMAND_REPLY. Up to window of them
+        are in flight, the next one is sent, when the reply of the oldest
+        one has been collected. This keeps the EV3's command queue busy
+        instead of paying a full round trip per command.
+
+        Arguments:
+        ops_list: list of operations (netto data, as in send_direct_cmd)
+
+        Keyword Arguments:
+        local_mem: size of the local memory of each command
+        global_mem: size of the global memory of each command
+        window: maximum number of commands in flight
+        timeout: maximum seconds for all of them
+                 (None: the connection's default timeout)
+
+        Returns:
+        list of replies, in the order of ops_list
+        """
+        assert isinstance(window, int), \
+            "window needs to be of type int"
+        assert window > 0, \
+            "window needs to be positive"
+        replies = []
+        pending = collections.deque()
+        first_exc = None
+        deadline = self._deadline(timeout)
+        try:
+            for ops in ops_list:
+                if len(pending) >= window:
+                    try:
+                        replies.append(self.wait_for_reply(
+                            pending.popleft(), self._remaining(deadline)))
+                    except error.DirCmdError as exc:
+                        replies.append(None)
+                        first_exc = first_exc or exc
+                pending.append(self._send_direct(
+                    ops, const.DIRECT_COMMAND_REPLY, local_mem, global_mem,
+                    deadline))
+            while pending:
+                try:
+                    replies.append(self.wait_for_reply(
+                        pending.popleft(), self._remaining(deadline)))
+                except error.DirCmdError as exc:
+                    replies.append(None)
+                    first_exc = first_exc or exc
+        finally:
+            for counter in pending:
+                self._session.receiver.cancel(counter)
+        if first_exc:
+            raise first_exc
+        return replies
+
+    def send_template(self, template: CommandTemplate,
+                      timeout: float = None, priority: str = None,
+                      mailbox: typing.Hashable = None, **values) -> bytes:
+        """Send a direct command, that was compiled as a CommandTemplate
+
+        Only the parameters, the counter and the type are patched into
+        the template's frame, no operations are encoded.
+
+        Arguments:
+        template: the compiled operations
+
+        Keyword Arguments:
+        timeout: maximum seconds for sending and waiting for the reply
+                 (None: the connection's default timeout)
+        priority: as in send_direct_cmd
+        mailbox: key, as in send_direct_cmd
+        values: the template's parameters
+
+        Returns:
+          as send_direct_cmd
+        """
+        assert priority in (None, const.HIGH, const.NORMAL), \
+            "priority needs to be HIGH or NORMAL"
+        if self._verbosity >= 1 or \
+           getattr(self._session.local, 'batch', None) is not None:
+            return self.send_direct_cmd(template.ops(**values),
+                                        local_mem=template.local_mem,
+                                        global_mem=template.global_mem,
+                                        timeout=timeout,
+                                        priority=priority,
+                                        mailbox=mailbox)
+        if template.global_mem > 0 or self._sync_mode == const.SYNC:
+            cmd_type = const.DIRECT_COMMAND_REPLY
+        else:
+            cmd_type = const.DIRECT_COMMAND_NO_REPLY
+        deadline = self._deadline(timeout)
+        msg_cnt = self._next_counter()
+        cmd = template.frame(msg_cnt, cmd_type, values)
+        if not self._send(cmd, cmd_type == const.DIRECT_COMMAND_REPLY,
+                          deadline, priority, mailbox):
+            return None
+        counter = _COUNTER.pack(msg_cnt)
+        if (cmd_type == const.DIRECT_COMMAND_NO_REPLY
+                or self._sync_mode == const.ASYNC):
+            return counter
         else:
-            self._msg_cnt = 1
-        msg_cnt = self._msg_cnt
-        self._lock.release()
+            return self.wait_for_reply(counter, self._remaining(deadline))
+
+    def _send_direct(self, ops: bytes, cmd_type: bytes, local_mem: int,
+                     global_mem: int, deadline: float = None,
+                     priority: str = None,
+                     mailbox: typing.Hashable = None) -> bytes:
+        """
+        write a direct command and return its message counter
+        (the transport adds the header, via usb it is patched into the report),
+        None, if it was superseded by a newer command of its mailbox
+        """
+        if priority is None:
+            priority = priority_of(ops)
+        if self._verbosity >= 1 or self._replayable():
+            cmd = self._direct_cmd(ops, cmd_type, local_mem, global_mem)
+            if not self._send(cmd, cmd_type == const.DIRECT_COMMAND_REPLY,
+                              deadline, priority, mailbox):
+                return None
+            return cmd[2:4]
+        msg_cnt = self._next_counter()
+        counter = _COUNTER.pack(msg_cnt)
+        if not self._transmit(
+                counter, cmd_type == const.DIRECT_COMMAND_REPLY, deadline,
+                self._session.transport.send_direct,
+                ops, msg_cnt, cmd_type, local_mem * 1024 + global_mem,
+                priority=priority,
+                counted=cmd_type == const.DIRECT_COMMAND_NO_REPLY,
+                mailbox=mailbox
+        ):
+            return None
+        return counter
+
+    def _replayable(self) -> bool:
+        """
+        flag, if commands are kept as bytes to send them again
+        after a reconnect
+        """
+        return self._idempotent and self._session.reconnect is not None
+
+    def _transmit(self, counter: bytes, expect_reply: bool, deadline: float,
+                  write: typing.Callable, *args, replay: bytes = None,
+                  priority: str = const.NORMAL, counted: bool = False,
+                  mailbox: typing.Hashable = None) -> bool:
+        """
+        register the waiter of a reply, wait until the connection is
+        writable and for the turn of the priority,
+        then write the command with write(*args)
+        (counted: direct command without reply, that needs a credit).
+        Returns False, if a newer command of the mailbox superseded it.
+        If the write fails and the connection is reestablished,
+        a command without reply is written again, if it is idempotent
+        (with reply, the receiver sends it again or fails it)
+        """
+        transport = self._session.transport
+        receiver = self._session.receiver
+        sender = self._session.sender
+        if expect_reply:
+            receiver.expect(counter, replay=replay)
+        try:
+            if deadline is not None and \
+               not transport.wait_writable(self._remaining(deadline)):
+                if self._session.metrics is not None:
+                    self._session.metrics.timeout()
+                raise error.CmdTimeoutError('connection to EV3 not writable')
+            generation = receiver.generation
+            try:
+                result = sender.write(priority, write, *args,
+                                      timeout=self._remaining(deadline),
+                                      counted=counted, mailbox=mailbox)
+                if result == TIMED_OUT:
+                    if self._session.metrics is not None:
+                        self._session.metrics.timeout()
+                    raise error.CmdTimeoutError(
+                        'no turn to write within the timeout')
+                if result == SUPERSEDED:
+                    if expect_reply:
+                        receiver.cancel(counter)
+                    return False
+                if expect_reply:
+                    receiver.sent(counter)
+            except OSError:
+                if not receiver.wait_reconnected(generation,
+                                                 self._remaining(deadline)):
+                    raise
+                if expect_reply:
+                    return True
+                if not self._idempotent:
+                    raise error.ConnectionLostError(
+                        'connection to EV3 broke while writing')
+                sender.write(priority, write, *args, counted=counted)
+        except Exception:
+            if expect_reply:
+                receiver.cancel(counter)
+            raise
+        return True
+
+    def _direct_cmd(self, ops: bytes, cmd_type: bytes, local_mem: int,
+                    global_mem: int) -> bytes:
+        """
+        add length, counter, type and header to the operations
+        """
+        msg_cnt = self._next_counter()
         cmd = b''.join([
-            struct.pack('<hh', len(ops) + 5, msg_cnt),
+            struct.pack('<HH', len(ops) + 5, msg_cnt),
             cmd_type,
-            struct.pack('<h', local_mem * 1024 + global_mem),
+            struct.pack('<H', local_mem * 1024 + global_mem),
             ops
         ])
         if self._verbosity >= 1:
-            now = datetime.datetime.now().strftime('%H:%M:%S.%f')
-            print(now
-                  + ' Sent 0x|'
-                  + ':'.join('{:02X}'.format(byte) for byte in cmd[0:2]) + '|'
-                  + ':'.join('{:02X}'.format(byte) for byte in cmd[2:4]) + '|'
-                  + ':'.join('{:02X}'.format(byte) for byte in cmd[4:5]) + '|'
-                  + ':'.join('{:02X}'.format(byte) for byte in cmd[5:7]) + '|'
-                  + ':'.join('{:02X}'.format(byte) for byte in cmd[7:]) + '|')
-        if self._protocol in [const.BLUETOOTH, const.WIFI]:
-            self._socket.send(cmd)
-        elif self._protocol is const.USB:
-            self._device.write(list(cmd) + [0] * 100)
-        else:
-            raise RuntimeError('No EV3 connected')
-        counter = cmd[2:4]
-        if (cmd[4:5] == const.DIRECT_COMMAND_NO_REPLY
-            or self._sync_mode == const.ASYNC):
-            return counter
-        else:
-            return self.wait_for_reply(counter)
+            print(trace.render(trace.SENT, cmd))
+        return cmd
 
-    def wait_for_reply(self, counter: bytes) -> bytes:
+    def _send(self, cmd: bytes, expect_reply: bool,
+              deadline: float = None, priority: str = None,
+              mailbox: typing.Hashable = None) -> bool:
+        """
+        write a command to the LEGO EV3,
+        if it has a reply, its waiter is registered before
+        (priority None: HIGH, if it starts with opOutput_Stop),
+        returns False, if a newer command of the mailbox superseded it
+        """
+        counted = cmd[4] == const.DIRECT_COMMAND_NO_REPLY[0]
+        return self._transmit(bytes(cmd[2:4]), expect_reply, deadline,
+                              self._session.transport.send, cmd,
+                              replay=cmd if self._replayable() else None,
+                              priority=priority or frame_priority(cmd),
+                              counted=counted, mailbox=mailbox)
+
+    def wait_for_reply(self, counter: bytes, timeout: float = None) -> bytes:
         """Ask the LEGO EV3 for a reply and wait until it is received
 
         Arguments:
         counter: is the message counter of the corresponding send_direct_cmd
 
+        Keyword Arguments:
+        timeout: maximum seconds to wait
+                 (None: the connection's default timeout)
+
         Returns:
         reply to the direct command
         """
-        self._lock.acquire()
-        reply = self._get_foreign_reply(counter)
-        if reply:
-            self._lock.release()
-            if reply[4:5] != const.DIRECT_REPLY:
-                raise error.DirCmdError(
-                    "direct command {:02X}:{:02X} replied error".format(
-                        reply[2],
-                        reply[3]
-                    )
+        reply = self._session.receiver.wait(
+            counter, self._remaining(self._deadline(timeout)))
+        if self._verbosity >= 1:
+            print(trace.render(trace.RECV, reply))
+        if reply[4:5] != const.DIRECT_REPLY:
+            raise error.DirCmdError(
+                "direct command {:02X}:{:02X} replied error".format(
+                    reply[2],
+                    reply[3]
                 )
-            return reply
-        loop_counter = 0
-        while True:
-            if self._protocol in [const.BLUETOOTH, const.WIFI]:
-                reply = self._socket.recv(1024)
-            else:
-                reply = bytes(self._device.read(1024))
-            try:
-                len_data = struct.unpack('<H', reply[:2])[0] + 2
-            except struct.error:
-                time.sleep(0.01)
-                loop_counter += 1
-                if loop_counter > 100:
-                    raise Exception("More than %d loops with no response" % loop_counter)
-                continue
-
-
-            reply_counter = reply[2:4]
-            if self._verbosity >= 1:
-                now = datetime.datetime.now().strftime('%H:%M:%S.%f')
-                print(now
-                      + ' Recv 0x|'
-                      + ':'.join('{:02X}'.format(byte) for byte in reply[0:2])
-                      + '|'
-                      + ':'.join('{:02X}'.format(byte) for byte in reply[2:4])
-                      + '|'
-                      + ':'.join('{:02X}'.format(byte) for byte in reply[4:5])
-                      + '|', end='')
-                if len_data > 5:
-                    dat = ':'.join('{:02X}'.format(byte)
-                                   for byte in reply[5:len_data])
-                    print(dat + '|')
-                else:
-                    print()
-            if counter != reply_counter:
-                self._put_foreign_reply(reply_counter, reply[:len_data])
-            else:
-                self._lock.release()
-                if reply[4:5] != const.DIRECT_REPLY:
-                    raise error.DirCmdError(
-                        "direct command {:02X}:{:02X} replied error".format(
-                            reply[2],
-                            reply[3]
-                        )
-                    )
-                return reply[:len_data]
-
-    def send_system_cmd(self, cmd: bytes, reply: bool = True) -> bytes:
+            )
+        return reply
+
+    def send_system_cmd(self, cmd: bytes, reply: bool = True,
+                        timeout: float = None) -> bytes:
         """Send a system command to the LEGO EV3
 
         Arguments:
@@ -324,119 +647,81 @@ class EV3:
 
         Keyword Arguments:
         reply: flag if with reply
+        timeout: maximum seconds for sending and waiting for the reply
+                 (None: the connection's default timeout)
 
         Returns:
           reply (in case of SYSTEM_COMMAND_NO_REPLY: counter)
         """
+        batch = getattr(self._session.local, 'batch', None)
+        if batch is not None:
+            batch.flush()
         if reply:
             cmd_type = const.SYSTEM_COMMAND_REPLY
         else:
             cmd_type = const.SYSTEM_COMMAND_NO_REPLY
-        self._lock.acquire()
-        if self._msg_cnt < 65535:
-            self._msg_cnt += 1
+        deadline = self._deadline(timeout)
+        counter = self._send_system(cmd, cmd_type, deadline)
+        if not reply:
+            return counter
         else:
-            self._msg_cnt = 1
-        msg_cnt = self._msg_cnt
-        self._lock.release()
+            reply = self._wait_for_system_reply(counter,
+                                                self._remaining(deadline))
+            return reply
+
+    def _send_system(self, cmd: bytes, cmd_type: bytes,
+                     deadline: float = None) -> bytes:
+        """
+        write a system command and return its message counter
+        (the transport adds the header, via usb it is patched into the report)
+        """
+        if self._verbosity >= 1 or self._replayable():
+            cmd = self._system_cmd(cmd, cmd_type)
+            self._send(cmd, cmd_type == const.SYSTEM_COMMAND_REPLY, deadline)
+            return cmd[2:4]
+        msg_cnt = self._next_counter()
+        counter = _COUNTER.pack(msg_cnt)
+        self._transmit(counter, cmd_type == const.SYSTEM_COMMAND_REPLY,
+                       deadline, self._session.transport.send_system,
+                       cmd, msg_cnt, cmd_type)
+        return counter
+
+    def _system_cmd(self, cmd: bytes, cmd_type: bytes) -> bytes:
+        """
+        add length, counter and type to a system command
+        """
+        msg_cnt = self._next_counter()
         cmd = b''.join([
-            struct.pack('<hh', len(cmd) + 3, msg_cnt),
+            struct.pack('<HH', len(cmd) + 3, msg_cnt),
             cmd_type,
             cmd
         ])
         if self._verbosity >= 1:
-            now = datetime.datetime.now().strftime('%H:%M:%S.%f')
-            print(now
-                  + ' Sent 0x|'
-                  + ':'.join('{:02X}'.format(byte) for byte in cmd[0:2]) + '|'
-                  + ':'.join('{:02X}'.format(byte) for byte in cmd[2:4]) + '|'
-                  + ':'.join('{:02X}'.format(byte) for byte in cmd[4:5]) + '|'
-                  + ':'.join('{:02X}'.format(byte) for byte in cmd[5:]) + '|')
-        if self._protocol in [const.BLUETOOTH, const.WIFI]:
-            self._socket.send(cmd)
-        elif self._protocol is const.USB:
-            self._device.write(list(cmd) + [0] * 100)
-        else:
-            raise RuntimeError('No EV3 connected')
-        counter = cmd[2:4]
-        if not reply:
-            return counter
-        else:
-            reply = self._wait_for_system_reply(counter)
-            return reply
+            print(trace.render(trace.SENT, cmd))
+        return cmd
 
-    def _wait_for_system_reply(self, counter: bytes) -> bytes:
+    def _wait_for_system_reply(self, counter: bytes,
+                               timeout: float = None) -> bytes:
         """Ask the LEGO EV3 for a system command reply and wait until received
 
         Arguments:
         counter: is the message counter of the corresponding send_system_cmd
 
+        Keyword Arguments:
+        timeout: maximum seconds to wait
+                 (None: the connection's default timeout)
+
         Returns:
         reply to the system command
         """
-        self._lock.acquire()
-        reply = self._get_foreign_reply(counter)
-        if reply:
-            self._lock.release()
-            if reply[4:5] != const.SYSTEM_REPLY:
-                raise error.SysCmdError("error: {:02X}".format(reply[6]))
-            return reply
-        if self._protocol == const.BLUETOOTH:
-            time.sleep(0.1)
-        while True:
-            if self._protocol in [const.BLUETOOTH, const.WIFI]:
-                reply = self._socket.recv(1024)
-            else:
-                reply = bytes(self._device.read(1024))
-            len_data = struct.unpack('<H', reply[:2])[0] + 2
-            reply_counter = reply[2:4]
-            if self._verbosity >= 1:
-                now = datetime.datetime.now().strftime('%H:%M:%S.%f')
-                print(now
-                      + ' Recv 0x|'
-                      + ':'.join('{:02X}'.format(byte) for byte in reply[0:2])
-                      + '|'
-                      + ':'.join('{:02X}'.format(byte) for byte in reply[2:4])
-                      + '|'
-                      + ':'.join('{:02X}'.format(byte) for byte in reply[4:5])
-                      + '|'
-                      + ':'.join('{:02X}'.format(byte) for byte in reply[5:6])
-                      + '|'
-                      + ':'.join('{:02X}'.format(byte) for byte in reply[6:7])
-                      + '|', end='')
-                if len_data > 7:
-                    dat = ':'.join('{:02X}'.format(byte)
-                                   for byte in reply[7:len_data])
-                    print(dat + '|')
-                else:
-                    print()
-            if counter != reply_counter:
-                self._put_foreign_reply(reply_counter, reply[:len_data])
-            else:
-                self._lock.release()
-                if reply[4:5] != const.SYSTEM_REPLY:
-                    raise error.SysCmdError("system command replied "
-                                            "error: {:02X}".format(reply[6]))
-                return reply[:len_data]
-
-    def _put_foreign_reply(self, counter: bytes, reply: bytes) -> None:
-        """
-        put a foreign reply to the stack
-        """
-        if counter in self._foreign:
-            raise ValueError('reply with counter ' + str(counter)
-                             + ' already exists')
-        else:
-            self._foreign[counter] = reply
+        reply = self._session.receiver.wait(
+            counter, self._remaining(self._deadline(timeout)))
+        if self._verbosity >= 1:
+            print(trace.render(trace.RECV, reply))
+        if reply[4:5] != const.SYSTEM_REPLY:
+            raise error.SysCmdError("system command replied "
+                                    "error: {:02X}".format(reply[6]))
+        return reply
 
-    def _get_foreign_reply(self, counter: bytes) -> bytes:
-        """
-        get a reply from the stack (returns None if there is no)
-        and delete this reply from the stack
-        """
-        if counter in self._foreign:
-            reply = self._foreign[counter]
-            del self._foreign[counter]
-            return reply
 
-        return None
+from .aio import AsyncEV3  # noqa: E402,F401
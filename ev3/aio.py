@@ -0,0 +1,249 @@
+"""Asyncio client for the EV3, replies are resolved by message counter."""
+
+import asyncio
+import struct
+
+from . import (
+    constants as const,
+    error,
+    trace,
+    EV3,
+)
+
+
+class AsyncEV3:
+    """Object to communicate with a LEGO EV3 from an asyncio event loop
+
+    Every reply-expecting command registers a future, keyed by its 2-byte
+    message counter, before it is written. The receiver of the connection
+    resolves the future, whose counter matches the reply, so any number
+    of commands may be in flight at the same time. The commands are
+    written from the loop's default executor, the write may block
+    (turn of the Sender, credits, a slow connection).
+    """
+
+    def __init__(self, protocol: str = None, host: str = None, ev3_obj=None,
+                 transport=None):
+        """Establish a connection to a LEGO EV3 device
+
+        Keyword Arguments (either protocol and host, ev3_obj or transport):
+        protocol: None, 'Bluetooth', 'Usb' or 'Wifi'
+        host: None or mac-address of the LEGO EV3 (f.i. '00:16:53:42:2B:99')
+        ev3_obj: None or an existing EV3 object (its connections will be used)
+        transport: None or an established connection (ev3.Transport)
+        """
+        if ev3_obj is None:
+            ev3_obj = EV3(protocol=protocol, host=host, transport=transport)
+        assert isinstance(ev3_obj, EV3), \
+            'ev3_obj needs to be instance of EV3'
+        self._ev3 = ev3_obj
+        self._futures = {}
+        self._verbosity = 0
+        self._sync_mode = const.STD
+
+    @property
+    def sync_mode(self) -> str:
+        """
+        sync mode (standard, asynchronous, synchronous)
+
+        STD:   Use DIRECT_COMMAND_REPLY if global_mem > 0,
+               await reply if there is one.
+        ASYNC: Use DIRECT_COMMAND_REPLY if global_mem > 0,
+               never await reply (use wait_for_reply with the counter).
+        SYNC:  Always use DIRECT_COMMAND_REPLY and await reply.
+        """
+        return self._sync_mode
+
+    @sync_mode.setter
+    def sync_mode(self, value: str):
+        assert isinstance(value, str), \
+            "sync_mode needs to be of type str"
+        assert value in [const.STD, const.SYNC, const.ASYNC], \
+            "value of sync_mode: " + value + " is invalid"
+        self._sync_mode = value
+
+    @property
+    def verbosity(self) -> int:
+        """
+        level of verbosity (prints on stdout).
+        """
+        return self._verbosity
+
+    @verbosity.setter
+    def verbosity(self, value: int):
+        assert isinstance(value, int), \
+            "verbosity needs to be of type int"
+        assert value >= 0 and value <= 2, \
+            "allowed verbosity values are: 0, 1 or 2"
+        self._verbosity = value
+
+    async def close(self) -> None:
+        """
+        cancels all pending futures
+        """
+        for counter, future in self._futures.items():
+            self._ev3._session.receiver.cancel(counter)
+            future.cancel()
+        self._futures.clear()
+
+    def _resolve(self, future: asyncio.Future, reply: bytes,
+                 exc: Exception) -> None:
+        """
+        resolve a future with the reply (runs inside the event loop)
+        """
+        if future.done():
+            return
+        if exc:
+            future.set_exception(exc)
+            return
+        if self._verbosity >= 1:
+            print(trace.render(trace.RECV, reply))
+        future.set_result(reply)
+
+    async def _send(self, cmd: bytes, expect_reply: bool) -> bytes:
+        """
+        write a command, register its future before, if a reply is expected
+        """
+        counter = cmd[2:4]
+        loop = asyncio.get_running_loop()
+        receiver = self._ev3._session.receiver
+        if expect_reply:
+            future = loop.create_future()
+
+            def callback(reply: bytes, exc: Exception) -> None:
+                try:
+                    loop.call_soon_threadsafe(self._resolve, future, reply,
+                                              exc)
+                except RuntimeError:
+                    # the loop is closed, nobody awaits the reply
+                    receiver.store.orphan()
+                    if receiver.metrics is not None:
+                        receiver.metrics.orphaned()
+
+            self._futures[counter] = future
+            receiver.expect(counter, callback=callback)
+        if self._verbosity >= 1:
+            print(trace.render(trace.SENT, cmd))
+        try:
+            # waits for its turn, a credit and the connection,
+            # the event loop doesn't
+            await loop.run_in_executor(None, self._ev3._send, cmd, False)
+            if expect_reply:
+                # its round trip starts now
+                receiver.sent(counter)
+        except Exception:
+            receiver.cancel(counter)
+            self._futures.pop(counter, None)
+            raise
+        return counter
+
+    async def send_direct_cmd(self, ops: bytes, local_mem: int = 0,
+                              global_mem: int = 0,
+                              timeout: float = None) -> bytes:
+        """Send a direct command to the LEGO EV3
+
+        Arguments:
+        ops: holds netto data only (operations), the fields length, counter,
+             type and header are added (see EV3.send_direct_cmd)
+
+        Keyword Arguments:
+        local_mem: size of the local memory
+        global_mem: size of the global memory
+        timeout: maximum seconds to await the reply (None: forever)
+
+        Returns:
+          sync_mode is STD: reply (if global_mem > 0) or message counter
+          sync_mode is ASYNC: message counter
+          sync_mode is SYNC: reply of the LEGO EV3
+        """
+        if global_mem > 0 or self._sync_mode == const.SYNC:
+            cmd_type = const.DIRECT_COMMAND_REPLY
+        else:
+            cmd_type = const.DIRECT_COMMAND_NO_REPLY
+        cmd = b''.join([
+            struct.pack('<HH', len(ops) + 5, self._ev3._next_counter()),
+            cmd_type,
+            struct.pack('<H', local_mem * 1024 + global_mem),
+            ops
+        ])
+        counter = await self._send(
+            cmd, cmd_type == const.DIRECT_COMMAND_REPLY)
+        if (cmd_type == const.DIRECT_COMMAND_NO_REPLY
+                or self._sync_mode == const.ASYNC):
+            return counter
+        return await self.wait_for_reply(counter, timeout)
+
+    async def wait_for_reply(self, counter: bytes,
+                             timeout: float = None) -> bytes:
+        """Await the reply of a direct command
+
+        Arguments:
+        counter: is the message counter of the corresponding send_direct_cmd
+
+        Keyword Arguments:
+        timeout: maximum seconds to await the reply (None: forever)
+
+        Returns:
+        reply to the direct command
+        """
+        reply = await self._collect(counter, timeout)
+        if reply[4:5] != const.DIRECT_REPLY:
+            raise error.DirCmdError(
+                "direct command {:02X}:{:02X} replied error".format(
+                    reply[2],
+                    reply[3]
+                )
+            )
+        return reply
+
+    async def send_system_cmd(self, cmd: bytes, reply: bool = True,
+                              timeout: float = None) -> bytes:
+        """Send a system command to the LEGO EV3
+
+        Arguments:
+        cmd: holds netto data only (cmd and arguments), the fields length,
+             counter and type are added (see EV3.send_system_cmd)
+
+        Keyword Arguments:
+        reply: flag if with reply
+        timeout: maximum seconds to await the reply (None: forever)
+
+        Returns:
+          reply (in case of SYSTEM_COMMAND_NO_REPLY: counter)
+        """
+        if reply:
+            cmd_type = const.SYSTEM_COMMAND_REPLY
+        else:
+            cmd_type = const.SYSTEM_COMMAND_NO_REPLY
+        cmd = b''.join([
+            struct.pack('<HH', len(cmd) + 3, self._ev3._next_counter()),
+            cmd_type,
+            cmd
+        ])
+        counter = await self._send(cmd, reply)
+        if not reply:
+            return counter
+        reply = await self._collect(counter, timeout)
+        if reply[4:5] != const.SYSTEM_REPLY:
+            raise error.SysCmdError("system command replied "
+                                    "error: {:02X}".format(reply[6]))
+        return reply
+
+    async def _collect(self, counter: bytes, timeout: float) -> bytes:
+        """
+        await the reply of a counter and forget its future
+        (raises KeyError if no reply is expected)
+        """
+        if counter not in self._futures:
+            raise KeyError('no reply expected for counter ' + str(counter))
+        try:
+            return await asyncio.wait_for(self._futures[counter], timeout)
+        except asyncio.TimeoutError:
+            if self._ev3._session.metrics is not None:
+                self._ev3._session.metrics.timeout(counter)
+            self._ev3._session.receiver.cancel(counter)
+            raise error.CmdTimeoutError(
+                'no reply for counter {:02X}:{:02X} within {:.3f} sec.'
+                .format(counter[0], counter[1], timeout))
+        finally:
+            self._futures.pop(counter, None)
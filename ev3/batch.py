@@ -0,0 +1,256 @@
+"""Module for coalescing many small operations into few direct commands."""
+
+import struct
+import typing
+
+from . import (
+    constants as const,
+    error,
+)
+
+
+def _align(offset: int) -> int:
+    """
+    next multiple of 4 (global memory of a value starts aligned)
+    """
+    return (offset + 3) & ~3
+
+
+class BatchReply:
+    """
+    Handle of an operation, that was added to a batch.
+    After the flush, it holds its slice of the global memory.
+    """
+
+    __slots__ = ('_ops', '_global_mem', '_local_mem', '_data', '_head',
+                 '_exc', '_done')
+
+    def __init__(self, ops: typing.Union[bytes, typing.Callable],
+                 global_mem: int, local_mem: int):
+        self._ops = ops
+        self._global_mem = global_mem
+        self._local_mem = local_mem
+        self._data = None
+        self._head = None
+        self._exc = None
+        self._done = False
+
+    @property
+    def done(self) -> bool:
+        """
+        flag, that the batch was flushed and this operation was executed
+        """
+        return self._done
+
+    @property
+    def data(self) -> bytes:
+        """
+        the operation's slice of the global memory (raises, if its direct
+        command replied an error, or if the batch wasn't flushed yet)
+        """
+        if self._exc:
+            raise self._exc
+        assert self._done, 'batch is not yet flushed'
+        return self._data
+
+    def _build(self, offset: int) -> bytes:
+        """
+        the operations, with global memory starting at offset
+        """
+        if callable(self._ops):
+            return self._ops(offset)
+        return self._ops
+
+
+class Batch:
+    """
+    Collects operations and flushes them as the fewest direct commands,
+    that fit the protocol's size limits.
+
+    Operations with global memory are added as callables, that get
+    the offset of their global memory and return the operations
+    (f.i. lambda offset: b''.join([..., ev3.GVX(offset)])).
+    Their replies are split, each BatchReply gets its slice.
+    """
+
+    def __init__(self, ev3_obj):
+        """Create an empty batch
+
+        Arguments:
+        ev3_obj: EV3 object, that sends the direct commands
+        """
+        self._ev3 = ev3_obj
+        self._items = []
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def add(self, ops: typing.Union[bytes, typing.Callable],
+            global_mem: int = 0, local_mem: int = 0) -> BatchReply:
+        """Add operations to the batch
+
+        Arguments:
+        ops: operations (bytes) without global memory or a callable,
+             that gets the offset of its global memory and returns them
+
+        Keyword Arguments:
+        global_mem: size of the global memory of the operations
+        local_mem: size of the local memory of the operations
+
+        Returns:
+        handle, that holds the slice of the reply after the flush
+        """
+        assert isinstance(ops, bytes) or callable(ops), \
+            "ops needs to be bytes or a callable"
+        assert global_mem == 0 or callable(ops), \
+            "operations with global memory need to be a callable"
+        assert 0 <= global_mem <= const.MAX_GLOBAL_MEM, \
+            "global_mem needs to be in range [0 - {}]".format(
+                const.MAX_GLOBAL_MEM)
+        assert 0 <= local_mem <= const.MAX_LOCAL_MEM, \
+            "local_mem needs to be in range [0 - {}]".format(
+                const.MAX_LOCAL_MEM)
+        item = BatchReply(ops, global_mem, local_mem)
+        self._items.append(item)
+        return item
+
+    def flush(self) -> None:
+        """
+        send all collected operations and distribute the replies
+        """
+        items = self._items
+        self._items = []
+        self._execute(self._pack(items))
+
+    def send_direct_cmd(self, ops: bytes, local_mem: int,
+                        global_mem: int) -> bytes:
+        """
+        a direct command, that was sent while the batch is active:
+        operations without reply are collected (returns None),
+        operations with reply are sent after the collected ones,
+        their global memory starts at offset 0, as they were written
+        (returns the reply)
+        """
+        if global_mem == 0 and self._ev3.sync_mode != const.SYNC:
+            self.add(ops, local_mem=local_mem)
+            return None
+        if self._ev3.sync_mode == const.ASYNC:
+            # the caller collects the reply by its counter
+            self.flush()
+            return self._ev3._send_direct(ops, const.DIRECT_COMMAND_REPLY,
+                                          local_mem, global_mem)
+        items = self._items
+        self._items = []
+        chunks = self._pack(items)
+        last = chunks.pop() if chunks else []
+        # executed last, but its global memory starts at offset 0,
+        # the one of the collected operations follows it
+        own = (BatchReply(lambda offset: ops, global_mem, local_mem),
+               0, ops)
+        chunk = self._place(last, _align(global_mem))
+        if chunk is None or not self._fits(chunk + [own]):
+            chunks.append(last)
+            chunk = []
+            if not self._fits([own]):
+                raise ValueError('operations exceed the size limits '
+                                 'of a direct command')
+        chunks.append(chunk + [own])
+        self._execute(chunks, force_reply=True)
+        reply = own[0].data
+        return b''.join([
+            struct.pack('<H', len(reply) + 3),
+            own[0]._head,
+            reply
+        ])
+
+    def _pack(self, items: list) -> list:
+        """
+        split items into chunks, each fits into one direct command,
+        every entry of a chunk is (item, offset, ops)
+        """
+        chunks = []
+        chunk = []
+        for item in items:
+            placed = self._place(chunk + [(item, None, None)], 0)
+            if placed is None:
+                if chunk:
+                    chunks.append(chunk)
+                chunk = self._place([(item, None, None)], 0)
+                if chunk is None:
+                    raise ValueError('operations exceed the size limits '
+                                     'of a direct command')
+            else:
+                chunk = placed
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    @staticmethod
+    def _place(chunk: list, start: int) -> list:
+        """
+        assign global memory to the items of a chunk, beginning at start,
+        returns None if they don't fit into one direct command
+        """
+        placed = []
+        offset = start
+        size = 0
+        for item, _, _ in chunk:
+            if item._global_mem:
+                offset = _align(offset)
+            ops = item._build(offset)
+            size += len(ops)
+            placed.append((item, offset, ops))
+            offset += item._global_mem
+        if size > const.MAX_OPS_SIZE or offset > const.MAX_GLOBAL_MEM:
+            return None
+        return placed
+
+    @staticmethod
+    def _fits(chunk: list) -> bool:
+        """
+        flag, if the placed items of a chunk fit into one direct command
+        """
+        size = sum([len(ops) for _, _, ops in chunk])
+        end = max([offset + item._global_mem for item, offset, _ in chunk])
+        return size <= const.MAX_OPS_SIZE and end <= const.MAX_GLOBAL_MEM
+
+    def _execute(self, chunks: list, force_reply: bool = False) -> None:
+        """
+        send one direct command per chunk and collect the replies
+        """
+        sync = self._ev3.sync_mode == const.SYNC
+        pending = []
+        for num, chunk in enumerate(chunks):
+            global_mem = max([offset + item._global_mem
+                              for item, offset, _ in chunk])
+            local_mem = max([item._local_mem for item, _, _ in chunk])
+            with_reply = global_mem > 0 or sync or \
+                (force_reply and num == len(chunks) - 1)
+            if with_reply:
+                cmd_type = const.DIRECT_COMMAND_REPLY
+            else:
+                cmd_type = const.DIRECT_COMMAND_NO_REPLY
+            counter = self._ev3._send_direct(
+                b''.join([ops for _, _, ops in chunk]),
+                cmd_type, local_mem, global_mem)
+            if with_reply:
+                pending.append((counter, chunk))
+            else:
+                for item, _, _ in chunk:
+                    item._done = True
+        first_exc = None
+        for counter, chunk in pending:
+            try:
+                reply = self._ev3.wait_for_reply(counter)
+            except error.DirCmdError as exc:
+                first_exc = first_exc or exc
+                for item, _, _ in chunk:
+                    item._exc = exc
+                    item._done = True
+                continue
+            for item, offset, _ in chunk:
+                item._data = reply[5 + offset:5 + offset + item._global_mem]
+                item._head = reply[2:5]
+                item._done = True
+        if first_exc:
+            raise first_exc
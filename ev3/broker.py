@@ -0,0 +1,279 @@
+"""
+Module for sharing one connection to an EV3 between processes.
+
+The broker owns the connection (only one process can open the USB device,
+a WiFi brick accepts one TCP client) and serves it via a unix domain
+socket. Each client is a normal EV3 object:
+
+  ev3_obj = ev3.EV3(transport=ev3.UnixTransport('/tmp/ev3.sock'))
+
+The message counters of the clients are replaced by the broker's own
+ones and the replies get back the counters of their clients. Frames are
+patched in place in the receive buffers and passed on without copies.
+
+start the broker:
+python3 -m ev3.broker --protocol Usb --path /tmp/ev3.sock
+"""
+
+import argparse
+import os
+import socket
+import stat
+import struct
+import threading
+import typing
+
+from . import constants as const
+from .framing import FrameReader
+from .sender import Sender, frame_priority
+from .transport import (
+    Transport,
+    SocketTransport,
+    TcpTransport,
+    HidTransport,
+    LoopbackTransport
+)
+
+PATH = '/tmp/ev3.sock'
+
+_COUNTER = struct.Struct('<H')
+_REPLY_TYPES = (const.DIRECT_COMMAND_REPLY[0], const.SYSTEM_COMMAND_REPLY[0])
+
+
+class Broker:
+    """
+    Serves one connection to an EV3 to multiple clients via
+    a unix domain socket
+    """
+
+    def __init__(self, transport: Transport, path: str = PATH):
+        """Create a broker (call start or serve_forever)
+
+        Arguments:
+        transport: the connection to the EV3, the broker owns it
+
+        Keyword Arguments:
+        path: file name of the unix domain socket
+        """
+        assert isinstance(transport, Transport), \
+            "transport needs to be instance of Transport"
+        assert isinstance(path, str), \
+            "path needs to be of type str"
+        self._transport = transport
+        self._path = path
+        self._lock = threading.Lock()
+        self._routes = {}   # broker's counter -> (client, client's counter)
+        self._counter = 0
+        self._clients = set()
+        self._sender = Sender()  # stop commands of all clients first
+        self._server = None
+        self._threads = []
+        self._stopped = threading.Event()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    @property
+    def path(self) -> str:
+        """
+        file name of the unix domain socket
+        """
+        return self._path
+
+    @property
+    def clients(self) -> int:
+        """
+        number of connected clients
+        """
+        with self._lock:
+            return len(self._clients)
+
+    @property
+    def pending(self) -> int:
+        """
+        number of commands, that wait for their replies
+        """
+        with self._lock:
+            return len(self._routes)
+
+    def start(self) -> 'Broker':
+        """
+        listen for clients and forward the replies (in daemon threads)
+        """
+        if os.path.exists(self._path) and \
+           stat.S_ISSOCK(os.stat(self._path).st_mode):
+            os.unlink(self._path)  # left by a broker, that died
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(self._path)
+        self._server.listen()
+        self._spawn(self._accept)
+        self._spawn(self._forward_replies)
+        return self
+
+    def stop(self) -> None:
+        """
+        disconnect all clients, close the connection to the EV3
+        and remove the socket file
+        """
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        if self._server:
+            SocketTransport._shutdown(self._server)
+        with self._lock:
+            clients = list(self._clients)
+        for client in clients:
+            client.close()
+        self._transport.close()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(1)
+        if os.path.exists(self._path):
+            os.unlink(self._path)
+
+    def serve_forever(self) -> None:
+        """
+        start and block until interrupted or the EV3 is lost
+        """
+        self.start()
+        try:
+            self._stopped.wait()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def _spawn(self, target: typing.Callable, *args) -> None:
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _accept(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            client = SocketTransport(conn, protocol=const.UNIX)
+            with self._lock:
+                self._clients.add(client)
+            self._spawn(self._forward_commands, client)
+
+    def _forward_commands(self, client: SocketTransport) -> None:
+        """
+        read the commands of a client, replace their counters
+        and send them to the EV3
+        """
+        frames = FrameReader(client.recv_into)
+        try:
+            while True:
+                for frame in frames.read():
+                    if len(frame) < 5:
+                        continue
+                    counter = self._route(client, frame)
+                    _COUNTER.pack_into(frame, 2, counter)
+                    try:
+                        self._sender.write(frame_priority(frame),
+                                           self._transport.send, frame)
+                    except Exception:
+                        self._unroute(counter)
+                        raise
+        except Exception:  # pylint: disable=broad-except
+            pass
+        finally:
+            with self._lock:
+                self._clients.discard(client)
+                for counter in [
+                        counter
+                        for counter, (owner, _) in self._routes.items()
+                        if owner is client
+                ]:
+                    del self._routes[counter]
+            client.close()
+
+    def _forward_replies(self) -> None:
+        """
+        read the replies of the EV3 and send them to their clients
+        (with their original counters)
+        """
+        frames = FrameReader(self._transport.recv_into,
+                             datagram=self._transport.datagram)
+        try:
+            while True:
+                for frame in frames.read():
+                    counter = _COUNTER.unpack_from(frame, 2)[0]
+                    with self._lock:
+                        route = self._routes.pop(counter, None)
+                    if route is None:
+                        continue
+                    client, client_counter = route
+                    frame[2:4] = client_counter
+                    try:
+                        client.send(frame)
+                    except OSError:
+                        pass  # the client is gone
+        except Exception:  # pylint: disable=broad-except
+            if not self._stopped.is_set():
+                # the EV3 is lost, the clients get ConnectionErrors
+                self.stop()
+
+    def _route(self, client: SocketTransport, frame: memoryview) -> int:
+        """
+        the broker's counter of a command (its reply is routed back,
+        if the command has one)
+        """
+        with self._lock:
+            while True:
+                self._counter = self._counter % 65535 + 1
+                if self._counter not in self._routes:
+                    break
+            if frame[4] in _REPLY_TYPES:
+                self._routes[self._counter] = (client, bytes(frame[2:4]))
+            return self._counter
+
+    def _unroute(self, counter: int) -> None:
+        with self._lock:
+            self._routes.pop(counter, None)
+
+
+def open_transport(protocol: str, host: str = None) -> Transport:
+    """Connect to an EV3
+
+    Arguments:
+    protocol: 'Usb', 'Wifi' or 'Loopback' (the emulator in this process)
+
+    Keyword Arguments:
+    host: mac-address of the EV3 (None: the first one)
+    """
+    if protocol == const.USB:
+        return HidTransport.open(host)
+    if protocol == const.WIFI:
+        return TcpTransport.open(host)
+    if protocol == const.LOOPBACK:
+        # pylint: disable=import-outside-toplevel
+        from .emulator import Emulator
+        return LoopbackTransport(Emulator().handle)
+    raise ValueError('protocol ' + protocol + ' is not supported')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Share the connection to an EV3 between processes')
+    parser.add_argument('--protocol', default=const.USB,
+                        choices=[const.USB, const.WIFI, const.LOOPBACK],
+                        help='connection to the EV3 (default: Usb)')
+    parser.add_argument('--host',
+                        help='mac-address of the EV3 (default: the first)')
+    parser.add_argument('--path', default=PATH,
+                        help='unix domain socket (default: ' + PATH + ')')
+    args = parser.parse_args()
+
+    Broker(open_transport(args.protocol, args.host),
+           path=args.path).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,11 +3,16 @@
 WIFI      = 'Wifi'
 BLUETOOTH = 'Bluetooth'
 USB       = 'Usb'
+LOOPBACK  = 'Loopback'          # in-process, no brick
+UNIX      = 'Unix'              # unix domain socket
 
 STD       = 'STD'               # reply if global_mem, wait for reply
 ASYNC     = 'ASYNC'             # reply if global_mem, never wait for reply
 SYNC      = 'SYNC'              # always with reply, always wait for reply
 
+HIGH      = 'HIGH'              # priority: written before waiting commands
+NORMAL    = 'NORMAL'            # priority: in the order of arrival
+
 ID_VENDOR_LEGO = 0x0694         # Usb-Identification of the device
 ID_PRODUCT_EV3 = 0x0005
 
@@ -17,6 +22,11 @@ EP_OUT = 0x01
 DIRECT_COMMAND_REPLY     = b'\x00'
 DIRECT_COMMAND_NO_REPLY  = b'\x80'
 
+MAX_CMD_SIZE    = 1024          # size limits of commands (bytes)
+MAX_OPS_SIZE    = 1017          # operations of a direct command
+MAX_GLOBAL_MEM  = 1019          # global memory of a direct command
+MAX_LOCAL_MEM   = 63            # local memory of a direct command
+
 DIRECT_REPLY             = b'\x02'
 DIRECT_REPLY_ERROR       = b'\x04'
 
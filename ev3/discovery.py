@@ -0,0 +1,285 @@
+"""
+Module for discovering EV3 bricks, that are connected via WiFi.
+
+A Discovery listens continuously for the UDP beacons, the bricks broadcast
+every few seconds, and keeps them in a cache, that forgets bricks,
+which stopped sending. Connections start immediately from the cache,
+f.i. (the first call waits for the beacon, the second one not):
+
+  ev3_1 = ev3.EV3(protocol=ev3.WIFI, host='00:16:53:42:2B:99')
+  ev3_2 = ev3.EV3(protocol=ev3.WIFI, host='00:16:53:50:1C:04')
+
+The port is opened with SO_REUSEADDR (and SO_REUSEPORT), so multiple
+processes can listen at the same time (broadcasts reach all of them,
+unicast beacons, f.i. of the emulator, only one).
+
+list the visible bricks:
+python3 -m ev3.discovery --duration 6
+"""
+
+import argparse
+import collections
+import re
+import socket
+import threading
+import time
+import typing
+
+PORT = 3015
+
+Beacon = collections.namedtuple('Beacon', [
+    'serial_number',    # f.i. '0016535D7E2D'
+    'address',          # ip address of the EV3
+    'port',             # tcp port of the EV3
+    'name',             # name of the EV3
+    'protocol',         # protocol of the unlock message
+    'seen',             # time of the last beacon (time.monotonic())
+])
+
+_BEACON = re.compile(r'Serial-Number: (\w*)\s\n'
+                     + r'Port: (\d{4,4})\s\n'
+                     + r'Name: (\w+)\s\n'
+                     + r'Protocol: (\w+)\s\n')
+
+
+def parse(data: bytes, address: str, seen: float = None) -> Beacon:
+    """Read a beacon
+
+    Arguments:
+    data: the UDP message
+    address: ip address of its sender
+
+    Keyword Arguments:
+    seen: time of receiving (default: now)
+
+    Returns:
+    the beacon or None, if data is no beacon
+    """
+    matcher = _BEACON.search(data.decode('utf-8', 'replace'))
+    if not matcher:
+        return None
+    return Beacon(
+        matcher.group(1).upper(),
+        address,
+        int(matcher.group(2)),
+        matcher.group(3),
+        matcher.group(4),
+        time.monotonic() if seen is None else seen
+    )
+
+
+def _serial(host: str) -> str:
+    """
+    serial number of a mac-address
+    """
+    return host.replace(':', '').upper()
+
+
+class Discovery:
+    """
+    Listens for the beacons of EV3 bricks in a daemon thread and
+    caches serial number -> Beacon. Bricks without a beacon for ttl
+    seconds are forgotten.
+    """
+
+    def __init__(self, port: int = PORT, ttl: float = 15.0):
+        """Create a listener (call start)
+
+        Keyword Arguments:
+        port: UDP port of the beacons
+        ttl: seconds, a brick stays in the cache after its last beacon
+        """
+        assert isinstance(port, int), \
+            "port needs to be of type int"
+        assert isinstance(ttl, (int, float)), \
+            "ttl needs to be a number"
+        assert ttl > 0, \
+            "ttl needs to be positive"
+        self._port = port
+        self._ttl = ttl
+        self._cache = collections.OrderedDict()
+        self._cond = threading.Condition()
+        self._sock = None
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    @property
+    def port(self) -> int:
+        """
+        UDP port of the beacons
+        """
+        return self._port
+
+    @property
+    def ttl(self) -> float:
+        """
+        seconds, a brick stays in the cache after its last beacon
+        """
+        return self._ttl
+
+    @property
+    def running(self) -> bool:
+        """
+        flag, if the listener is running
+        """
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> 'Discovery':
+        """
+        open the port and listen (in a daemon thread)
+        """
+        if self.running:
+            return self
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, 'SO_REUSEPORT'):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(('', self._port))
+        sock.settimeout(0.5)
+        self._sock = sock
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._listen, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """
+        stop listening and close the port
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def bricks(self) -> typing.List[Beacon]:
+        """
+        the visible bricks, in the order of their first beacon
+        """
+        with self._cond:
+            self._expire()
+            return list(self._cache.values())
+
+    def get(self, host: str = None) -> Beacon:
+        """Read the cache, without waiting
+
+        Keyword Arguments:
+        host: mac-address of the EV3 (None: any one)
+
+        Returns:
+        the beacon or None, if the brick is not visible
+        """
+        with self._cond:
+            return self._lookup(host)
+
+    def find(self, host: str = None, timeout: float = None) -> Beacon:
+        """Get a brick from the cache or wait for its beacon
+
+        Keyword Arguments:
+        host: mac-address of the EV3 (None: the first one, that is visible)
+        timeout: maximum seconds to wait (None: forever)
+
+        Returns:
+        the beacon (raises TimeoutError, if the brick is not visible)
+        """
+        assert self.running, 'Discovery needs to be started'
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._lookup(host), timeout):
+                raise TimeoutError(
+                    'no beacon of ' + (host or 'an EV3') + ' within '
+                    + str(timeout) + ' sec.'
+                )
+            return self._lookup(host)
+
+    def wake(self, beacon: Beacon) -> None:
+        """
+        answer a beacon, this makes the EV3 accept a tcp connection
+        """
+        sock = self._sock
+        if sock is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.sendto(b' ', (beacon.address, beacon.port))
+        finally:
+            if sock is not self._sock:
+                sock.close()
+
+    def _lookup(self, host: str) -> Beacon:
+        """
+        a beacon of the cache (the caller holds the lock)
+        """
+        self._expire()
+        if host is None:
+            return next(iter(self._cache.values()), None)
+        return self._cache.get(_serial(host))
+
+    def _expire(self) -> None:
+        """
+        forget bricks, that stopped sending (the caller holds the lock)
+        """
+        limit = time.monotonic() - self._ttl
+        for serial_number in [
+                key for key, beacon in self._cache.items()
+                if beacon.seen < limit
+        ]:
+            del self._cache[serial_number]
+
+    def _listen(self) -> None:
+        sock = self._sock
+        while not self._stopped.is_set():
+            try:
+                data, addr = sock.recvfrom(1024)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            beacon = parse(data, addr[0])
+            if beacon is None:
+                continue
+            with self._cond:
+                self._cache[beacon.serial_number] = beacon
+                self._cond.notify_all()
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared() -> Discovery:
+    """
+    the started Discovery of this process, all connections use it
+    """
+    global _shared  # pylint: disable=global-statement
+    with _shared_lock:
+        if _shared is None:
+            _shared = Discovery().start()
+        return _shared
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='List the EV3 bricks, that send beacons')
+    parser.add_argument('--port', type=int, default=PORT,
+                        help='UDP port of the beacons (default: 3015)')
+    parser.add_argument('--duration', type=float, default=6,
+                        help='seconds to listen (default: 6)')
+    args = parser.parse_args()
+
+    with Discovery(port=args.port) as discovery:
+        time.sleep(args.duration)
+        for beacon in discovery.bricks():
+            print('{}  {}:{}  {}  {}'.format(
+                beacon.serial_number, beacon.address, beacon.port,
+                beacon.name, beacon.protocol))
+
+
+if __name__ == "__main__":
+    main()
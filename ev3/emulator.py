@@ -0,0 +1,1039 @@
+#!/usr/bin/env python3
+"""
+Emulator of an EV3, that is connected via WiFi
+
+It sends the UDP beacon, accepts the unlock message and answers direct
+and system commands over TCP, so EV3 objects (protocol WIFI) connect to
+it as to a real brick. It knows a subset of the operations: motors with
+simulated tacho counts, opInput_Device, LEDs, sound and some file
+operations. The file system lives in a temporary directory.
+
+run from the repository's root directory:
+python3 -m ev3.emulator --beacon 127.0.0.1 --latency 15 --jitter 5
+"""
+
+import argparse
+import hashlib
+import os
+import posixpath
+import queue
+import random
+import re
+import shutil
+import socket
+import struct
+import tempfile
+import threading
+import time
+import typing
+
+from . import constants as const
+
+_LENGTH = struct.Struct('<H')
+_UNLOCK = re.compile(rb'GET /target\?sn=(\w+)VMTP1\.0\nProtocol: \w')
+
+DEG_PER_SEC = 10.0          # motor speed in degree per sec. and percent
+SOUND_DURATION = 1.0        # duration of a sound file (sec.)
+BATTERY_VOLTAGE = 7.5       # answer of GET_VBATT
+SYS_DIR = '/home/root/lms2012/sys/'  # base of relative paths
+
+
+class _OpError(Exception):
+    """an operation failed, the direct command replies an error"""
+
+
+class _Motor:
+    """
+    State of one motor, its tacho count is integrated from the speed
+    """
+
+    def __init__(self):
+        self.tacho = 0.0
+        self.speed = 0
+        self.polarity = 1
+        self.running = False
+        self.steps = None       # degrees left to move (None: unlimited)
+        self.until = None       # end of a timed movement (monotonic)
+        self.last = time.monotonic()
+
+    def advance(self, now: float) -> None:
+        """
+        move from the last update until now
+        """
+        if self.running and self.speed:
+            end = now if self.until is None else min(now, self.until)
+            delta = abs(self.speed) * DEG_PER_SEC * max(0.0, end - self.last)
+            if self.steps is not None and delta >= self.steps:
+                delta = self.steps
+                self.running = False
+            elif self.steps is not None:
+                self.steps -= delta
+            if self.until is not None and now >= self.until:
+                self.running = False
+            sign = 1 if self.speed > 0 else -1
+            self.tacho += sign * self.polarity * delta
+        self.last = now
+
+    def start(self, speed: int, now: float, steps: float = None,
+              duration: float = None) -> None:
+        """
+        start a movement (limited by steps in degree or duration in sec.)
+        """
+        self.advance(now)
+        self.speed = speed
+        self.running = True
+        self.steps = abs(steps) if steps else None
+        self.until = now + duration if duration else None
+
+    def stop(self, now: float) -> None:
+        self.advance(now)
+        self.running = False
+
+    @property
+    def busy(self) -> bool:
+        return self.running and bool(self.speed)
+
+
+class Brick:
+    """
+    Simulated state of the brick, shared by all connections
+    """
+
+    def __init__(self, root: str):
+        """Create a brick
+
+        Arguments:
+        root: directory, that holds the brick's file system
+        """
+        self.root = root
+        self.lock = threading.RLock()
+        self.motors = [_Motor() for _ in range(4)]
+        self.led = const.LED_GREEN[0]
+        self.sound = None           # (kind, frequency or name)
+        self.sound_until = None     # None: sound plays forever
+        for name in ('sys', 'prjs', 'apps', 'tools'):
+            os.makedirs(self.path('/home/root/lms2012/' + name),
+                        exist_ok=True)
+
+    def path(self, name: str) -> str:
+        """
+        local path of a file of the brick (relative names start at SYS_DIR)
+        """
+        if not name.startswith('/'):
+            name = SYS_DIR + name
+        name = posixpath.normpath(name)
+        return os.path.join(self.root, name.lstrip('/'))
+
+    def ports(self, nos: int) -> typing.List[_Motor]:
+        """
+        motors of a bitmask of output ports (PORT_A | PORT_B ...)
+        """
+        return [motor for num, motor in enumerate(self.motors)
+                if nos & (1 << num)]
+
+    def motor(self, num: int) -> _Motor:
+        """
+        motor of a port number, output (0 - 3) or input (16 - 19)
+        """
+        if 16 <= num <= 19:
+            num -= 16
+        if not 0 <= num <= 3:
+            raise _OpError('no motor at port {}'.format(num))
+        motor = self.motors[num]
+        motor.advance(time.monotonic())
+        return motor
+
+    @property
+    def sound_busy(self) -> bool:
+        if self.sound is None:
+            return False
+        if self.sound_until is not None and \
+           time.monotonic() >= self.sound_until:
+            self.sound = None
+        return self.sound is not None
+
+
+class _Execution:
+    """
+    Operations of one direct command and their memory
+    """
+
+    def __init__(self, ops: bytes, local_mem: int, global_mem: int):
+        self.ops = ops
+        self.pos = 0
+        self.memory = {
+            False: bytearray(local_mem),
+            True: bytearray(global_mem),
+        }
+
+    def byte(self) -> int:
+        """
+        next byte of the operations (opcode or subcode)
+        """
+        if self.pos >= len(self.ops):
+            raise _OpError('operations end unexpectedly')
+        value = self.ops[self.pos]
+        self.pos += 1
+        return value
+
+    def _param(self) -> tuple:
+        """
+        decode a parameter, returns ('const', value)
+        or ('var', is_global, index)
+        """
+        first = self.byte()
+        if not first & 0x80:
+            # short format
+            if first & 0x40:
+                return 'var', bool(first & 0x20), first & 0x1F
+            value = first & 0x3F
+            return 'const', value - 64 if value & 0x20 else value
+        size = first & 0x07
+        if first & 0x40:
+            fmt = {1: '<B', 2: '<H', 3: '<I'}.get(size)
+            if fmt is None:
+                raise _OpError('unknown variable format')
+            index = struct.unpack_from(fmt, self.ops, self.pos)[0]
+            self.pos += struct.calcsize(fmt)
+            return 'var', bool(first & 0x20), index
+        if size == 4 or first == 0x80:
+            # zero terminated string
+            end = self.ops.index(b'\x00', self.pos)
+            value = self.ops[self.pos:end].decode('utf8', 'replace')
+            self.pos = end + 1
+            return 'const', value
+        fmt = {1: '<b', 2: '<h', 3: '<i'}.get(size)
+        if fmt is None:
+            raise _OpError('unknown constant format')
+        value = struct.unpack_from(fmt, self.ops, self.pos)[0]
+        self.pos += struct.calcsize(fmt)
+        return 'const', value
+
+    def arg(self, fmt: str = '<b'):
+        """
+        value of an input parameter (fmt: type of a variable)
+        """
+        param = self._param()
+        if param[0] == 'const':
+            return param[1]
+        _, is_global, index = param
+        memory = self.memory[is_global]
+        if fmt == 's':
+            end = memory.find(b'\x00', index)
+            return bytes(memory[index:end if end >= 0 else None]).decode(
+                'utf8', 'replace')
+        try:
+            return struct.unpack_from(fmt, memory, index)[0]
+        except struct.error:
+            raise _OpError('variable out of memory')
+
+    def out(self, fmt: str, value) -> None:
+        """
+        write an output parameter (fmt: its type, f.i. '<i')
+        """
+        param = self._param()
+        if param[0] != 'var':
+            raise _OpError('output parameter is no variable')
+        _, is_global, index = param
+        try:
+            struct.pack_into(fmt, self.memory[is_global], index, value)
+        except struct.error:
+            raise _OpError('variable out of memory')
+
+    def out_str(self, value: str, length: int) -> None:
+        """
+        write a zero terminated string of maximum length
+        """
+        param = self._param()
+        if param[0] != 'var':
+            raise _OpError('output parameter is no variable')
+        _, is_global, index = param
+        data = value.encode('utf8')[:max(0, length - 1)] + b'\x00'
+        memory = self.memory[is_global]
+        if index + len(data) > len(memory):
+            raise _OpError('variable out of memory')
+        memory[index:index + len(data)] = data
+
+
+def _cast(fmt: str, value):
+    """
+    convert a value to the type of fmt (as opMove does)
+    """
+    if fmt == '<f':
+        return float(value)
+    bits = struct.calcsize(fmt) * 8
+    value = int(value) & ((1 << bits) - 1)
+    return value - (1 << bits) if value >> (bits - 1) else value
+
+
+class Emulator:
+    """
+    Simulated EV3 behind a tcp port, with beacon and unlock handshake
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, host: str = '', port: int = 5555,
+                 serial_number: str = '0016535D7E2D', name: str = 'EV3',
+                 latency: float = 0.0, jitter: float = 0.0,
+                 root: str = None,
+                 beacon: tuple = ('255.255.255.255', 3015),
+                 beacon_interval: float = 5.0):
+        """Create an emulator (start it with start)
+
+        Keyword Arguments:
+        host: address of the tcp port
+        port: tcp port, 4 digits (as _connect_wifi expects)
+        serial_number: serial number (mac address without colons)
+        name: name of the brick (a word, no spaces)
+        latency: delay of each reply (sec.)
+        jitter: maximum additional random delay of a reply (sec.)
+        root: directory of the file system (default: temporary directory)
+        beacon: address, the UDP beacon is sent to (None: no beacon)
+        beacon_interval: seconds between two beacons
+        """
+        assert 1000 <= port <= 9999, \
+            "port needs to have 4 digits"
+        assert re.fullmatch(r'\w+', serial_number), \
+            "serial_number needs to be a word"
+        assert re.fullmatch(r'\w+', name), \
+            "name needs to be a word"
+        assert latency >= 0 and jitter >= 0, \
+            "latency and jitter need to be positive"
+        self._host = host
+        self._port = port
+        self._serial_number = serial_number.upper()
+        self._name = name
+        self._latency = latency
+        self._jitter = jitter
+        self._beacon = beacon
+        self._beacon_interval = beacon_interval
+        if root is None:
+            self._tempdir = tempfile.TemporaryDirectory(prefix='ev3-')
+            root = self._tempdir.name
+        else:
+            self._tempdir = None
+        self.brick = Brick(root)
+        self._handles = {}
+        self._stopped = threading.Event()
+        self._server = None
+        self._udp = None
+        self._threads = []
+        self._direct = {
+            const.opNop[0]: lambda ex: None,
+            const.opOutput_Reset[0]: self._output_reset,
+            const.opOutput_Stop[0]: self._output_stop,
+            const.opOutput_Power[0]: self._output_speed,
+            const.opOutput_Speed[0]: self._output_speed,
+            const.opOutput_Start[0]: self._output_start,
+            const.opOutput_Polarity[0]: self._output_polarity,
+            const.opOutput_Read[0]: self._output_read,
+            const.opOutput_Test[0]: self._output_test,
+            const.opOutput_Ready[0]: self._output_ready,
+            const.opOutput_Step_Power[0]: self._output_step,
+            const.opOutput_Step_Speed[0]: self._output_step,
+            const.opOutput_Time_Power[0]: self._output_time,
+            const.opOutput_Time_Speed[0]: self._output_time,
+            const.opOutput_Step_Sync[0]: self._output_step_sync,
+            const.opOutput_Time_Sync[0]: self._output_time_sync,
+            const.opOutput_Clr_Count[0]: self._output_clr_count,
+            const.opOutput_Get_Count[0]: self._output_get_count,
+            const.opInput_Device[0]: self._input_device,
+            const.opUI_Write[0]: self._ui_write,
+            const.opUI_Read[0]: self._ui_read,
+            const.opSound[0]: self._sound,
+            const.opSound_Test[0]: self._sound_test,
+            const.opSound_Ready[0]: self._sound_ready,
+            const.opFile[0]: self._file,
+        }
+        for src in ('8', '16', '32', 'F'):
+            for dst in ('8', '16', '32', 'F'):
+                opcode = getattr(const, 'opMove{}_{}'.format(
+                    src if src != 'F' else 'f', dst))[0]
+                self._direct[opcode] = self._move_op(src, dst)
+        self._system = {
+            const.BEGIN_DOWNLOAD[0]: self._begin_download,
+            const.CONTINUE_DOWNLOAD[0]: self._continue_download,
+            const.BEGIN_UPLOAD[0]: self._begin_upload,
+            const.CONTINUE_UPLOAD[0]: self._continue_upload,
+            const.LIST_FILES[0]: self._list_files,
+            const.CONTINUE_LIST_FILES[0]: self._continue_upload,
+            const.CLOSE_FILEHANDLE[0]: self._close_filehandle,
+            const.CREATE_DIR[0]: self._create_dir,
+            const.DELETE_FILE[0]: self._delete_file,
+        }
+    # pylint: enable=too-many-arguments
+
+    @property
+    def address(self) -> tuple:
+        """
+        address of the tcp port (host, port)
+        """
+        return (self._host or '127.0.0.1', self._port)
+
+    @property
+    def root(self) -> str:
+        """
+        directory, that holds the brick's file system
+        """
+        return self.brick.root
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self) -> 'Emulator':
+        """
+        listen for connections and send beacons (in daemon threads)
+        """
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((self._host, self._port))
+        self._server.listen()
+        self._spawn(self._accept)
+        if self._beacon:
+            self._udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._udp.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            # receives the answer to the beacon
+            self._udp.bind((self._host, self._port))
+            self._spawn(self._send_beacons)
+        return self
+
+    def stop(self) -> None:
+        """
+        close all sockets and remove the temporary directory
+        """
+        self._stopped.set()
+        for sock in (self._server, self._udp):
+            if sock:
+                sock.close()
+        for thread in self._threads:
+            thread.join(1)
+        if self._tempdir:
+            self._tempdir.cleanup()
+
+    def serve_forever(self) -> None:
+        """
+        start and block until interrupted
+        """
+        self.start()
+        try:
+            self._stopped.wait()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def _spawn(self, target: typing.Callable, *args) -> None:
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _send_beacons(self) -> None:
+        msg = ('Serial-Number: {}\r\nPort: {}\r\nName: {}\r\n'
+               'Protocol: EV3\r\n').format(
+                   self._serial_number, self._port, self._name).encode()
+        while not self._stopped.is_set():
+            try:
+                self._udp.sendto(msg, self._beacon)
+            except OSError:
+                pass
+            self._stopped.wait(self._beacon_interval)
+
+    def _accept(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._spawn(self._serve, conn)
+
+    def _unlock(self, conn: socket.socket) -> bool:
+        """
+        read the unlock message and accept it, if the serial number fits
+        """
+        data = b''
+        conn.settimeout(5)
+        while not _UNLOCK.search(data):
+            part = conn.recv(1024)
+            if not part:
+                return False
+            data += part
+        # the client waits for the answer, all of it belongs to the message
+        conn.settimeout(0.05)
+        try:
+            while True:
+                part = conn.recv(1024)
+                if not part:
+                    return False
+        except socket.timeout:
+            pass
+        conn.settimeout(None)
+        if _UNLOCK.search(data).group(1).decode().upper() != \
+           self._serial_number:
+            return False
+        conn.sendall(b'Accept:EV340\r\n\r\n')
+        return True
+
+    def _serve(self, conn: socket.socket) -> None:
+        """
+        answer the commands of one connection, replies are delayed by
+        latency and jitter, but keep their order
+        """
+        replies = queue.Queue()
+        self._spawn(self._write_replies, conn, replies)
+        try:
+            if not self._unlock(conn):
+                return
+            buf = b''
+            last_due = 0.0
+            while not self._stopped.is_set():
+                part = conn.recv(4096)
+                if not part:
+                    return
+                buf += part
+                while len(buf) >= 2:
+                    size = _LENGTH.unpack_from(buf)[0] + 2
+                    if len(buf) < size:
+                        break
+                    frame, buf = buf[:size], buf[size:]
+                    reply = self.handle(frame)
+                    if reply is None:
+                        continue
+                    due = time.monotonic() + self._latency + \
+                        random.uniform(0, self._jitter)
+                    last_due = max(due, last_due)
+                    replies.put((last_due, reply))
+        except OSError:
+            pass
+        finally:
+            replies.put(None)
+
+    def _write_replies(self, conn: socket.socket,
+                       replies: queue.Queue) -> None:
+        try:
+            while True:
+                item = replies.get()
+                if item is None:
+                    return
+                due, reply = item
+                delay = due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                conn.sendall(reply)
+        except OSError:
+            pass
+        finally:
+            conn.close()
+
+    def handle(self, frame: bytes) -> bytes:
+        """
+        execute a command, returns its reply (None: no reply),
+        LoopbackTransport(handler=emulator.handle) uses it without sockets
+        """
+        if len(frame) < 5:
+            return None
+        counter = frame[2:4]
+        cmd_type = frame[4]
+        if cmd_type in (const.DIRECT_COMMAND_REPLY[0],
+                        const.DIRECT_COMMAND_NO_REPLY[0]):
+            if len(frame) < 7:
+                return None
+            mem = _LENGTH.unpack_from(frame, 5)[0]
+            execution = _Execution(frame[7:], mem >> 10, mem & 0x3FF)
+            ok = self._execute(execution)
+            if cmd_type == const.DIRECT_COMMAND_NO_REPLY[0]:
+                return None
+            data = bytes(execution.memory[True])
+            reply_type = const.DIRECT_REPLY if ok \
+                else const.DIRECT_REPLY_ERROR
+        elif cmd_type in (const.SYSTEM_COMMAND_REPLY[0],
+                          const.SYSTEM_COMMAND_NO_REPLY[0]):
+            if len(frame) < 6:
+                return None
+            handler = self._system.get(frame[5])
+            with self.brick.lock:
+                if handler is None:
+                    status, payload = const.SYSTEM_UNKNOWN_ERROR, b''
+                else:
+                    status, payload = handler(frame[6:])
+            if cmd_type == const.SYSTEM_COMMAND_NO_REPLY[0]:
+                return None
+            data = frame[5:6] + status + payload
+            reply_type = const.SYSTEM_REPLY \
+                if status in (const.SYSTEM_REPLY_OK,
+                              const.SYSTEM_END_OF_FILE) \
+                else const.SYSTEM_REPLY_ERROR
+        else:
+            return None
+        return b''.join([
+            _LENGTH.pack(len(data) + 3),
+            counter,
+            reply_type,
+            data
+        ])
+
+    def _execute(self, execution: _Execution) -> bool:
+        """
+        run the operations of a direct command, False if one failed
+        """
+        try:
+            while execution.pos < len(execution.ops):
+                opcode = execution.byte()
+                handler = self._direct.get(opcode)
+                if handler is None:
+                    return False
+                with self.brick.lock:
+                    handler(execution)
+        except (_OpError, IndexError, ValueError, struct.error, OSError):
+            return False
+        return True
+
+    # direct commands: output
+
+    def _output_reset(self, ex: _Execution) -> None:
+        ex.arg()                                  # LAYER
+        now = time.monotonic()
+        for motor in self.brick.ports(ex.arg()):  # NOS
+            motor.stop(now)
+
+    def _output_stop(self, ex: _Execution) -> None:
+        ex.arg()                                  # LAYER
+        nos = ex.arg()
+        ex.arg()                                  # BRAKE
+        now = time.monotonic()
+        for motor in self.brick.ports(nos):
+            motor.stop(now)
+
+    def _output_speed(self, ex: _Execution) -> None:
+        ex.arg()                                  # LAYER
+        nos = ex.arg()
+        speed = ex.arg()
+        now = time.monotonic()
+        for motor in self.brick.ports(nos):
+            motor.advance(now)
+            motor.speed = speed
+
+    def _output_start(self, ex: _Execution) -> None:
+        ex.arg()                                  # LAYER
+        now = time.monotonic()
+        for motor in self.brick.ports(ex.arg()):  # NOS
+            motor.start(motor.speed, now)
+
+    def _output_polarity(self, ex: _Execution) -> None:
+        ex.arg()                                  # LAYER
+        nos = ex.arg()
+        polarity = ex.arg()
+        now = time.monotonic()
+        for motor in self.brick.ports(nos):
+            motor.advance(now)
+            if polarity == 0:
+                motor.polarity *= -1
+            else:
+                motor.polarity = 1 if polarity > 0 else -1
+
+    def _output_read(self, ex: _Execution) -> None:
+        ex.arg()                                  # LAYER
+        motor = self.brick.motor(ex.arg())        # NO
+        ex.out('<b', motor.speed if motor.busy else 0)
+        ex.out('<i', round(motor.tacho))
+
+    def _output_test(self, ex: _Execution) -> None:
+        ex.arg()                                  # LAYER
+        nos = ex.arg()
+        now = time.monotonic()
+        busy = False
+        for motor in self.brick.ports(nos):
+            motor.advance(now)
+            busy = busy or motor.busy
+        ex.out('<b', int(busy))
+
+    def _output_ready(self, ex: _Execution) -> None:
+        """
+        block until the motors stop (as the brick does)
+        """
+        ex.arg()                                  # LAYER
+        motors = self.brick.ports(ex.arg())       # NOS
+        while not self._stopped.is_set():
+            now = time.monotonic()
+            for motor in motors:
+                motor.advance(now)
+            if not any(motor.busy for motor in motors):
+                return
+            self.brick.lock.release()
+            try:
+                time.sleep(0.01)
+            finally:
+                self.brick.lock.acquire()
+
+    def _output_step(self, ex: _Execution) -> None:
+        ex.arg()                                  # LAYER
+        nos = ex.arg()
+        speed = ex.arg()
+        steps = sum(ex.arg('<i') for _ in range(3))  # STEP1 - STEP3
+        ex.arg()                                  # BRAKE
+        now = time.monotonic()
+        for motor in self.brick.ports(nos):
+            motor.start(speed, now, steps=steps or None)
+
+    def _output_time(self, ex: _Execution) -> None:
+        ex.arg()                                  # LAYER
+        nos = ex.arg()
+        speed = ex.arg()
+        duration = sum(ex.arg('<i') for _ in range(3)) / 1000
+        ex.arg()                                  # BRAKE
+        now = time.monotonic()
+        for motor in self.brick.ports(nos):
+            motor.start(speed, now, duration=duration or None)
+
+    def _output_step_sync(self, ex: _Execution) -> None:
+        self._output_sync(ex, timed=False)
+
+    def _output_time_sync(self, ex: _Execution) -> None:
+        self._output_sync(ex, timed=True)
+
+    def _output_sync(self, ex: _Execution, timed: bool) -> None:
+        """
+        two synchronized motors, a positive turn slows down the one
+        with the higher port, a negative one the lower
+        """
+        ex.arg()                                  # LAYER
+        nos = ex.arg()
+        speed = ex.arg()
+        turn = ex.arg('<h')
+        limit = ex.arg('<i')                      # STEP or TIME
+        ex.arg()                                  # BRAKE
+        motors = self.brick.ports(nos)
+        if len(motors) != 2:
+            raise _OpError('synchronized movement needs two motors')
+        if turn >= 0:
+            ratios = (1.0, (100 - turn) / 100)
+        else:
+            ratios = ((100 + turn) / 100, 1.0)
+        now = time.monotonic()
+        for motor, ratio in zip(motors, ratios):
+            if timed:
+                motor.start(round(speed * ratio), now,
+                            duration=limit / 1000 if limit else None)
+            else:
+                motor.start(round(speed * ratio), now,
+                            steps=abs(limit * ratio) if limit else None)
+
+    def _output_clr_count(self, ex: _Execution) -> None:
+        ex.arg()                                  # LAYER
+        now = time.monotonic()
+        for motor in self.brick.ports(ex.arg()):  # NOS
+            motor.advance(now)
+            motor.tacho = 0.0
+
+    def _output_get_count(self, ex: _Execution) -> None:
+        ex.arg()                                  # LAYER
+        motor = self.brick.motor(ex.arg())        # NO
+        ex.out('<i', round(motor.tacho))
+
+    # direct commands: input, ui, sound
+
+    def _input_device(self, ex: _Execution) -> None:
+        cmd = ex.byte()
+        if cmd in (const.READY_RAW[0], const.READY_SI[0],
+                   const.READY_PCT[0]):
+            ex.arg()                              # LAYER
+            num = ex.arg()
+            ex.arg()                              # TYPE
+            mode = ex.arg()
+            values = ex.arg()
+            value = self._sensor_value(num, mode)
+            for _ in range(values):
+                if cmd == const.READY_SI[0]:
+                    ex.out('<f', float(value))
+                elif cmd == const.READY_PCT[0]:
+                    ex.out('<b', 0)
+                else:
+                    ex.out('<i', round(value))
+        elif cmd == const.GET_RAW[0]:
+            ex.arg()                              # LAYER
+            ex.out('<i', round(self._sensor_value(ex.arg(), 0)))
+        elif cmd == const.GET_TYPEMODE[0]:
+            ex.arg()                              # LAYER
+            num = ex.arg()
+            ex.out('<b', 7 if 16 <= num <= 19 else 126)
+            ex.out('<b', 0)
+        elif cmd == const.GET_NAME[0]:
+            ex.arg()                              # LAYER
+            num = ex.arg()
+            length = ex.arg()
+            ex.out_str('L-MOTOR-DEG' if 16 <= num <= 19 else 'NONE',
+                       length)
+        else:
+            raise _OpError('unknown subcode of opInput_Device')
+
+    def _sensor_value(self, num: int, mode: int) -> float:
+        """
+        motors (ports 16 - 19) know degrees (mode 0, 1) and rotations (2),
+        all other sensors read 0
+        """
+        if 16 <= num <= 19:
+            tacho = self.brick.motor(num).tacho
+            return tacho / 360 if mode == 2 else tacho
+        return 0
+
+    def _ui_write(self, ex: _Execution) -> None:
+        cmd = ex.byte()
+        if cmd != const.LED[0]:
+            raise _OpError('unknown subcode of opUI_Write')
+        self.brick.led = ex.arg()
+
+    def _ui_read(self, ex: _Execution) -> None:
+        cmd = ex.byte()
+        if cmd != const.GET_VBATT[0]:
+            raise _OpError('unknown subcode of opUI_Read')
+        ex.out('<f', BATTERY_VOLTAGE)
+
+    def _sound(self, ex: _Execution) -> None:
+        cmd = ex.byte()
+        brick = self.brick
+        if cmd == const.BREAK[0]:
+            brick.sound = None
+        elif cmd == const.TONE[0]:
+            ex.arg()                              # VOLUME
+            freq = ex.arg('<h')
+            duration = ex.arg('<h')
+            brick.sound = ('tone', freq)
+            brick.sound_until = time.monotonic() + duration / 1000 \
+                if duration else None
+        elif cmd in (const.PLAY[0], const.REPEAT[0]):
+            ex.arg()                              # VOLUME
+            name = ex.arg('s')
+            brick.sound = ('file', name)
+            brick.sound_until = time.monotonic() + SOUND_DURATION \
+                if cmd == const.PLAY[0] else None
+        else:
+            raise _OpError('unknown subcode of opSound')
+
+    def _sound_test(self, ex: _Execution) -> None:
+        ex.out('<b', int(self.brick.sound_busy))
+
+    def _sound_ready(self, ex: _Execution) -> None:
+        while self.brick.sound_busy and not self._stopped.is_set():
+            self.brick.lock.release()
+            try:
+                time.sleep(0.01)
+            finally:
+                self.brick.lock.acquire()
+
+    @staticmethod
+    def _move_op(src: str, dst: str) -> typing.Callable:
+        """
+        handler of opMove<src>_<dst>
+        """
+        fmts = {'8': '<b', '16': '<h', '32': '<i', 'F': '<f'}
+
+        def move(ex: _Execution) -> None:
+            value = ex.arg(fmts[src])
+            ex.out(fmts[dst], _cast(fmts[dst], value))
+        return move
+
+    # direct commands: file
+
+    def _file(self, ex: _Execution) -> None:
+        cmd = ex.byte()
+        if cmd == const.MOVE[0]:
+            # the brick copies (cp -r)
+            source = self.brick.path(ex.arg('s'))
+            dest = self.brick.path(ex.arg('s'))
+            if os.path.isdir(source):
+                shutil.copytree(source, dest)
+            elif os.path.isfile(source):
+                shutil.copy(source, dest)
+        elif cmd == const.GET_FOLDERS[0]:
+            folders = self._folders(ex.arg('s'))
+            ex.out('<b', len(folders))
+        elif cmd == const.GET_SUBFOLDER_NAME[0]:
+            folders = self._folders(ex.arg('s'))
+            item = ex.arg()
+            length = ex.arg()
+            if not 1 <= item <= len(folders):
+                raise _OpError('no subfolder {}'.format(item))
+            ex.out_str(folders[item - 1], length)
+        elif cmd == const.DEL_SUBFOLDER[0]:
+            path = ex.arg('s')
+            folders = self._folders(path)
+            item = ex.arg()
+            if not 1 <= item <= len(folders):
+                raise _OpError('no subfolder {}'.format(item))
+            shutil.rmtree(os.path.join(self.brick.path(path),
+                                       folders[item - 1]))
+        else:
+            raise _OpError('unknown subcode of opFile')
+
+    def _folders(self, name: str) -> typing.List[str]:
+        path = self.brick.path(name)
+        return sorted(entry for entry in os.listdir(path)
+                      if os.path.isdir(os.path.join(path, entry)))
+
+    # system commands, they return (status, payload)
+
+    def _new_handle(self, state: dict) -> typing.Optional[int]:
+        for handle in range(256):
+            if handle not in self._handles:
+                self._handles[handle] = state
+                return handle
+        return None
+
+    def _begin_download(self, data: bytes) -> tuple:
+        size = struct.unpack_from('<I', data)[0]
+        path = self.brick.path(data[4:].split(b'\x00')[0].decode())
+        try:
+            # the brick creates missing directories
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            file = open(path, 'wb')
+        except OSError:
+            return const.SYSTEM_ILLEGAL_PATH, b''
+        handle = self._new_handle({'file': file, 'rest': size})
+        if handle is None:
+            file.close()
+            return const.SYSTEM_NO_HANDLES_AVAILABLE, b''
+        if size == 0:
+            file.close()
+            del self._handles[handle]
+        return const.SYSTEM_REPLY_OK, bytes([handle])
+
+    def _continue_download(self, data: bytes) -> tuple:
+        handle = data[0]
+        state = self._handles.get(handle)
+        if state is None or 'file' not in state:
+            return const.SYSTEM_UNKNOWN_HANDLE, bytes([handle])
+        part = data[1:]
+        if len(part) > state['rest']:
+            return const.SYSTEM_SIZE_ERROR, bytes([handle])
+        state['file'].write(part)
+        state['rest'] -= len(part)
+        if state['rest'] == 0:
+            state['file'].close()
+            del self._handles[handle]
+            return const.SYSTEM_END_OF_FILE, bytes([handle])
+        return const.SYSTEM_REPLY_OK, bytes([handle])
+
+    def _upload(self, content: bytes, max_size: int) -> tuple:
+        """
+        first part of an upload, the rest is kept by a handle
+        """
+        handle = self._new_handle({'data': content, 'pos': 0})
+        if handle is None:
+            return const.SYSTEM_NO_HANDLES_AVAILABLE, b''
+        status, part = self._next_part(handle, max_size)
+        return status, b''.join([
+            struct.pack('<IB', len(content), handle),
+            part
+        ])
+
+    def _next_part(self, handle: int, max_size: int) -> tuple:
+        state = self._handles[handle]
+        pos = state['pos']
+        part = state['data'][pos:pos + max_size]
+        state['pos'] = pos + len(part)
+        if state['pos'] >= len(state['data']):
+            del self._handles[handle]
+            return const.SYSTEM_END_OF_FILE, part
+        return const.SYSTEM_REPLY_OK, part
+
+    def _begin_upload(self, data: bytes) -> tuple:
+        max_size = struct.unpack_from('<H', data)[0]
+        path = self.brick.path(data[2:].split(b'\x00')[0].decode())
+        if not os.path.isfile(path):
+            return const.SYSTEM_ILLEGAL_PATH, b''
+        with open(path, 'rb') as file:
+            content = file.read()
+        return self._upload(content, max_size)
+
+    def _continue_upload(self, data: bytes) -> tuple:
+        handle, max_size = struct.unpack_from('<BH', data)
+        state = self._handles.get(handle)
+        if state is None or 'data' not in state:
+            return const.SYSTEM_UNKNOWN_HANDLE, bytes([handle])
+        status, part = self._next_part(handle, max_size)
+        return status, bytes([handle]) + part
+
+    def _list_files(self, data: bytes) -> tuple:
+        max_size = struct.unpack_from('<H', data)[0]
+        path = self.brick.path(data[2:].split(b'\x00')[0].decode())
+        if not os.path.isdir(path):
+            return const.SYSTEM_ILLEGAL_PATH, b''
+        lines = []
+        for entry in sorted(os.listdir(path)):
+            full = os.path.join(path, entry)
+            if os.path.isdir(full):
+                lines.append(entry + '/\n')
+            else:
+                with open(full, 'rb') as file:
+                    content = file.read()
+                lines.append('{} {:08X} {}\n'.format(
+                    hashlib.md5(content).hexdigest().upper(),
+                    len(content), entry))
+        return self._upload(''.join(lines).encode(), max_size)
+
+    def _close_filehandle(self, data: bytes) -> tuple:
+        state = self._handles.pop(data[0], None)
+        if state is None:
+            return const.SYSTEM_UNKNOWN_HANDLE, b''
+        if 'file' in state:
+            state['file'].close()
+        return const.SYSTEM_REPLY_OK, b''
+
+    def _create_dir(self, data: bytes) -> tuple:
+        path = self.brick.path(data.split(b'\x00')[0].decode())
+        if os.path.exists(path):
+            return const.SYSTEM_FILE_EXITS, b''
+        try:
+            os.mkdir(path)
+        except OSError:
+            return const.SYSTEM_ILLEGAL_PATH, b''
+        return const.SYSTEM_REPLY_OK, b''
+
+    def _delete_file(self, data: bytes) -> tuple:
+        path = self.brick.path(data.split(b'\x00')[0].decode())
+        try:
+            if os.path.isdir(path):
+                os.rmdir(path)
+            else:
+                os.remove(path)
+        except OSError:
+            return const.SYSTEM_ILLEGAL_PATH, b''
+        return const.SYSTEM_REPLY_OK, b''
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Emulator of an EV3, that is connected via WiFi')
+    parser.add_argument('--host', default='',
+                        help='address of the tcp port (default: all)')
+    parser.add_argument('--port', type=int, default=5555,
+                        help='tcp port, 4 digits (default: 5555)')
+    parser.add_argument('--serial-number', default='0016535D7E2D',
+                        help='serial number of the brick')
+    parser.add_argument('--name', default='EV3',
+                        help='name of the brick')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='delay of each reply in ms')
+    parser.add_argument('--jitter', type=float, default=0,
+                        help='maximum additional random delay in ms')
+    parser.add_argument('--root',
+                        help='directory of the file system '
+                        '(default: temporary directory)')
+    parser.add_argument('--beacon', default='255.255.255.255',
+                        help='address of the UDP beacon (f.i. 127.0.0.1)')
+    args = parser.parse_args()
+    emulator = Emulator(host=args.host, port=args.port,
+                        serial_number=args.serial_number, name=args.name,
+                        latency=args.latency / 1000,
+                        jitter=args.jitter / 1000,
+                        root=args.root, beacon=(args.beacon, 3015))
+    print('EV3 emulator {} on port {}, file system in {}'.format(
+        args.name, args.port, emulator.root))
+    emulator.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -7,3 +7,11 @@ class DirCmdError(Exception):
 
 class SysCmdError(Exception):
     """System command reply error."""
+
+
+class CmdTimeoutError(TimeoutError):
+    """No reply (or connection not writable) within the timeout."""
+
+
+class ConnectionLostError(ConnectionError):
+    """Connection broke, the command may or may not have been executed."""
@@ -0,0 +1,82 @@
+"""Module for splitting the byte stream of an EV3 into replies."""
+
+import struct
+import typing
+
+_LENGTH = struct.Struct('<H')
+
+
+class FrameReader:
+    """
+    Accumulates received bytes in a preallocated buffer and splits them
+    into length-prefixed frames. Frames are handed out as memoryviews
+    into the buffer, they are valid until the next call of read.
+    """
+
+    def __init__(self, read_into: typing.Callable[[memoryview], int],
+                 size: int = 4096, datagram: bool = False,
+                 max_read: int = 1024):
+        """Create a reader
+
+        Arguments:
+        read_into: callable, that receives bytes into a memoryview
+                   and returns their number (0 if nothing was received)
+
+        Keyword Arguments:
+        size: initial size of the buffer
+        datagram: flag, that each read returns one frame (f.i. usb reports,
+                  which are padded with zeros), instead of a byte stream
+        max_read: maximum number of bytes, a single read may return
+        """
+        assert size >= max_read, "size needs to hold max_read bytes"
+        self._read_into = read_into
+        self._datagram = datagram
+        self._max_read = max_read
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+        self._start = 0
+        self._end = 0
+
+    def read(self) -> typing.Iterator[memoryview]:
+        """
+        receive once and yield every complete frame
+        (a partial frame is kept until the rest of it is received)
+        """
+        self._make_room()
+        received = self._read_into(self._view[self._end:])
+        self._end += received
+        while self._end - self._start >= 2:
+            start = self._start
+            len_frame = _LENGTH.unpack_from(self._buf, start)[0] + 2
+            if self._end - start < len_frame:
+                if self._datagram:
+                    # a truncated report can't be completed
+                    self._start = self._end
+                break
+            if self._datagram:
+                self._start = self._end
+            else:
+                self._start = start + len_frame
+            yield self._view[start:start + len_frame]
+
+    def _make_room(self) -> None:
+        """
+        move a partial frame to the front and grow the buffer, if needed
+        """
+        if self._start == self._end:
+            self._start = self._end = 0
+            return
+        pending = self._end - self._start
+        if self._end + self._max_read <= len(self._buf):
+            return
+        needed = pending + self._max_read
+        if pending >= 2:
+            needed = max(needed,
+                         _LENGTH.unpack_from(self._buf, self._start)[0] + 2)
+        rest = bytes(self._view[self._start:self._end])
+        if needed > len(self._buf):
+            self._buf = bytearray(needed)
+            self._view = memoryview(self._buf)
+        self._buf[:pending] = rest
+        self._start = 0
+        self._end = pending
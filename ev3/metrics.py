@@ -0,0 +1,365 @@
+"""Module for counters and latency histograms of the commands on the wire."""
+
+import bisect
+import collections
+import http.server
+import json
+import threading
+import time
+import typing
+
+from . import constants as const
+
+# upper bounds of the latency buckets (sec.)
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, float('inf'))
+
+_TYPES = {
+    0x00: 'direct',
+    0x80: 'direct_no_reply',
+    0x01: 'system',
+    0x81: 'system_no_reply',
+    0x02: 'direct_reply',
+    0x04: 'direct_reply_error',
+    0x03: 'system_reply',
+    0x05: 'system_reply_error',
+}
+
+_OPCODES = {
+    value[0]: name for name, value in vars(const).items()
+    if name.startswith('op') and isinstance(value, bytes) and len(value) == 1
+}
+
+_SYSTEM_COMMANDS = {
+    getattr(const, name)[0]: name for name in (
+        'BEGIN_DOWNLOAD', 'CONTINUE_DOWNLOAD', 'BEGIN_UPLOAD',
+        'CONTINUE_UPLOAD', 'BEGIN_GETFILE', 'CONTINUE_GETFILE',
+        'CLOSE_FILEHANDLE', 'LIST_FILES', 'CONTINUE_LIST_FILES',
+        'CREATE_DIR', 'DELETE_FILE', 'LIST_OPEN_HANDLES', 'WRITEMAILBOX',
+        'BLUETOOTHPIN', 'ENTERFWUPDATE'
+    )
+}
+
+_HELP = {
+    'ev3_commands_sent_total': ('counter', 'commands written'),
+    'ev3_bytes_sent_total': ('counter', 'bytes of the written commands'),
+    'ev3_replies_received_total': ('counter', 'replies read'),
+    'ev3_bytes_received_total': ('counter', 'bytes of the read replies'),
+    'ev3_replies_parked_total': (
+        'counter', 'replies, that arrived before anybody waited for them'),
+    'ev3_replies_orphaned_total': (
+        'counter', 'replies, nobody expected (dropped)'),
+    'ev3_timeouts_total': ('counter', 'commands without reply in time'),
+    'ev3_commands_coalesced_total': (
+        'counter', 'commands, replaced by a newer one before written'),
+    'ev3_outages_total': (
+        'counter', 'breaks of the connection (type recovered or lost)'),
+    'ev3_send_seconds': ('histogram', 'duration of writing a command'),
+    'ev3_queue_seconds': (
+        'histogram',
+        'time from sending until written, incl. waiting (type priority)'),
+    'ev3_round_trip_seconds': (
+        'histogram', 'time from writing a command until its reply is read'),
+    'ev3_outage_seconds': (
+        'histogram', 'time from a break until the connection is back'),
+}
+
+
+def _labels(frame: bytes) -> tuple:
+    """
+    command type and opcode (first operation or system command) of a frame
+    """
+    kind = _TYPES.get(frame[4], 'unknown') if len(frame) > 4 else 'unknown'
+    if kind.startswith('direct') and len(frame) > 7:
+        code = frame[7]
+        opcode = _OPCODES.get(code, '0x{:02X}'.format(code))
+    elif kind.startswith('system') and len(frame) > 5:
+        code = frame[5]
+        opcode = _SYSTEM_COMMANDS.get(code, '0x{:02X}'.format(code))
+    else:
+        opcode = ''
+    return kind, opcode
+
+
+class Histogram:
+    """
+    Counts of observations per bucket, their sum and number
+    """
+
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """
+        add an observation
+        """
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> typing.List[int]:
+        """
+        number of observations <= each bound of BUCKETS
+        """
+        result = []
+        total = 0
+        for count in self.counts:
+            total += count
+            result.append(total)
+        return result
+
+
+class Metrics:
+    """
+    Counters and latency histograms of one connection,
+    split by command type and opcode (the first operation of a direct
+    command or the system command).
+    Export them as dict (snapshot), as Prometheus text (prometheus)
+    or serve the text via http (serve).
+    """
+
+    def __init__(self, max_inflight: int = 4096):
+        """Create empty metrics
+
+        Keyword Arguments:
+        max_inflight: maximum number of commands, whose round trip is
+                      measured at the same time (the oldest are dropped)
+        """
+        assert isinstance(max_inflight, int), \
+            "max_inflight needs to be of type int"
+        assert max_inflight > 0, \
+            "max_inflight needs to be positive"
+        self._max_inflight = max_inflight
+        self._lock = threading.Lock()
+        self._counters = collections.defaultdict(int)
+        self._histograms = collections.defaultdict(Histogram)
+        self._inflight = collections.OrderedDict()
+
+    def sending(self, frame: bytes) -> float:
+        """Start measuring a command (call it right before writing)
+
+        Arguments:
+        frame: the command (length, counter and type included)
+
+        Returns:
+        start time, to be handed to sent
+        """
+        start = time.monotonic()
+        if not frame[4] & 0x80:
+            # with reply, its round trip starts now
+            counter = bytes(frame[2:4])
+            with self._lock:
+                self._inflight[counter] = (start,) + _labels(frame)
+                self._inflight.move_to_end(counter)
+                if len(self._inflight) > self._max_inflight:
+                    self._inflight.popitem(last=False)
+        return start
+
+    def sent(self, frame: bytes, start: float) -> None:
+        """Count a written command (call it right after writing)
+
+        Arguments:
+        frame: the command (length, counter and type included)
+        start: return value of sending
+        """
+        end = time.monotonic()
+        kind, opcode = _labels(frame)
+        with self._lock:
+            self._counters['ev3_commands_sent_total', kind, opcode] += 1
+            self._counters['ev3_bytes_sent_total', kind, ''] += len(frame)
+            self._histograms['ev3_send_seconds', kind, ''].observe(
+                end - start)
+
+    def received(self, frame: bytes) -> None:
+        """Count a read reply and measure its round trip
+
+        Arguments:
+        frame: the reply (length, counter and type included)
+        """
+        now = time.monotonic()
+        kind = _labels(frame)[0]
+        with self._lock:
+            self._counters['ev3_replies_received_total', kind, ''] += 1
+            self._counters['ev3_bytes_received_total', kind, ''] += \
+                len(frame)
+            sent = self._inflight.pop(bytes(frame[2:4]), None)
+            if sent:
+                start, kind, opcode = sent
+                self._histograms['ev3_round_trip_seconds', kind,
+                                 opcode].observe(now - start)
+
+    def parked(self) -> None:
+        """
+        count a reply, that arrived before anybody waited for it
+        """
+        with self._lock:
+            self._counters['ev3_replies_parked_total', '', ''] += 1
+
+    def orphaned(self) -> None:
+        """
+        count a reply, nobody expected
+        """
+        with self._lock:
+            self._counters['ev3_replies_orphaned_total', '', ''] += 1
+
+    def coalesced(self) -> None:
+        """
+        count a command, that was superseded by a newer one
+        """
+        with self._lock:
+            self._counters['ev3_commands_coalesced_total', '', ''] += 1
+
+    def timeout(self, counter: bytes = None) -> None:
+        """
+        count a command, whose reply (or write) exceeded its timeout
+        """
+        with self._lock:
+            sent = self._inflight.pop(counter, None)
+            if sent:
+                kind, opcode = sent[1:]
+            else:
+                kind, opcode = '', ''
+            self._counters['ev3_timeouts_total', kind, opcode] += 1
+
+    def outage(self, duration: float, recovered: bool) -> None:
+        """
+        count a break of the connection, that lasted duration seconds
+        """
+        kind = 'recovered' if recovered else 'lost'
+        with self._lock:
+            self._counters['ev3_outages_total', kind, ''] += 1
+            if recovered:
+                self._histograms['ev3_outage_seconds', '', ''].observe(
+                    duration)
+
+    def queued(self, priority: str, duration: float) -> None:
+        """
+        measure a command, that waited and was written in duration seconds
+        """
+        with self._lock:
+            self._histograms['ev3_queue_seconds', priority.lower(),
+                             ''].observe(duration)
+
+    def forget(self, counter: bytes) -> None:
+        """
+        stop measuring the round trip of a command (its reply is cancelled)
+        """
+        with self._lock:
+            self._inflight.pop(counter, None)
+
+    def snapshot(self) -> dict:
+        """Actual values as dict
+
+        Returns:
+        {name: [{'type': ..., 'opcode': ..., 'value': ...}, ...]},
+        values of histograms are dicts with count, sum and buckets
+        (cumulative count per upper bound)
+        """
+        with self._lock:
+            result = collections.OrderedDict()
+            for (name, kind, opcode), value in sorted(
+                    self._counters.items()):
+                result.setdefault(name, []).append(
+                    self._entry(kind, opcode, value))
+            for (name, kind, opcode), hist in sorted(
+                    self._histograms.items()):
+                value = {
+                    'count': hist.count,
+                    'sum': hist.sum,
+                    'buckets': dict(zip(BUCKETS, hist.cumulative()))
+                }
+                result.setdefault(name, []).append(
+                    self._entry(kind, opcode, value))
+        return dict(result)
+
+    def prometheus(self) -> str:
+        """
+        actual values in the text format of Prometheus
+        """
+        lines = []
+        for name, entries in self.snapshot().items():
+            lines.append('# HELP {} {}'.format(name, _HELP[name][1]))
+            lines.append('# TYPE {} {}'.format(name, _HELP[name][0]))
+            for entry in entries:
+                labels = ['{}="{}"'.format(key, entry[key])
+                          for key in ('type', 'opcode') if key in entry]
+                value = entry['value']
+                if not isinstance(value, dict):
+                    lines.append(name + self._format(labels) +
+                                 ' ' + str(value))
+                    continue
+                for bound, count in value['buckets'].items():
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(
+                        name + '_bucket' +
+                        self._format(labels + ['le="{}"'.format(le)]) +
+                        ' ' + str(count))
+                lines.append(name + '_sum' + self._format(labels) +
+                             ' ' + repr(value['sum']))
+                lines.append(name + '_count' + self._format(labels) +
+                             ' ' + str(value['count']))
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port: int = 9100,
+              host: str = '127.0.0.1') -> http.server.HTTPServer:
+        """Serve the metrics via http in a background thread
+
+        GET /metrics returns the Prometheus text, GET /metrics.json
+        the snapshot as JSON.
+
+        Keyword Arguments:
+        port: tcp port (0: any free one)
+        host: address to bind (default: local only)
+
+        Returns:
+        the server, its shutdown method stops serving
+        """
+        metrics = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            """answers the requests of the metrics"""
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                if self.path == '/metrics':
+                    body = metrics.prometheus().encode()
+                    content_type = 'text/plain; version=0.0.4'
+                elif self.path == '/metrics.json':
+                    body = json.dumps(metrics.snapshot(),
+                                      default=str).encode()
+                    content_type = 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    @staticmethod
+    def _entry(kind: str, opcode: str, value) -> dict:
+        entry = {}
+        if kind:
+            entry['type'] = kind
+        if opcode:
+            entry['opcode'] = opcode
+        entry['value'] = value
+        return entry
+
+    @staticmethod
+    def _format(labels: list) -> str:
+        if not labels:
+            return ''
+        return '{' + ','.join(labels) + '}'
@@ -10,17 +10,24 @@ def port_motor_input(port_output: int) -> bytes:
     """
     get corresponding input motor port (from output motor port)
     """
+    return utils.LCX(motor_input_no(port_output))
+
+
+def motor_input_no(port_output: int) -> int:
+    """
+    get number of the corresponding input motor port (from output motor port)
+    """
     if port_output == constants.PORT_A:
-        return utils.LCX(16)
+        return 16
 
     if port_output == constants.PORT_B:
-        return utils.LCX(17)
+        return 17
 
     if port_output == constants.PORT_C:
-        return utils.LCX(18)
+        return 18
 
     if port_output == constants.PORT_D:
-        return utils.LCX(19)
+        return 19
 
     raise ValueError("port_output needs to be one of "
                      "the port numbers [1, 2, 4, 8]")
@@ -0,0 +1,457 @@
+"""Background receiver, that routes the replies of an EV3 to their waiters."""
+
+import collections
+import logging
+import numbers
+import threading
+import time
+import typing
+
+from . import error
+from .framing import FrameReader
+from .reconnect import Outage, Reconnect
+from .rtt import RttEstimator
+from .trace import RECV
+from .transport import Transport
+
+_LOG = logging.getLogger(__name__)
+
+
+class ReplyStore:
+    """
+    Parks replies, that arrived before anybody waits for them
+    (or the errors of commands, that failed meanwhile).
+    The store is bounded by a capacity and a maximum age, replies beyond
+    are evicted (oldest first) and counted, so long-running sessions
+    in sync_mode ASYNC keep constant memory.
+    """
+
+    def __init__(self, capacity: int = 256, max_age: float = 60.0):
+        """Create an empty store
+
+        Keyword Arguments:
+        capacity: maximum number of parked replies
+        max_age: seconds, a reply stays parked (None: no limit)
+        """
+        self._replies = collections.OrderedDict()
+        self._capacity = None
+        self._max_age = None
+        self.capacity = capacity
+        self.max_age = max_age
+        self._evicted = 0
+        self._orphaned = 0
+
+    @property
+    def capacity(self) -> int:
+        """
+        maximum number of parked replies
+        """
+        return self._capacity
+
+    @capacity.setter
+    def capacity(self, value: int):
+        assert isinstance(value, int), \
+            "capacity needs to be of type int"
+        assert value > 0, \
+            "capacity needs to be positive"
+        self._capacity = value
+
+    @property
+    def max_age(self) -> float:
+        """
+        seconds, a reply stays parked (None: no limit)
+        """
+        return self._max_age
+
+    @max_age.setter
+    def max_age(self, value: float):
+        assert value is None or isinstance(value, numbers.Number), \
+            "max_age needs to be a number"
+        assert value is None or value > 0, \
+            "max_age needs to be positive"
+        self._max_age = value
+
+    @property
+    def evicted(self) -> int:
+        """
+        number of parked replies, that were dropped uncollected
+        """
+        return self._evicted
+
+    @property
+    def orphaned(self) -> int:
+        """
+        number of replies, nobody expected (f.i. canceled commands)
+        """
+        return self._orphaned
+
+    def __len__(self) -> int:
+        return len(self._replies)
+
+    def put(self, counter: bytes, reply: bytes) -> None:
+        """
+        park a reply (an uncollected one with the same counter is evicted)
+        """
+        if self._replies.pop(counter, None) is not None:
+            self._evicted += 1
+        now = time.monotonic()
+        self._replies[counter] = (now, reply)
+        self._expire(now)
+        while len(self._replies) > self._capacity:
+            self._replies.popitem(last=False)
+            self._evicted += 1
+
+    def pop(self, counter: bytes) -> bytes:
+        """
+        take a reply from the store (returns None if there is no)
+        """
+        self._expire(time.monotonic())
+        item = self._replies.pop(counter, None)
+        return item[1] if item else None
+
+    def discard(self, counter: bytes) -> None:
+        """
+        drop the reply of counter, if there is one, without counting it
+        """
+        self._replies.pop(counter, None)
+
+    def orphan(self) -> None:
+        """
+        count a reply, that was dropped because nobody expected it
+        """
+        self._orphaned += 1
+
+    def _expire(self, now: float) -> None:
+        """
+        evict replies, that are older than max_age
+        """
+        if self._max_age is None:
+            return
+        limit = now - self._max_age
+        while self._replies:
+            counter, (arrived, _) = next(iter(self._replies.items()))
+            if arrived >= limit:
+                break
+            del self._replies[counter]
+            self._evicted += 1
+
+
+class _Waiter:
+    """A thread or a callback, that waits for the reply of a counter"""
+
+    __slots__ = ('event', 'reply', 'exc', 'callback')
+
+    def __init__(self, callback: typing.Callable = None):
+        self.event = threading.Event()
+        self.reply = None
+        self.exc = None
+        self.callback = callback
+
+
+class Receiver:
+    """
+    Reads all replies of one connection in a daemon thread and
+    hands each of them to the waiter, that is registered for its counter.
+    Replies of expected counters, nobody waits for yet, are parked
+    in a bounded ReplyStore, replies of unexpected counters are dropped.
+    With a Reconnect policy, a broken connection is reestablished
+    by the receiver thread.
+    """
+
+    def __init__(self, transport: Transport):
+        """Start reading from a connection
+
+        Arguments:
+        transport: the connection to the EV3
+        """
+        self._transport = transport
+        self._lock = threading.Lock()
+        self._reconnected = threading.Condition(self._lock)
+        self._expected = set()
+        self._waiters = {}
+        self._replay = {}  # frames of idempotent commands in flight
+        self._sent_at = {}  # time of writing the commands in flight
+        self._store = ReplyStore()
+        self._exc = None
+        self._generation = 0  # number of reconnects
+        self._outages = collections.deque(maxlen=100)
+        self.trace = None  # TraceBuffer, that records the replies
+        self.metrics = None  # Metrics, that count the replies
+        self.reconnect = None  # Reconnect, policy after a break
+        self.rtt = RttEstimator()  # round trips of the replies
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def store(self) -> ReplyStore:
+        """
+        store of the parked replies
+        """
+        return self._store
+
+    @property
+    def outages(self) -> typing.List[Outage]:
+        """
+        the last breaks of the connection (up to 100), oldest first
+        """
+        with self._lock:
+            return list(self._outages)
+
+    @property
+    def generation(self) -> int:
+        """
+        number of reconnects, a write, that failed, waits until it changes
+        """
+        return self._generation
+
+    def expect(self, counter: bytes, callback: typing.Callable = None,
+               replay: bytes = None) -> None:
+        """Announce a reply (call it before the command is sent)
+
+        Arguments:
+        counter: message counter of the command
+
+        Keyword Arguments:
+        callback: called from the receiver thread as callback(reply, exc),
+                  instead of parking the reply for a call of wait
+        replay: the command (idempotent), it is sent again, if the
+                connection is reestablished before the reply arrived
+        """
+        with self._lock:
+            if self._exc:
+                raise self._exc
+            self._expected.add(counter)
+            self._store.discard(counter)
+            if callback:
+                self._waiters[counter] = _Waiter(callback)
+            if replay is not None:
+                self._replay[counter] = bytes(replay)
+
+    def sent(self, counter: bytes) -> None:
+        """
+        the command of an expected reply was written,
+        its round trip starts now
+        """
+        now = time.monotonic()
+        with self._lock:
+            if counter in self._expected:
+                self._sent_at[counter] = now
+
+    def wait_reconnected(self, generation: int, timeout: float = None) -> bool:
+        """Wait for a reconnect (after a write failed)
+
+        Arguments:
+        generation: value of generation before the write
+
+        Keyword Arguments:
+        timeout: maximum seconds to wait (None: forever)
+
+        Returns:
+        False, if there is no policy, it gave up or timeout exceeded
+        """
+        if self.reconnect is None:
+            return False
+        with self._reconnected:
+            return self._reconnected.wait_for(
+                lambda: self._generation != generation or
+                self._exc is not None,
+                timeout
+            ) and self._exc is None
+
+    def cancel(self, counter: bytes) -> None:
+        """
+        forget a reply (f.i. the command was not sent),
+        if it arrives later, it counts as orphaned
+        """
+        with self._lock:
+            self._expected.discard(counter)
+            self._waiters.pop(counter, None)
+            self._replay.pop(counter, None)
+            self._sent_at.pop(counter, None)
+            self._store.discard(counter)
+        if self.metrics is not None:
+            self.metrics.forget(counter)
+
+    def wait(self, counter: bytes, timeout: float = None) -> bytes:
+        """Wait until the reply with counter is received
+
+        Arguments:
+        counter: message counter of the corresponding command
+
+        Keyword Arguments:
+        timeout: maximum seconds to wait (None: forever), when exceeded,
+                 CmdTimeoutError is raised and a late reply is orphaned
+
+        Returns:
+        reply, that holds this counter
+        """
+        with self._lock:
+            reply = self._store.pop(counter)
+            if isinstance(reply, Exception):
+                raise reply
+            if reply is not None:
+                return reply
+            if self._exc:
+                raise self._exc
+            waiter = self._waiters.get(counter)
+            if waiter is None:
+                if counter not in self._expected:
+                    raise KeyError('no reply expected for counter '
+                                   + str(counter)
+                                   + ' (not sent or already evicted)')
+                waiter = self._waiters[counter] = _Waiter()
+        waiter.event.wait(timeout)
+        with self._lock:
+            if self._waiters.get(counter) is waiter:
+                del self._waiters[counter]
+            if not waiter.event.is_set():
+                self._expected.discard(counter)
+                self._replay.pop(counter, None)
+                self._sent_at.pop(counter, None)
+                if self.metrics is not None:
+                    self.metrics.timeout(counter)
+                raise error.CmdTimeoutError(
+                    'no reply for counter {:02X}:{:02X} within {:.3f} sec.'
+                    .format(counter[0], counter[1], timeout))
+        if waiter.exc:
+            raise waiter.exc
+        return waiter.reply
+
+    def _run(self) -> None:
+        """
+        read replies and route them, until the connection breaks
+        (and can't be reestablished)
+        """
+        while True:
+            frames = FrameReader(self._transport.recv_into,
+                                 datagram=self._transport.datagram)
+            try:
+                while True:
+                    for frame in frames.read():
+                        if self.trace is not None:
+                            self.trace.record(RECV, frame)
+                        if self.metrics is not None:
+                            self.metrics.received(frame)
+                        self._route(bytes(frame))
+            except Exception as exc:  # pylint: disable=broad-except
+                policy = self.reconnect
+                if policy is not None and not self._transport.closed and \
+                   self._recover(policy, exc):
+                    continue
+                with self._lock:
+                    self._exc = exc
+                    waiters = list(self._waiters.values())
+                    for waiter in waiters:
+                        waiter.exc = exc
+                        waiter.event.set()
+                    self._reconnected.notify_all()
+                for waiter in waiters:
+                    if waiter.callback:
+                        self._call(waiter, None, exc)
+                return
+
+    def _recover(self, policy: Reconnect, exc: Exception) -> bool:
+        """
+        reconnect the transport, send the idempotent commands in flight
+        again and fail the others, returns False, if it gave up
+        """
+        start = time.time()
+        started = time.monotonic()
+        attempts = 0
+        recovered = False
+        for delay in policy.delays():
+            time.sleep(delay)
+            if self._transport.closed:
+                break
+            attempts += 1
+            try:
+                self._transport.reconnect()
+                recovered = True
+                break
+            except Exception:  # pylint: disable=broad-except
+                pass
+        resend = []
+        failed = []
+        if recovered:
+            lost = error.ConnectionLostError(
+                'connection to EV3 broke, command was not idempotent')
+            with self._lock:
+                # in the order, they were sent
+                resend = [frame for counter, frame in self._replay.items()
+                          if counter in self._expected]
+                # no round trips of resent commands (Karn)
+                self._sent_at.clear()
+                for counter in list(self._expected):
+                    if counter in self._replay:
+                        continue
+                    self._expected.discard(counter)
+                    waiter = self._waiters.pop(counter, None)
+                    if waiter is None:
+                        # parked like a reply, wait raises it
+                        self._store.put(counter, lost)
+                        continue
+                    waiter.exc = lost
+                    waiter.event.set()
+                    failed.append(waiter)
+        outage = Outage(start, time.monotonic() - started, attempts,
+                        recovered, exc, len(resend), len(failed))
+        with self._lock:
+            self._outages.append(outage)
+            if recovered:
+                self._generation += 1
+                self._reconnected.notify_all()
+        for waiter in failed:
+            if waiter.callback:
+                self._call(waiter, None, waiter.exc)
+        for frame in resend:
+            try:
+                self._transport.send(frame)
+            except OSError:
+                break  # the next read finds the break
+        if self.metrics is not None:
+            self.metrics.outage(outage.duration, recovered)
+        if policy.callback is not None:
+            try:
+                policy.callback(outage)
+            except Exception:  # pylint: disable=broad-except
+                _LOG.exception('callback of the reconnect policy failed')
+        return recovered
+
+    def _route(self, reply: bytes) -> None:
+        """
+        hand reply to its waiter, park or drop it
+        """
+        counter = reply[2:4]
+        now = time.monotonic()
+        with self._lock:
+            if counter not in self._expected:
+                self._store.orphan()
+                if self.metrics is not None:
+                    self.metrics.orphaned()
+                return
+            self._expected.discard(counter)
+            self._replay.pop(counter, None)
+            sent = self._sent_at.pop(counter, None)
+            if sent is not None:
+                self.rtt.observe(now - sent)
+            waiter = self._waiters.pop(counter, None)
+            if waiter is None:
+                self._store.put(counter, reply)
+                if self.metrics is not None:
+                    self.metrics.parked()
+                return
+            waiter.reply = reply
+            waiter.event.set()
+        if waiter.callback:
+            self._call(waiter, reply, None)
+
+    @staticmethod
+    def _call(waiter: _Waiter, reply: bytes, exc: Exception) -> None:
+        """
+        call the callback of a waiter, its errors are logged and
+        never taken for a broken connection
+        """
+        try:
+            waiter.callback(reply, exc)
+        except Exception:  # pylint: disable=broad-except
+            _LOG.exception('callback of a reply failed')
@@ -0,0 +1,69 @@
+"""Module for the policy of reconnecting a broken connection."""
+
+import collections
+import numbers
+import typing
+
+Outage = collections.namedtuple('Outage', [
+    'start',        # time of the break (seconds since the epoch)
+    'duration',     # seconds until reconnected or given up
+    'attempts',     # number of reconnect attempts
+    'recovered',    # flag, if the connection was reestablished
+    'error',        # the exception, that broke the connection
+    'replayed',     # number of idempotent commands, that were resent
+    'failed',       # number of commands, that raised ConnectionLostError
+])
+
+
+class Reconnect:
+    """
+    Policy, how a broken connection is reestablished.
+    The session stays the same, the transport reconnects to the known
+    address or device (no discovery). Commands in flight are sent again,
+    if they are idempotent (EV3.idempotent), the others raise
+    ConnectionLostError. Writes, that fail during the outage,
+    wait for the reconnect.
+    """
+
+    def __init__(self, attempts: int = 10, delay: float = 0.1,
+                 backoff: float = 2.0, max_delay: float = 2.0,
+                 callback: typing.Callable[[Outage], None] = None):
+        """Create a policy
+
+        Keyword Arguments:
+        attempts: maximum number of reconnect attempts
+        delay: seconds before the second attempt
+               (the first one follows the break immediately)
+        backoff: factor, that increases the delay after each attempt
+        max_delay: upper limit of the delay
+        callback: called with the Outage, when reconnected or given up
+        """
+        assert isinstance(attempts, int), \
+            "attempts needs to be of type int"
+        assert attempts > 0, \
+            "attempts needs to be positive"
+        assert isinstance(delay, numbers.Number), \
+            "delay needs to be a number"
+        assert delay >= 0, \
+            "delay needs to be positive"
+        assert isinstance(backoff, numbers.Number), \
+            "backoff needs to be a number"
+        assert backoff >= 1, \
+            "backoff needs to be at least 1"
+        assert isinstance(max_delay, numbers.Number), \
+            "max_delay needs to be a number"
+        self.attempts = attempts
+        self.delay = delay
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self.callback = callback
+
+    def delays(self) -> typing.Iterator[float]:
+        """
+        seconds to wait before each attempt
+        """
+        delay = self.delay
+        yield 0
+        for _ in range(self.attempts - 1):
+            yield delay
+            delay = min(delay * self.backoff, self.max_delay)
@@ -0,0 +1,256 @@
+"""Module for recording the frames of a connection and replaying them."""
+
+import collections
+import struct
+import threading
+import time
+import typing
+
+from .trace import SENT, RECV
+from .transport import Transport
+
+MAGIC = b'EV3R'
+VERSION = 1
+
+_HEAD = struct.Struct('<4sBB')      # magic, version, length of protocol
+_RECORD = struct.Struct('<BdH')     # direction, seconds since start, length
+_LENGTH = struct.Struct('<H')
+
+
+def read_records(path: str) -> typing.Tuple[str, list]:
+    """Read a recording
+
+    Arguments:
+    path: name of the file
+
+    Returns:
+    protocol of the recorded connection and
+    list of tuples (direction, seconds since start, frame)
+    """
+    with open(path, 'rb') as file:
+        data = file.read()
+    magic, version, size = _HEAD.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(path + ' is no recording of version '
+                         + str(VERSION))
+    pos = _HEAD.size
+    protocol = data[pos:pos + size].decode('utf-8') or None
+    pos += size
+    records = []
+    while pos + _RECORD.size <= len(data):
+        direction, stamp, length = _RECORD.unpack_from(data, pos)
+        pos += _RECORD.size
+        frame = data[pos:pos + length]
+        if len(frame) < length:
+            break  # the recording was interrupted
+        pos += length
+        records.append((direction, stamp, frame))
+    return protocol, records
+
+
+class RecordingTransport(Transport):
+    """
+    Wraps a transport and writes every command and every reply with
+    its timestamp into a binary file, f.i.
+
+      transport = RecordingTransport(HidTransport.open(), 'drive.ev3r')
+      vehicle = ev3_vehicle.TwoWheelVehicle(
+          0.02128, 0.1175, ev3_obj=ev3.EV3(transport=transport))
+
+    The file starts with MAGIC, VERSION and the protocol, each record
+    is direction (SENT or RECV), seconds since start (double),
+    length (2 bytes) and the frame, all little endian.
+    """
+
+    def __init__(self, transport: Transport, path: str):
+        """Start recording
+
+        Arguments:
+        transport: the connection to the EV3
+        path: name of the file (it is overwritten)
+        """
+        assert isinstance(transport, Transport), \
+            "transport needs to be instance of Transport"
+        super().__init__()
+        self.protocol = transport.protocol
+        self.datagram = transport.datagram
+        self._transport = transport
+        self._file = open(path, 'wb')
+        self._file_lock = threading.Lock()
+        self._start = time.monotonic()
+        self._pending = bytearray()   # partial reply of a stream
+        protocol = (transport.protocol or '').encode('utf-8')
+        self._file.write(_HEAD.pack(MAGIC, VERSION, len(protocol)))
+        self._file.write(protocol)
+
+    def recv_into(self, view: memoryview) -> int:
+        received = self._transport.recv_into(view)
+        if received == 0:
+            return 0
+        if self.datagram:
+            # one report, padded with zeros
+            length = _LENGTH.unpack_from(view)[0] + 2
+            self._record(RECV, view[:min(length, received)])
+            return received
+        self._pending += view[:received]
+        while len(self._pending) >= 2:
+            length = _LENGTH.unpack_from(self._pending)[0] + 2
+            if len(self._pending) < length:
+                break
+            self._record(RECV, self._pending[:length])
+            del self._pending[:length]
+        return received
+
+    def wait_writable(self, timeout: float) -> bool:
+        return self._transport.wait_writable(timeout)
+
+    def reconnect(self) -> None:
+        self._transport.reconnect()
+        self._pending.clear()
+
+    def close(self) -> None:
+        self.closed = True
+        self._transport.close()
+        with self._file_lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def _write(self, frame: bytes) -> None:
+        self._record(SENT, frame)
+        self._transport.send(frame)
+
+    def _record(self, direction: int, frame: bytes) -> None:
+        stamp = time.monotonic() - self._start
+        with self._file_lock:
+            if self._file.closed:
+                return
+            self._file.write(_RECORD.pack(direction, stamp, len(frame)))
+            self._file.write(frame)
+            self._file.flush()
+
+
+class ReplayTransport(Transport):
+    """
+    Plays the brick of a recording. The n-th command, that is sent,
+    releases the replies, which followed the n-th recorded command.
+    Their counters are replaced by the ones actually sent, so the
+    commands needn't start with the same counter.
+    With realtime, each reply keeps its recorded delay after its command,
+    else it is received immediately.
+    Commands, that differ from the recording (apart from the counter),
+    are counted as mismatches; commands beyond the recording get no reply.
+    """
+
+    def __init__(self, path: str, realtime: bool = True):
+        """Load a recording
+
+        Arguments:
+        path: name of the file, written by RecordingTransport
+
+        Keyword Arguments:
+        realtime: flag, if replies keep their recorded timing
+        """
+        super().__init__()
+        self.protocol, records = read_records(path)
+        self._realtime = realtime
+        self._commands = []     # (seconds since start, frame)
+        self._replies = []      # replies, that follow each command
+        early = []              # replies before the first command
+        for direction, stamp, frame in records:
+            if direction == SENT:
+                self._commands.append((stamp, frame))
+                self._replies.append([])
+            elif self._commands:
+                self._replies[-1].append(
+                    (stamp - self._commands[-1][0], frame))
+            else:
+                early.append((0.0, frame))
+        self._counters = {}     # recorded counter -> actual counter
+        self._sent = 0
+        self._mismatches = 0
+        self._queue = collections.deque()   # (due, frame)
+        self._pending = None    # rest of a partially read reply
+        self._cond = threading.Condition()
+        now = time.monotonic()
+        for _, frame in early:
+            self._queue.append((now, frame))
+
+    @property
+    def commands(self) -> int:
+        """
+        number of recorded commands
+        """
+        return len(self._commands)
+
+    @property
+    def sent(self) -> int:
+        """
+        number of commands sent to the replay
+        """
+        return self._sent
+
+    @property
+    def mismatches(self) -> int:
+        """
+        number of sent commands, that differ from the recorded ones
+        (apart from their counters) or exceed the recording
+        """
+        return self._mismatches
+
+    def recv_into(self, view: memoryview) -> int:
+        with self._cond:
+            while self._pending is None:
+                if self.closed:
+                    raise ConnectionError('connection to EV3 closed')
+                if not self._queue:
+                    self._cond.wait()
+                    continue
+                due, frame = self._queue[0]
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                self._queue.popleft()
+                self._pending = self._patch(frame)
+            data = self._pending
+            size = min(len(view), len(data))
+            view[:size] = data[:size]
+            self._pending = data[size:] or None
+            return size
+
+    def close(self) -> None:
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def _write(self, frame: bytes) -> None:
+        if self.closed:
+            raise ConnectionError('connection to EV3 closed')
+        now = time.monotonic()
+        with self._cond:
+            num = self._sent
+            self._sent += 1
+            if num >= len(self._commands):
+                self._mismatches += 1
+                return
+            recorded = self._commands[num][1]
+            if bytes(frame[:2]) + bytes(frame[4:]) != \
+               recorded[:2] + recorded[4:]:
+                self._mismatches += 1
+            self._counters[recorded[2:4]] = bytes(frame[2:4])
+            for delay, reply in self._replies[num]:
+                due = now + delay if self._realtime else now
+                # keep the recorded order of the replies
+                if self._queue:
+                    due = max(due, self._queue[-1][0])
+                self._queue.append((due, reply))
+            self._cond.notify()
+
+    def _patch(self, frame: bytes) -> bytes:
+        """
+        replace the recorded counter of a reply by the one actually sent
+        """
+        counter = self._counters.pop(frame[2:4], None)
+        if counter is None:
+            return frame
+        return frame[:2] + counter + frame[4:]
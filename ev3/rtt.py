@@ -0,0 +1,107 @@
+"""Module for estimating the round trip time of a connection."""
+
+import numbers
+
+
+class RttEstimator:
+    """
+    Smoothed round trip time and its variation, as TCP does
+    (RFC 6298: SRTT and RTTVAR). The receiver feeds it with the time
+    from writing a command until its reply is read. Commands, that were
+    sent again after a reconnect, are not measured (Karn's algorithm).
+    """
+
+    def __init__(self, alpha: float = 0.125, beta: float = 0.25,
+                 max_sample: float = 1.0):
+        """Create an estimator without samples
+
+        Keyword Arguments:
+        alpha: weight of a new sample in srtt
+        beta: weight of a new deviation in rttvar
+        max_sample: longer round trips are ignored (seconds),
+                    f.i. of commands, that wait for a motor or a sound
+        """
+        assert isinstance(alpha, numbers.Number), \
+            "alpha needs to be a number"
+        assert 0 < alpha <= 1, \
+            "alpha needs to be in range (0 - 1]"
+        assert isinstance(beta, numbers.Number), \
+            "beta needs to be a number"
+        assert 0 < beta <= 1, \
+            "beta needs to be in range (0 - 1]"
+        assert isinstance(max_sample, numbers.Number), \
+            "max_sample needs to be a number"
+        assert max_sample > 0, \
+            "max_sample needs to be positive"
+        self._alpha = alpha
+        self._beta = beta
+        self.max_sample = max_sample
+        self._srtt = None
+        self._rttvar = None
+        self._samples = 0
+        self._last = None
+
+    @property
+    def srtt(self) -> float:
+        """
+        smoothed round trip time in seconds (None: no sample yet)
+        """
+        return self._srtt
+
+    @property
+    def rttvar(self) -> float:
+        """
+        smoothed deviation of the round trips in seconds
+        (None: no sample yet)
+        """
+        return self._rttvar
+
+    @property
+    def rto(self) -> float:
+        """
+        srtt + 4 * rttvar, a round trip, that is rarely exceeded
+        (None: no sample yet)
+        """
+        if self._srtt is None:
+            return None
+        return self._srtt + 4 * self._rttvar
+
+    @property
+    def last(self) -> float:
+        """
+        the last measured round trip in seconds (None: no sample yet)
+        """
+        return self._last
+
+    @property
+    def samples(self) -> int:
+        """
+        number of measured round trips
+        """
+        return self._samples
+
+    def observe(self, sample: float) -> None:
+        """
+        add a measured round trip (seconds)
+        """
+        if sample < 0 or sample > self.max_sample:
+            return
+        if self._srtt is None:
+            self._srtt = sample
+            self._rttvar = sample / 2
+        else:
+            self._rttvar = (1 - self._beta) * self._rttvar + \
+                self._beta * abs(self._srtt - sample)
+            self._srtt = (1 - self._alpha) * self._srtt + \
+                self._alpha * sample
+        self._samples += 1
+        self._last = sample
+
+    def reset(self) -> None:
+        """
+        forget all samples (f.i. after the route changed)
+        """
+        self._srtt = None
+        self._rttvar = None
+        self._samples = 0
+        self._last = None
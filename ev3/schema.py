@@ -0,0 +1,205 @@
+"""Module for the layout of global memory and the decoding of replies."""
+
+import struct
+
+from .utils import GVX
+
+# struct format and size of the field types
+_TYPES = {
+    'int8': ('b', 1),
+    'int16': ('h', 2),
+    'int32': ('i', 4),
+    'float': ('f', 4),
+}
+
+
+class _Record:
+    """
+    Base of the decoded replies, its subclasses define __slots__
+    """
+
+    __slots__ = ()
+
+    def __repr__(self) -> str:
+        return '{}({})'.format(
+            type(self).__name__,
+            ', '.join('{}={!r}'.format(name, getattr(self, name))
+                      for name in self.__slots__)
+        )
+
+    def __iter__(self):
+        """
+        values in the order of the fields (f.i. tuple(record))
+        """
+        return (getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other) -> bool:
+        return type(self) is type(other) and \
+            all(getattr(self, name) == getattr(other, name)
+                for name in self.__slots__)
+
+
+class ReplySchema:
+    """
+    Named fields of global memory. Each field gets its aligned offset,
+    the operations reference it by gvx(name) and the reply is decoded
+    by one precompiled struct into a record with attributes of the
+    same names.
+
+      pos = ReplySchema('Pos')
+      pos.int32('left')
+      pos.int32('right')
+      ops = b''.join([..., pos.gvx('left'), ..., pos.gvx('right')])
+      reply = ev3_obj.send_direct_cmd(ops, global_mem=pos.global_mem)
+      record = pos.decode(reply)   # record.left, record.right
+    """
+
+    def __init__(self, name: str = 'Reply'):
+        """Create an empty schema
+
+        Keyword Arguments:
+        name: class name of the decoded records
+        """
+        assert isinstance(name, str), \
+            "name needs to be of type str"
+        self._name = name
+        self._fields = []
+        self._offsets = {}
+        self._global_mem = 0
+        self._struct = None
+        self._record = None
+        self._strings = ()
+
+    @property
+    def global_mem(self) -> int:
+        """
+        size of the global memory, that holds all fields
+        """
+        return self._global_mem
+
+    @property
+    def names(self) -> tuple:
+        """
+        names of the fields in the order of their declaration
+        """
+        return tuple(name for name, _, _ in self._fields)
+
+    def int8(self, name: str) -> int:
+        """
+        add a field of 1 byte (DATA8), returns its offset
+        """
+        return self._add(name, 'int8')
+
+    def int16(self, name: str) -> int:
+        """
+        add a field of 2 bytes (DATA16), returns its offset
+        """
+        return self._add(name, 'int16')
+
+    def int32(self, name: str) -> int:
+        """
+        add a field of 4 bytes (DATA32), returns its offset
+        """
+        return self._add(name, 'int32')
+
+    def float(self, name: str) -> int:
+        """
+        add a field of 4 bytes (DATAF), returns its offset
+        """
+        return self._add(name, 'float')
+
+    def string(self, name: str, size: int) -> int:
+        """
+        add a zero terminated string of fixed size (DATAS),
+        returns its offset (decoded as str, without the zeros)
+        """
+        assert isinstance(size, int), \
+            "size needs to be of type int"
+        assert size > 0, \
+            "size needs to be positive"
+        return self._add(name, 'string', size)
+
+    def offset(self, name: str) -> int:
+        """
+        offset of a field in global memory
+        """
+        return self._offsets[name]
+
+    def gvx(self, name: str, base: int = 0) -> bytes:
+        """Global variable of a field
+
+        Arguments:
+        name: name of the field
+
+        Keyword Arguments:
+        base: offset of the schema in global memory
+              (f.i. the offset, a Batch assigns)
+
+        Returns:
+        GVX of the field's offset
+        """
+        return GVX(base + self._offsets[name])
+
+    def decode(self, reply: bytes, start: int = 5) -> _Record:
+        """Decode a reply
+
+        Arguments:
+        reply: reply of a direct command (or a slice of its global memory)
+
+        Keyword Arguments:
+        start: position of the schema's global memory in reply
+               (5: behind the header of a reply, 0: data of a BatchReply)
+
+        Returns:
+        record with one attribute per field
+        """
+        if self._struct is None:
+            self._compile()
+        values = self._struct.unpack_from(memoryview(reply), start)
+        record = self._record.__new__(self._record)
+        for name, value in zip(self._record.__slots__, values):
+            setattr(record, name, value)
+        for name in self._strings:
+            value = getattr(record, name)
+            setattr(record, name, value.split(b'\x00', 1)[0].decode('utf8'))
+        return record
+
+    def _add(self, name: str, kind: str, size: int = None) -> int:
+        """
+        allocate a field behind the existing ones, naturally aligned
+        """
+        assert isinstance(name, str) and name.isidentifier(), \
+            "name needs to be an identifier"
+        assert name not in self._offsets, \
+            "field " + name + " already exists"
+        if size is None:
+            size = _TYPES[kind][1]
+            offset = -(-self._global_mem // size) * size
+        else:
+            offset = self._global_mem
+        self._fields.append((name, kind, size))
+        self._offsets[name] = offset
+        self._global_mem = offset + size
+        self._struct = None
+        return offset
+
+    def _compile(self) -> None:
+        """
+        build the struct (padding included) and the record class
+        """
+        fmt = ['<']
+        pos = 0
+        for name, kind, size in self._fields:
+            offset = self._offsets[name]
+            if offset > pos:
+                fmt.append('{}x'.format(offset - pos))
+            if kind == 'string':
+                fmt.append('{}s'.format(size))
+            else:
+                fmt.append(_TYPES[kind][0])
+            pos = offset + size
+        self._struct = struct.Struct(''.join(fmt))
+        self._record = type(self._name, (_Record,),
+                            {'__slots__': self.names})
+        self._strings = tuple(name for name, kind, _ in self._fields
+                              if kind == 'string')
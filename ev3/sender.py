@@ -0,0 +1,392 @@
+"""Module for the order, in which the threads of a connection write."""
+
+# pylint: disable=protected-access
+
+import collections
+import threading
+import time
+import typing
+
+from . import constants as const
+
+# first operations of direct commands, that are written with HIGH priority
+HIGH_OPS = (
+    const.opOutput_Stop,
+)
+
+# results of Sender.write
+TIMED_OUT = 0       # no turn within the timeout, nothing was written
+WRITTEN = 1
+SUPERSEDED = 2      # replaced by a newer command of the same mailbox
+
+
+def priority_of(ops: bytes) -> str:
+    """
+    priority of a direct command's operations (HIGH if it stops motors)
+    """
+    if ops[:1] in HIGH_OPS:
+        return const.HIGH
+    return const.NORMAL
+
+
+def frame_priority(frame: bytes) -> str:
+    """
+    priority of a complete command (length, counter and type included)
+    """
+    if len(frame) > 7 and not frame[4] & 0x7F:
+        return priority_of(frame[7:8])
+    return const.NORMAL
+
+
+class Credits:
+    """
+    Flow control of the direct commands without reply. The EV3 executes
+    its commands in order, so the reply of a probe (opNop with reply)
+    confirms, that all commands before it are executed. Commands without
+    reply wait for their turn, while window of them are unconfirmed.
+    The window follows the drain rate, the probes measure:
+    rate * target commands keep the brick's queue about target seconds
+    long, so input-to-motion latency stays bounded.
+    """
+
+    def __init__(self, target: float = 0.05, window: int = 8,
+                 min_window: int = 2, max_window: int = 64,
+                 probe_every: int = 4, probe_timeout: float = 1.0):
+        """Create a flow control (set it as EV3.credits)
+
+        Keyword Arguments:
+        target: seconds of commands, the brick's queue may hold
+        window: commands in flight, until the rate is measured
+        min_window: lower limit of the window
+        max_window: upper limit of the window
+        probe_every: commands in flight, that trigger a probe
+        probe_timeout: seconds, after which a missing probe reply
+                       releases the window (f.i. a lost reply)
+        """
+        assert isinstance(target, (int, float)), \
+            "target needs to be a number"
+        assert target > 0, \
+            "target needs to be positive"
+        assert isinstance(min_window, int), \
+            "min_window needs to be of type int"
+        assert isinstance(max_window, int), \
+            "max_window needs to be of type int"
+        assert isinstance(window, int), \
+            "window needs to be of type int"
+        assert 1 <= min_window <= window <= max_window, \
+            "windows need to be 1 <= min_window <= window <= max_window"
+        assert isinstance(probe_every, int), \
+            "probe_every needs to be of type int"
+        assert probe_every > 0, \
+            "probe_every needs to be positive"
+        assert isinstance(probe_timeout, (int, float)), \
+            "probe_timeout needs to be a number"
+        assert probe_timeout > 0, \
+            "probe_timeout needs to be positive"
+        self._target = target
+        self._window = window
+        self._min_window = min_window
+        self._max_window = max_window
+        self._probe_every = probe_every
+        self.probe_timeout = probe_timeout
+        self._rate = None
+        self._sent = 0      # commands without reply, that were written
+        self._drained = 0   # of them confirmed as executed
+        self._probe = None  # (mark, time) of the probe in flight
+        self._last = None   # (time, commands in flight) of the last reply
+
+    @property
+    def window(self) -> int:
+        """
+        maximum number of unconfirmed commands
+        """
+        return self._window
+
+    @property
+    def rate(self) -> float:
+        """
+        measured commands per second, the brick executes (None: unknown)
+        """
+        return self._rate
+
+    @property
+    def in_flight(self) -> int:
+        """
+        commands without reply, that are not confirmed as executed
+        """
+        return self._sent - self._drained
+
+    def _available(self, now: float) -> bool:
+        """
+        flag, if a command may be written (the caller holds the lock)
+        """
+        if self._sent - self._drained < self._window:
+            return True
+        if self._probe is not None and \
+           now - self._probe[1] > self.probe_timeout:
+            # the reply is lost, don't block forever
+            self._drained = self._sent
+            self._probe = None
+            return True
+        return False
+
+    def _written(self) -> bool:
+        """
+        count a written command, returns True, if a probe is needed
+        """
+        self._sent += 1
+        return self._probe is None and self._sent - self._drained >= \
+            min(self._probe_every, self._window)
+
+    def _replied(self, mark: int, ok: bool, now: float) -> None:
+        """
+        all commands before the probe (mark) are executed
+        """
+        self._probe = None
+        if not ok:
+            self._drained = self._sent
+            self._last = None
+            return
+        drained = mark - self._drained
+        if drained > 0 and self._last is not None and self._last[1] > 0:
+            # the brick was busy since the last reply
+            sample = drained / max(now - self._last[0], 1e-6)
+            if self._rate is None:
+                self._rate = sample
+            else:
+                self._rate = 0.8 * self._rate + 0.2 * sample
+            self._window = max(self._min_window, min(
+                self._max_window, int(self._rate * self._target + 0.5)))
+        self._drained = max(self._drained, mark)
+        self._last = (now, self._sent - self._drained)
+
+
+class _Ticket:
+    """
+    place of a NORMAL writer in the queue
+    """
+
+    __slots__ = ('mailbox', 'superseded')
+
+    def __init__(self, mailbox: typing.Hashable):
+        self.mailbox = mailbox
+        self.superseded = False
+
+
+class Sender:
+    """
+    Gate in front of a transport, that orders the writes of all threads,
+    which share the connection. A HIGH command is written next,
+    it only waits for the write in progress, NORMAL commands are written
+    in the order of their arrival, when no HIGH one waits.
+    The frames stay with their threads (no copies), the gate
+    only decides, whose turn it is.
+    With Credits, direct commands without reply (counted)
+    additionally wait for a credit.
+    Commands with a mailbox (f.i. the output ports, they address)
+    replace a waiting NORMAL command of the same mailbox in place,
+    which is not written at all, only the newest value matters.
+    A HIGH command removes the waiting ones of its mailbox.
+    """
+
+    def __init__(self, probe: typing.Callable = None):
+        """Create a gate
+
+        Keyword Arguments:
+        probe: writes a probe (opNop with reply) and
+               calls callback(ok) with its reply, as probe(callback)
+        """
+        self._cond = threading.Condition()
+        self._busy = False
+        self._high = 0  # number of waiting HIGH writers
+        self._normal = collections.deque()  # tickets of NORMAL writers
+        self._probe = probe
+        self._credits = None
+        self.metrics = None  # Metrics, that measure the waits
+
+    @property
+    def credits(self) -> Credits:
+        """
+        flow control of the commands without reply (None: no limit)
+        """
+        return self._credits
+
+    @credits.setter
+    def credits(self, value: Credits):
+        assert value is None or isinstance(value, Credits), \
+            "credits needs to be of type Credits"
+        assert value is None or self._probe is not None, \
+            "credits need a probe"
+        with self._cond:
+            self._credits = value
+            self._cond.notify_all()
+
+    @property
+    def waiting(self) -> int:
+        """
+        number of writers, that wait for their turn
+        """
+        with self._cond:
+            return self._high + len(self._normal)
+
+    def write(self, priority: str, write: typing.Callable, *args,
+              timeout: float = None, counted: bool = False,
+              mailbox: typing.Hashable = None) -> int:
+        """Wait for the turn of a command and write it with write(*args)
+
+        Arguments:
+        priority: HIGH or NORMAL
+        write: callable, that writes the command
+
+        Keyword Arguments:
+        timeout: maximum seconds to wait for the turn (None: forever)
+        counted: flag, that it is a direct command without reply,
+                 which needs a credit (HIGH ones never wait for credits)
+        mailbox: key of commands, that supersede each other
+                 (None: the command is never superseded)
+
+        Returns:
+        WRITTEN, TIMED_OUT (nothing was written) or
+        SUPERSEDED (a newer command of the mailbox took its place)
+        """
+        start = time.monotonic()
+        with self._cond:
+            ready = False
+            if priority == const.HIGH:
+                if mailbox is not None:
+                    self._supersede(mailbox, None)
+                self._high += 1
+                try:
+                    ready = self._cond.wait_for(
+                        lambda: not self._busy, timeout)
+                finally:
+                    self._high -= 1
+            else:
+                ticket = _Ticket(mailbox)
+                if mailbox is None or \
+                   not self._supersede(mailbox, ticket):
+                    self._normal.append(ticket)
+                deadline = None if timeout is None else start + timeout
+                try:
+                    while True:
+                        ready = self._wait_for(
+                            lambda: self._may_write(ticket, counted),
+                            None if deadline is None
+                            else deadline - time.monotonic()
+                        )
+                        flow = self._credits
+                        if ticket.superseded:
+                            break
+                        if not ready or not counted or flow is None or \
+                           flow._available(time.monotonic()):
+                            break
+                        # no credit and no probe in flight,
+                        # it's this writer's turn to probe
+                        self._busy = True
+                        try:
+                            self._send_probe(flow)
+                        finally:
+                            self._busy = False
+                            self._cond.notify_all()
+                finally:
+                    if not ticket.superseded:
+                        self._normal.remove(ticket)
+                        if not ready:
+                            # the next one may be ready now
+                            self._cond.notify_all()
+                if ticket.superseded:
+                    if self.metrics is not None:
+                        self.metrics.coalesced()
+                    return SUPERSEDED
+            if not ready:
+                return TIMED_OUT
+            self._busy = True
+        try:
+            write(*args)
+            if counted:
+                with self._cond:
+                    flow = self._credits
+                    if flow is not None and flow._written():
+                        self._send_probe(flow)
+        finally:
+            with self._cond:
+                self._busy = False
+                if self._high or self._normal:
+                    self._cond.notify_all()
+        if self.metrics is not None:
+            self.metrics.queued(priority, time.monotonic() - start)
+        return WRITTEN
+
+    def _supersede(self, mailbox: typing.Hashable, ticket: _Ticket) -> bool:
+        """
+        mark the waiting tickets of a mailbox as superseded and put ticket
+        in place of the first one (None: remove them),
+        returns False, if there was none (the caller holds the lock)
+        """
+        found = False
+        for pos, waiting in enumerate(self._normal):
+            if waiting.mailbox == mailbox:
+                waiting.superseded = True
+                if ticket is not None and not found:
+                    self._normal[pos] = ticket
+                else:
+                    self._normal[pos] = None
+                found = True
+        if not found:
+            return False
+        while None in self._normal:
+            self._normal.remove(None)
+        self._cond.notify_all()
+        return True
+
+    def _may_write(self, ticket: _Ticket, counted: bool) -> bool:
+        """
+        flag, if it is the turn of a NORMAL writer (or its turn to probe),
+        or it is superseded
+        """
+        if ticket.superseded:
+            return True
+        if self._busy or self._high or self._normal[0] is not ticket:
+            return False
+        flow = self._credits
+        return not counted or flow is None or flow._probe is None or \
+            flow._available(time.monotonic())
+
+    def _wait_for(self, predicate: typing.Callable, timeout: float) -> bool:
+        """
+        wait_for, that checks lost probes (the caller holds the lock)
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not predicate():
+            flow = self._credits
+            wait = None if flow is None else flow.probe_timeout
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = remaining if wait is None else min(wait, remaining)
+            self._cond.wait(wait)
+        return True
+
+    def _send_probe(self, flow: Credits) -> None:
+        """
+        write a probe, its reply confirms all commands, written before
+        (the caller holds the lock and the turn, the lock is released,
+        while the probe is written)
+        """
+        mark = flow._sent
+        flow._probe = (mark, time.monotonic())
+
+        def replied(ok: bool) -> None:
+            with self._cond:
+                flow._replied(mark, ok, time.monotonic())
+                self._cond.notify_all()
+
+        self._cond.release()
+        try:
+            self._probe(replied)
+        except Exception:
+            replied(False)
+            raise
+        finally:
+            self._cond.acquire()
@@ -0,0 +1,133 @@
+"""Module for the state of one connection to an EV3."""
+
+import struct
+import threading
+import weakref
+
+from . import constants as const
+from .metrics import Metrics
+from .receiver import Receiver
+from .reconnect import Reconnect
+from .rtt import RttEstimator
+from .sender import Credits, Sender
+from .trace import TraceBuffer
+from .transport import Transport
+
+
+class Session:
+    """
+    Connection to one EV3 with its own message counter, lock and receiver.
+    All EV3 objects, that use the same connection (ev3_obj), share it,
+    while different bricks never share state.
+    """
+
+    def __init__(self, transport: Transport):
+        """Take over an established connection
+
+        Arguments:
+        transport: the connection to the EV3
+        """
+        self.protocol = transport.protocol
+        self.transport = transport
+        self.receiver = Receiver(transport)
+        # order of the writes, its probe doesn't reference the session,
+        # so __del__ closes the connection without a garbage collection
+        probe = weakref.WeakMethod(self._probe)
+        self.sender = Sender(probe=lambda callback: probe()(callback))
+        self._lock = threading.Lock()
+        self._msg_cnt = 41
+        self.local = threading.local()  # active batch of each thread
+        self._trace = None
+        self._metrics = None
+        self._reconnect = None
+
+    def __del__(self):
+        """
+        closes the connection, when no EV3 object uses it any more
+        """
+        self.transport.close()
+
+    @property
+    def trace(self) -> TraceBuffer:
+        """
+        records the frames of this connection (None: no recording)
+        """
+        return self._trace
+
+    @trace.setter
+    def trace(self, value: TraceBuffer):
+        self._trace = value
+        self.receiver.trace = value
+        self.transport.trace = value
+
+    @property
+    def metrics(self) -> Metrics:
+        """
+        counts the commands and replies of this connection (None: no counting)
+        """
+        return self._metrics
+
+    @metrics.setter
+    def metrics(self, value: Metrics):
+        self._metrics = value
+        self.receiver.metrics = value
+        self.transport.metrics = value
+        self.sender.metrics = value
+
+    @property
+    def reconnect(self) -> Reconnect:
+        """
+        policy after a break of the connection (None: no reconnect)
+        """
+        return self._reconnect
+
+    @reconnect.setter
+    def reconnect(self, value: Reconnect):
+        self._reconnect = value
+        self.receiver.reconnect = value
+
+    @property
+    def rtt(self) -> RttEstimator:
+        """
+        round trip times of the replies of this connection
+        """
+        return self.receiver.rtt
+
+    @property
+    def credits(self) -> Credits:
+        """
+        flow control of the commands without reply (None: no limit)
+        """
+        return self.sender.credits
+
+    @credits.setter
+    def credits(self, value: Credits):
+        self.sender.credits = value
+
+    def next_counter(self) -> int:
+        """
+        returns the next message counter (range [1 - 65535])
+        """
+        with self._lock:
+            if self._msg_cnt < 65535:
+                self._msg_cnt += 1
+            else:
+                self._msg_cnt = 1
+            return self._msg_cnt
+
+    def _probe(self, callback) -> None:
+        """
+        write an opNop with reply, callback(ok) is called with its reply
+        """
+        msg_cnt = self.next_counter()
+        counter = struct.pack('<H', msg_cnt)
+        self.receiver.expect(
+            counter,
+            callback=lambda reply, exc: callback(exc is None)
+        )
+        try:
+            self.transport.send_direct(const.opNop, msg_cnt,
+                                       const.DIRECT_COMMAND_REPLY, 0)
+        except Exception:
+            self.receiver.cancel(counter)
+            raise
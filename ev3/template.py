@@ -0,0 +1,181 @@
+"""Module for direct commands, that are compiled once and patched per send."""
+
+import struct
+import threading
+import typing
+
+from . import constants as const
+
+_HEADER = struct.Struct('<HHcH')  # length, counter, type, mem sizes
+_COUNTER = struct.Struct('<H')
+
+# prefix and format of the fixed width constants
+_WIDTHS = {
+    2: (b'\x82', struct.Struct('<h')),
+    4: (b'\x83', struct.Struct('<i')),
+}
+
+
+class Slot:
+    """
+    Parameter of a CommandTemplate, a constant of fixed width,
+    its value is patched in at each send
+    """
+
+    __slots__ = ('name', 'width', 'default')
+
+    def __init__(self, name: str, width: int, default: int = None):
+        """Create a slot
+
+        Arguments:
+        name: name of the parameter
+        width: 2 (LC2) or 4 (LC4) bytes
+
+        Keyword Arguments:
+        default: value, if the parameter is not given
+        """
+        assert isinstance(name, str), \
+            "name needs to be of type str"
+        assert width in _WIDTHS, \
+            "width needs to be 2 or 4"
+        self.name = name
+        self.width = width
+        self.default = default
+
+
+def LC2(name: str, default: int = None) -> Slot:
+    """Parameter, that is sent as LC2 (range [-32767 - 32767])"""
+    return Slot(name, 2, default)
+
+
+def LC4(name: str, default: int = None) -> Slot:
+    """Parameter, that is sent as LC4"""
+    return Slot(name, 4, default)
+
+
+class CommandTemplate:
+    """
+    Operations of a direct command, compiled once into a frame.
+    The parameters are fixed width constants (LC2, LC4), at each send
+    only they, the counter and the type are patched into the frame.
+
+      TONE = CommandTemplate([
+          ev3.opSound,
+          ev3.TONE,
+          LC2('volume'),
+          LC2('freq'),
+          LC4('duration')
+      ])
+      ev3_obj.send_template(TONE, volume=10, freq=440, duration=500)
+    """
+
+    def __init__(self, parts: typing.List[typing.Union[bytes, Slot]],
+                 local_mem: int = 0, global_mem: int = 0):
+        """Compile operations
+
+        Arguments:
+        parts: operations (bytes) and parameters (Slot), in order
+               (a name may occur multiple times, all get the same value)
+
+        Keyword Arguments:
+        local_mem: size of the local memory
+        global_mem: size of the global memory
+        """
+        assert 0 <= local_mem <= const.MAX_LOCAL_MEM, \
+            "local_mem needs to be in range [0 - {}]".format(
+                const.MAX_LOCAL_MEM)
+        assert 0 <= global_mem <= const.MAX_GLOBAL_MEM, \
+            "global_mem needs to be in range [0 - {}]".format(
+                const.MAX_GLOBAL_MEM)
+        frame = bytearray(_HEADER.size)
+        slots = []
+        defaults = {}
+        for part in parts:
+            if isinstance(part, Slot):
+                prefix, fmt = _WIDTHS[part.width]
+                frame += prefix
+                slots.append((part.name, len(frame), fmt))
+                frame += bytes(part.width)
+                if part.default is not None:
+                    defaults[part.name] = part.default
+            else:
+                assert isinstance(part, bytes), \
+                    "parts need to be of type bytes or Slot"
+                frame += part
+        if len(frame) > const.MAX_CMD_SIZE:
+            raise ValueError('operations exceed the size limit '
+                             'of a direct command')
+        _HEADER.pack_into(frame, 0, len(frame) - 2, 0, b'\x00',
+                          local_mem * 1024 + global_mem)
+        self._frame = frame
+        self._slots = tuple(slots)
+        self._names = frozenset(name for name, _, _ in slots)
+        self._defaults = defaults
+        self._local_mem = local_mem
+        self._global_mem = global_mem
+        self._lock = threading.Lock()
+
+    @property
+    def local_mem(self) -> int:
+        """
+        size of the local memory
+        """
+        return self._local_mem
+
+    @property
+    def global_mem(self) -> int:
+        """
+        size of the global memory
+        """
+        return self._global_mem
+
+    @property
+    def names(self) -> frozenset:
+        """
+        names of the parameters
+        """
+        return self._names
+
+    def ops(self, **values) -> bytes:
+        """
+        operations with the given parameters (netto data)
+        """
+        with self._lock:
+            self._patch(values)
+            return bytes(self._frame[_HEADER.size:])
+
+    def frame(self, msg_cnt: int, cmd_type: bytes,
+              values: dict) -> bytes:
+        """Patch the frame and copy it (the lock is not held while
+        the command waits for its turn and is written)
+
+        Arguments:
+        msg_cnt: message counter
+        cmd_type: DIRECT_COMMAND_REPLY or DIRECT_COMMAND_NO_REPLY
+        values: the parameters
+
+        Returns:
+        the complete command
+        """
+        with self._lock:
+            self._patch(values)
+            _COUNTER.pack_into(self._frame, 2, msg_cnt)
+            self._frame[4:5] = cmd_type
+            return bytes(self._frame)
+
+    def _patch(self, values: dict) -> None:
+        """
+        write the parameters into the frame
+        """
+        if values.keys() != self._names:
+            unknown = values.keys() - self._names
+            if unknown:
+                raise TypeError('unknown parameters: ' +
+                                ', '.join(sorted(unknown)))
+            missing = self._names - values.keys() - self._defaults.keys()
+            if missing:
+                raise TypeError('missing parameters: ' +
+                                ', '.join(sorted(missing)))
+            values = dict(self._defaults, **values)
+        for name, pos, fmt in self._slots:
+            fmt.pack_into(self._frame, pos, values[name])
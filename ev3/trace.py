@@ -0,0 +1,171 @@
+"""Module for recording the frames on the wire and rendering them as hex."""
+
+import array
+import datetime
+import sys
+import threading
+import time
+import typing
+
+SENT = 0
+RECV = 1
+
+_NAMES = ('Sent', 'Recv')
+
+# slices of the fields, dependent from the type of the frame
+_FIELDS = {
+    0x00: (slice(0, 2), slice(2, 4), slice(4, 5), slice(5, 7), slice(7, None)),
+    0x80: (slice(0, 2), slice(2, 4), slice(4, 5), slice(5, 7), slice(7, None)),
+    0x01: (slice(0, 2), slice(2, 4), slice(4, 5), slice(5, None)),
+    0x81: (slice(0, 2), slice(2, 4), slice(4, 5), slice(5, None)),
+    0x02: (slice(0, 2), slice(2, 4), slice(4, 5)),
+    0x04: (slice(0, 2), slice(2, 4), slice(4, 5)),
+    0x03: (slice(0, 2), slice(2, 4), slice(4, 5), slice(5, 6), slice(6, 7)),
+    0x05: (slice(0, 2), slice(2, 4), slice(4, 5), slice(5, 6), slice(6, 7)),
+}
+# position of the data of replies, printed only if there is some
+_DATA = {0x02: 5, 0x04: 5, 0x03: 7, 0x05: 7}
+
+
+def _hex(data: bytes) -> str:
+    return ':'.join('{:02X}'.format(byte) for byte in data)
+
+
+def render(direction: int, frame: bytes, timestamp: float = None,
+           length: int = None) -> str:
+    """Render a frame as one line of hex, its fields separated by |
+
+    Arguments:
+    direction: SENT or RECV
+    frame: the command or reply
+
+    Keyword Arguments:
+    timestamp: time of the frame (seconds since the epoch, default: now)
+    length: original length of the frame, if it was truncated
+
+    Returns:
+    f.i. 12:34:56.789012 Sent 0x|09:00|2A:00|00|04:00|99:1C:00|
+    """
+    if timestamp is None:
+        timestamp = time.time()
+    now = datetime.datetime.fromtimestamp(timestamp).strftime('%H:%M:%S.%f')
+    kind = frame[4] if len(frame) > 4 else None
+    fields = _FIELDS.get(kind, (slice(0, None),))
+    parts = [_hex(frame[field]) for field in fields]
+    if kind in _DATA and len(frame) > _DATA[kind]:
+        parts.append(_hex(frame[_DATA[kind]:]))
+    line = now + ' ' + _NAMES[direction] + ' 0x|' + '|'.join(parts) + '|'
+    if length is not None and length > len(frame):
+        line += ' ({} of {} bytes)'.format(len(frame), length)
+    return line
+
+
+class TraceBuffer:
+    """
+    Ring buffer of the last frames, sent and received.
+    Recording copies the raw bytes into preallocated memory and stamps
+    them with time.monotonic(), rendering is done only by dump.
+    Frames longer than frame_size are truncated.
+    """
+
+    def __init__(self, capacity: int = 1024, frame_size: int = 64):
+        """Create an empty buffer
+
+        Keyword Arguments:
+        capacity: number of frames, the oldest ones are overwritten
+        frame_size: maximum number of bytes kept per frame
+        """
+        assert isinstance(capacity, int), \
+            "capacity needs to be of type int"
+        assert capacity > 0, \
+            "capacity needs to be positive"
+        assert isinstance(frame_size, int), \
+            "frame_size needs to be of type int"
+        assert frame_size >= 7, \
+            "frame_size needs to hold a header (7 bytes)"
+        self._capacity = capacity
+        self._frame_size = frame_size
+        self._data = bytearray(capacity * frame_size)
+        self._view = memoryview(self._data)
+        self._times = array.array('d', bytes(8 * capacity))
+        self._lengths = array.array('L', [0] * capacity)
+        self._directions = bytearray(capacity)
+        self._count = 0
+        self._lock = threading.Lock()
+        # converts monotonic to wall clock time
+        self._epoch = time.time() - time.monotonic()
+
+    @property
+    def capacity(self) -> int:
+        """
+        number of frames, the buffer holds
+        """
+        return self._capacity
+
+    @property
+    def recorded(self) -> int:
+        """
+        number of frames recorded since the creation (or clear)
+        """
+        return self._count
+
+    def __len__(self) -> int:
+        return min(self._count, self._capacity)
+
+    def record(self, direction: int, frame: bytes) -> None:
+        """Record a frame
+
+        Arguments:
+        direction: SENT or RECV
+        frame: command or reply (bytes, bytearray or memoryview)
+        """
+        size = min(len(frame), self._frame_size)
+        with self._lock:
+            slot = self._count % self._capacity
+            start = slot * self._frame_size
+            self._view[start:start + size] = frame[:size]
+            self._times[slot] = time.monotonic()
+            self._lengths[slot] = len(frame)
+            self._directions[slot] = direction
+            self._count += 1
+
+    def clear(self) -> None:
+        """
+        forget all recorded frames
+        """
+        with self._lock:
+            self._count = 0
+
+    def entries(self) -> typing.List[tuple]:
+        """
+        recorded frames, the oldest first, as tuples
+        (timestamp, direction, frame, length), timestamp in seconds since
+        the epoch, frame may be truncated, length is its original size
+        """
+        with self._lock:
+            count = self._count
+            first = max(0, count - self._capacity)
+            result = []
+            for num in range(first, count):
+                slot = num % self._capacity
+                start = slot * self._frame_size
+                length = self._lengths[slot]
+                size = min(length, self._frame_size)
+                result.append((
+                    self._epoch + self._times[slot],
+                    self._directions[slot],
+                    bytes(self._data[start:start + size]),
+                    length
+                ))
+        return result
+
+    def dump(self, file: typing.TextIO = None) -> None:
+        """Write the recorded frames as hex
+
+        Keyword Arguments:
+        file: where to write (default: stdout)
+        """
+        if file is None:
+            file = sys.stdout
+        for timestamp, direction, frame, length in self.entries():
+            print(render(direction, frame, timestamp, length), file=file)
@@ -0,0 +1,510 @@
+"""Module for the connections, that carry the frames to and from an EV3."""
+
+import collections
+import select
+import socket
+import struct
+import threading
+import typing
+
+from . import constants as const
+from .discovery import Discovery, shared as shared_discovery
+from .trace import SENT
+
+_DIRECT_HEADER = struct.Struct('<HHcH')  # length, counter, type, mem sizes
+_SYSTEM_HEADER = struct.Struct('<HHc')   # length, counter, type
+
+PADDING = 100              # zeros behind each usb command (as ever written)
+
+
+class Transport:
+    """
+    Connection to an EV3, that writes commands and reads replies.
+    Framing, batching and routing of the replies are done above it,
+    subclasses only implement _write and recv_into.
+    """
+
+    protocol = None        # 'Bluetooth', 'Usb', 'Wifi', 'Loopback', 'Unix'
+    datagram = False       # each recv_into returns one frame (usb reports)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.closed = False  # closed on purpose, no reconnect
+        self.trace = None  # TraceBuffer, that records the commands
+        self.metrics = None  # Metrics, that count the commands
+
+    def send(self, frame: bytes) -> None:
+        """
+        write a complete command (length, counter and type included)
+        """
+        with self._lock:
+            self._send_frame(frame)
+
+    def send_direct(self, ops: bytes, msg_cnt: int, cmd_type: bytes,
+                    mem: int) -> None:
+        """Write a direct command
+
+        Arguments:
+        ops: operations (netto data)
+        msg_cnt: message counter
+        cmd_type: DIRECT_COMMAND_REPLY or DIRECT_COMMAND_NO_REPLY
+        mem: header, local_mem * 1024 + global_mem
+        """
+        self.send(_DIRECT_HEADER.pack(len(ops) + 5, msg_cnt, cmd_type, mem)
+                  + ops)
+
+    def send_system(self, cmd: bytes, msg_cnt: int, cmd_type: bytes) -> None:
+        """Write a system command
+
+        Arguments:
+        cmd: system command and its arguments (netto data)
+        msg_cnt: message counter
+        cmd_type: SYSTEM_COMMAND_REPLY or SYSTEM_COMMAND_NO_REPLY
+        """
+        self.send(_SYSTEM_HEADER.pack(len(cmd) + 3, msg_cnt, cmd_type) + cmd)
+
+    def recv_into(self, view: memoryview) -> int:
+        """Receive bytes from the EV3
+
+        Arguments:
+        view: where to write them
+
+        Returns:
+        number of bytes (0 if nothing was received in time),
+        raises ConnectionError, when the connection is closed
+        """
+        raise NotImplementedError
+
+    def wait_writable(self, timeout: float) -> bool:
+        """
+        wait until a command can be written without blocking,
+        returns False, if timeout (sec.) was exceeded
+        """
+        return True
+
+    def close(self) -> None:
+        """
+        close the connection, a blocking recv_into raises ConnectionError
+        """
+        self.closed = True
+
+    def reconnect(self) -> None:
+        """
+        replace a broken connection by a new one to the same EV3,
+        the transport object stays the same
+        """
+        raise ConnectionError(type(self).__name__ + ' can not reconnect')
+
+    def _send_frame(self, frame: bytes) -> None:
+        """
+        record the frame and write it (the caller holds the lock)
+        """
+        if self.trace is not None:
+            self.trace.record(SENT, frame)
+        if self.metrics is None:
+            self._write(frame)
+            return
+        start = self.metrics.sending(frame)
+        self._write(frame)
+        self.metrics.sent(frame, start)
+
+    def _write(self, frame: bytes) -> None:
+        raise NotImplementedError
+
+
+class SocketTransport(Transport):
+    """
+    Stream socket, f.i. a bluetooth (RFCOMM) connection
+    """
+
+    protocol = const.BLUETOOTH
+
+    def __init__(self, sock: socket.socket, protocol: str = None):
+        """Take over a connected socket
+
+        Arguments:
+        sock: the socket
+
+        Keyword Arguments:
+        protocol: overwrites the protocol of the class
+        """
+        super().__init__()
+        self.socket = sock
+        if protocol is not None:
+            self.protocol = protocol
+
+    def recv_into(self, view: memoryview) -> int:
+        received = self.socket.recv_into(view)
+        if received == 0:
+            raise ConnectionError('connection to EV3 closed')
+        return received
+
+    def wait_writable(self, timeout: float) -> bool:
+        return bool(select.select([], [self.socket], [], timeout)[1])
+
+    def close(self) -> None:
+        self.closed = True
+        self._shutdown(self.socket)
+
+    def reconnect(self) -> None:
+        sock = self._connect()
+        with self._lock:
+            old, self.socket = self.socket, sock
+        self._shutdown(old)
+
+    def _connect(self) -> socket.socket:
+        """
+        a new socket, connected to the same EV3
+        """
+        raise ConnectionError(type(self).__name__ + ' can not reconnect')
+
+    @staticmethod
+    def _shutdown(sock: socket.socket) -> None:
+        try:
+            # wakes up the receiver, that blocks in recv
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        sock.close()
+
+    def _write(self, frame: bytes) -> None:
+        self.socket.sendall(frame)
+
+
+class TcpTransport(SocketTransport):
+    """
+    TCP connection, f.i. to an EV3, that is connected via WiFi
+    (after the unlock message)
+    """
+
+    protocol = const.WIFI
+
+    def __init__(self, sock: socket.socket = None, address: tuple = None):
+        """Take over a connected socket or connect to address
+
+        Keyword Arguments (either sock or address):
+        sock: connected tcp socket
+        address: (host, port) to connect to
+        """
+        assert sock or address, \
+            'Either sock or address needs to be given'
+        if sock is None:
+            sock = socket.create_connection(address)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        super().__init__(sock)
+        self.address = sock.getpeername()
+        self.serial_number = None   # set, if the EV3 needs an unlock
+        self._unlock_protocol = None
+        self._beacon = None         # answered again before a reconnect
+        self._discovery = None
+
+    @classmethod
+    def open(cls, host: str = None, timeout: float = None,
+             discovery: Discovery = None) -> 'TcpTransport':
+        """Connect to an EV3 via WiFi (beacon, then unlock message)
+
+        Keyword Arguments:
+        host: mac-address of the EV3 (None: the first one, that sends
+              its beacon)
+        timeout: maximum seconds to wait for the beacon (None: forever)
+        discovery: listener of the beacons (default: the shared one,
+                   its cache makes known bricks connect immediately)
+        """
+        if discovery is None:
+            discovery = shared_discovery()
+        beacon = discovery.find(host, timeout)
+
+        # answer the beacon to make the EV3 accept a TCP/IP connection
+        discovery.wake(beacon)
+
+        sock = cls._unlock((beacon.address, beacon.port),
+                           beacon.serial_number, beacon.protocol,
+                           beacon.name)
+        transport = cls(sock)
+        transport.serial_number = beacon.serial_number
+        transport._unlock_protocol = beacon.protocol
+        transport._beacon = beacon
+        transport._discovery = discovery
+        return transport
+
+    @staticmethod
+    def _unlock(address: tuple, serial_number: str, protocol: str,
+                name: str) -> socket.socket:
+        """
+        connect to the EV3 and send the unlock message
+        """
+
+        # Establish a TCP/IP connection with EV3s address and port
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.connect(address)
+
+        # Send an unlock message to the EV3 over TCP/IP
+        msg = 'GET /target?sn=' + serial_number + 'VMTP1.0\n' + \
+              'Protocol: ' + protocol
+        sock.send(msg.encode('utf-8'))
+        reply = sock.recv(16).decode('utf-8')
+        if not reply.startswith('Accept:EV340'):
+            sock.close()
+            raise RuntimeError('No wifi connection to ' + name
+                               + ' established')
+        return sock
+
+    def _connect(self) -> socket.socket:
+        """
+        connect to the known address, without waiting for a beacon
+        (the last one, that was seen, is answered)
+        """
+        if self._beacon is not None:
+            beacon = self._discovery.get(self.serial_number) or self._beacon
+            self._beacon = beacon
+            self.address = (beacon.address, beacon.port)
+            self._discovery.wake(beacon)
+        if self.serial_number is None:
+            sock = socket.create_connection(self.address)
+        else:
+            sock = self._unlock(self.address, self.serial_number,
+                                self._unlock_protocol, self.serial_number)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+
+class UnixTransport(SocketTransport):
+    """
+    Unix domain socket, f.i. to a local process, that owns the brick
+    """
+
+    protocol = const.UNIX
+
+    def __init__(self, path: str = None, sock: socket.socket = None):
+        """Connect to path or take over a connected socket
+
+        Keyword Arguments (either path or sock):
+        path: file name of the socket
+        sock: connected unix socket
+        """
+        assert path or sock, \
+            'Either path or sock needs to be given'
+        self.path = path
+        if sock is None:
+            sock = self._connect()
+        super().__init__(sock)
+
+    def _connect(self) -> socket.socket:
+        if self.path is None:
+            raise ConnectionError('UnixTransport without path '
+                                  'can not reconnect')
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.path)
+        return sock
+
+
+class HidTransport(Transport):
+    """
+    USB connection via hidapi. Commands are written through one
+    preallocated report, header fields are patched in place and
+    the operations are copied behind them.
+    """
+
+    protocol = const.USB
+    datagram = True
+
+    def __init__(self, device):
+        """Take over an opened device
+
+        Arguments:
+        device: opened hid device of the EV3
+        """
+        super().__init__()
+        self.device = device
+        self.serial_number = None   # set by open, allows reconnect
+        self._report = bytearray(const.MAX_CMD_SIZE + PADDING)
+        self._view = memoryview(self._report)
+        self._zeros = memoryview(bytes(const.MAX_CMD_SIZE + PADDING))
+        self._dirty = 0
+
+    @classmethod
+    def open(cls, host: str = None) -> 'HidTransport':
+        """Open the hid device of an EV3
+
+        Keyword Arguments:
+        host: mac-address of the EV3 (None: the only one, that is connected)
+        """
+        import hid  # pylint: disable=import-outside-toplevel
+        ev3_devices = [h for h in hid.enumerate()
+                       if h['vendor_id'] == const.ID_VENDOR_LEGO]
+
+        found_host = None
+        for dev in ev3_devices:
+            if found_host:
+                raise ValueError('found multiple ev3 but no argument'
+                                 'host was set')
+            if host:
+                mac_addr = dev['serial_number']
+                if mac_addr.upper() == host.replace(':', '').upper():
+                    found_host = dev
+                    break
+            else:
+                found_host = dev
+        if not found_host:
+            raise RuntimeError("Lego EV3 not found")
+
+        transport = cls(cls._open_device(found_host['serial_number']))
+        transport.serial_number = found_host['serial_number']
+        return transport
+
+    @staticmethod
+    def _open_device(serial_number: str):
+        import hid  # pylint: disable=import-outside-toplevel
+        device = hid.device()
+        device.open(const.ID_VENDOR_LEGO, const.ID_PRODUCT_EV3,
+                    serial_number)
+
+        # initial read
+        device.set_nonblocking(1)
+        device.read(1024)
+        return device
+
+    def close(self) -> None:
+        self.closed = True
+        self.device.close()
+
+    def reconnect(self) -> None:
+        if self.serial_number is None:
+            raise ConnectionError('HidTransport without serial number '
+                                  'can not reconnect')
+        device = self._open_device(self.serial_number)
+        with self._lock:
+            old, self.device = self.device, device
+        try:
+            old.close()
+        except (OSError, ValueError):
+            pass
+
+    def send(self, frame: bytes) -> None:
+        with self._lock:
+            self._patch(0, frame, len(frame))
+
+    def send_direct(self, ops: bytes, msg_cnt: int, cmd_type: bytes,
+                    mem: int) -> None:
+        size = len(ops) + 7
+        with self._lock:
+            _DIRECT_HEADER.pack_into(self._report, 0,
+                                     size - 2, msg_cnt, cmd_type, mem)
+            self._patch(7, ops, size)
+
+    def send_system(self, cmd: bytes, msg_cnt: int, cmd_type: bytes) -> None:
+        size = len(cmd) + 5
+        with self._lock:
+            _SYSTEM_HEADER.pack_into(self._report, 0,
+                                     size - 2, msg_cnt, cmd_type)
+            self._patch(5, cmd, size)
+
+    def recv_into(self, view: memoryview) -> int:
+        # blocking read, returns empty after 100 ms without a reply
+        try:
+            report = self.device.read(len(view), 100)
+        except (OSError, ValueError) as exc:
+            raise ConnectionError('usb connection to EV3 broken') from exc
+        if not report:
+            return 0
+        view[:len(report)] = bytes(report)
+        return len(report)
+
+    def _patch(self, pos: int, data: bytes, size: int) -> None:
+        """
+        copy data behind the header, clear old bytes and write the report
+        """
+        if size > const.MAX_CMD_SIZE:
+            raise ValueError('command of {} bytes exceeds the maximum of {}'
+                             .format(size, const.MAX_CMD_SIZE))
+        self._view[pos:size] = data
+        if self._dirty > size:
+            self._view[size:self._dirty] = self._zeros[size:self._dirty]
+        self._dirty = size
+        self._send_frame(self._view[:size])
+
+    def _write(self, frame: bytes) -> None:
+        try:
+            self.device.write(self._view[:len(frame) + PADDING])
+        except (OSError, ValueError) as exc:
+            raise ConnectionError('usb connection to EV3 broken') from exc
+
+
+def null_reply(frame: bytes) -> typing.Optional[bytes]:
+    """
+    reply of a brick, that does nothing: zeros as global memory,
+    status ok for system commands
+    """
+    kind = frame[4]
+    if kind == const.DIRECT_COMMAND_REPLY[0]:
+        global_mem = struct.unpack_from('<H', frame, 5)[0] & 0x3FF
+        return b''.join([
+            struct.pack('<H', global_mem + 3),
+            frame[2:4],
+            const.DIRECT_REPLY,
+            bytes(global_mem)
+        ])
+    if kind == const.SYSTEM_COMMAND_REPLY[0]:
+        return b''.join([
+            struct.pack('<H', 5),
+            frame[2:4],
+            const.SYSTEM_REPLY,
+            frame[5:6],
+            const.SYSTEM_REPLY_OK
+        ])
+    return None
+
+
+class LoopbackTransport(Transport):
+    """
+    In-process brick, a handler answers each command directly in send.
+    Without radio and sockets, it measures the python side of
+    a connection (encoding, framing, batching, routing of replies).
+    """
+
+    protocol = const.LOOPBACK
+
+    def __init__(self, handler: typing.Callable[[bytes], bytes] = None):
+        """Create a loopback
+
+        Keyword Arguments:
+        handler: gets each command (bytes) and returns its reply
+                 (None: no reply), default: null_reply,
+                 f.i. Emulator().handle answers like a brick
+        """
+        super().__init__()
+        self._handler = handler or null_reply
+        self._replies = collections.deque()
+        self._pending = None    # rest of a partially read reply
+        self._cond = threading.Condition()
+
+    def recv_into(self, view: memoryview) -> int:
+        with self._cond:
+            while self._pending is None and not self._replies:
+                if self.closed:
+                    raise ConnectionError('connection to EV3 closed')
+                self._cond.wait()
+            data = self._pending or self._replies.popleft()
+            size = min(len(view), len(data))
+            view[:size] = data[:size]
+            self._pending = data[size:] or None
+            return size
+
+    def close(self) -> None:
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def reconnect(self) -> None:
+        with self._cond:
+            self._replies.clear()
+            self._pending = None
+
+    def _write(self, frame: bytes) -> None:
+        if self.closed:
+            raise ConnectionError('connection to EV3 closed')
+        reply = self._handler(bytes(frame))
+        if reply is not None:
+            with self._cond:
+                self._replies.append(reply)
+                self._cond.notify()
@@ -1,5 +1,6 @@
 """Module for various helper utils for the EV3."""
 
+import functools
 import math
 import struct
 import time
@@ -79,8 +80,8 @@ class PID():
             return self._gain_prop * error + signal_int + signal_der
 
 
-def LCX(value: int) -> bytes:
-    """Create a LC0, LC1, LC2, LC4, dependent from the value"""
+def _lcx(value: int) -> bytes:
+    """Create a LC0, LC1, LC2, LC4 without the table"""
     if value >= -32 and value < 0:
         return struct.pack('b', 0x3F & (value + 64))
 
@@ -96,40 +97,88 @@ def LCX(value: int) -> bytes:
     return b'\x83' + struct.pack('<i', value)
 
 
-def LCS(value: str) -> bytes:
-    """Pack a string into a LCS"""
-    return b'\x84' + str.encode(value) + b'\x00'
-
-
-def LVX(value: int) -> bytes:
-    """Create a LV0, LV1, LV2, LV4, dependent from the value"""
+def _var(value: int, short: int, prefix: int) -> bytes:
+    """Create a variable (LV or GV) without the table"""
     if value < 0:
         raise RuntimeError('No negative values allowed')
 
     if value < 32:
-        return struct.pack('b', 0x40 | value)
+        return struct.pack('<B', short | value)
 
-    if value < 256:
-        return b'\xc1' + struct.pack('<b', value)
+    if value < 128:
+        return struct.pack('<Bb', prefix | 1, value)
 
-    if value < 65536:
-        return b'\xc2' + struct.pack('<h', value)
+    if value < 32768:
+        return struct.pack('<Bh', prefix | 2, value)
 
-    return b'\xc3' + struct.pack('<i', value)
+    return struct.pack('<Bi', prefix | 3, value)
 
 
-def GVX(value: int) -> bytes:
-    """Create a GV0, GV1, GV2, GV4, dependent from the value"""
-    if value < 0:
-        raise RuntimeError('No negative values allowed')
+# precomputed encodings of the most frequent values
+TABLE_SIZE = 1024
+_LCX_TABLE = tuple(_lcx(value) for value in range(-TABLE_SIZE, TABLE_SIZE))
+_LVX_TABLE = tuple(_var(value, 0x40, 0xc0) for value in range(TABLE_SIZE))
+_GVX_TABLE = tuple(_var(value, 0x60, 0xe0) for value in range(TABLE_SIZE))
 
-    if value < 32:
-        return struct.pack('<b', 0x60 | value)
 
-    if value < 256:
-        return b'\xe1' + struct.pack('<b', value)
+def LCX(value: int) -> bytes:
+    """Create a LC0, LC1, LC2, LC4, dependent from the value"""
+    if -TABLE_SIZE <= value < TABLE_SIZE:
+        return _LCX_TABLE[value + TABLE_SIZE]
+    return _lcx(value)
+
+
+@functools.lru_cache(maxsize=256)
+def LCS(value: str) -> bytes:
+    """Pack a string into a LCS"""
+    return b'\x84' + str.encode(value) + b'\x00'
 
-    if value < 65536:
-        return b'\xe2' + struct.pack('<h', value)
 
-    return b'\xe3' + struct.pack('<i', value)
+def LVX(value: int) -> bytes:
+    """Create a LV0, LV1, LV2, LV4, dependent from the value"""
+    if 0 <= value < TABLE_SIZE:
+        return _LVX_TABLE[value]
+    return _var(value, 0x40, 0xc0)
+
+
+def GVX(value: int) -> bytes:
+    """Create a GV0, GV1, GV2, GV4, dependent from the value"""
+    if 0 <= value < TABLE_SIZE:
+        return _GVX_TABLE[value]
+    return _var(value, 0x60, 0xe0)
+
+
+def LCX_array(values) -> bytes:
+    """Encode many constants at once (needs numpy)
+
+    Arguments:
+    values: sequence or numpy array of ints
+
+    Returns:
+    the concatenated LCX of all values
+    """
+    import numpy
+
+    values = numpy.asarray(values).ravel()
+    assert values.size == 0 or values.dtype.kind in 'iu', \
+        "values need to be integers"
+    values = values.astype(numpy.int64)
+    if values.size and (values.min() < -2**31 or values.max() >= 2**31):
+        raise ValueError('values need to be in range of int32')
+    lc0 = (values >= -32) & (values < 32)
+    lc1 = ~lc0 & (values >= -127) & (values <= 127)
+    lc2 = ~lc0 & ~lc1 & (values >= -32767) & (values <= 32767)
+    lc4 = ~(lc0 | lc1 | lc2)
+    sizes = numpy.select([lc0, lc1, lc2], [1, 2, 3], 5)
+    starts = numpy.cumsum(sizes) - sizes
+    # little endian bytes of each value
+    raw = values.astype('<i4').view(numpy.uint8).reshape(-1, 4)
+    out = numpy.empty(int(sizes.sum()), numpy.uint8)
+    out[starts[lc0]] = raw[lc0, 0] & 0x3F
+    for mask, prefix, width in ((lc1, 0x81, 1), (lc2, 0x82, 2),
+                                (lc4, 0x83, 4)):
+        pos = starts[mask]
+        out[pos] = prefix
+        for i in range(width):
+            out[pos + 1 + i] = raw[mask, i]
+    return out.tobytes()
@@ -23,6 +23,7 @@ import numbers
 import time
 import ev3
 import task
+from ev3.template import CommandTemplate, LC2, LC4
 
 TRIAS = {
     "tempo": 80,
@@ -105,6 +106,15 @@ HAPPY_BIRTHDAY = {
     ]
 }
 
+# play a tone, duration in ms (0 means forever)
+_TONE = CommandTemplate([
+    ev3.opSound,
+    ev3.TONE,
+    LC2('volume'),
+    LC2('freq'),
+    LC4('duration')
+])
+
 class Jukebox(ev3.EV3):
     """
     plays songs and uses LEDs
@@ -210,14 +220,12 @@ class Jukebox(ev3.EV3):
             raise AttributeError('tone is too low: ' + tone)
         if freq > 10000:
             raise AttributeError('tone is too high: ' + tone)
-        ops = b''.join([
-            ev3.opSound,
-            ev3.TONE,
-            ev3.LCX(self._volume),
-            ev3.LCX(freq),
-            ev3.LCX(round(1000*duration))
-        ])
-        self.send_direct_cmd(ops)
+        self.send_template(
+            _TONE,
+            volume=self._volume,
+            freq=freq,
+            duration=round(1000*duration)
+        )
     # pylint: enable=too-many-branches
 
     def sound(self, path: str, duration: float=None, repeat: bool=False) -> task.Task:
@@ -19,7 +19,6 @@ LEGO Mindstorms EV3 - vehicle
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 import math
-import struct
 import time
 import numbers
 import task
@@ -28,6 +27,8 @@ import ev3
 import ev3.constants as const
 import ev3.motor
 import ev3.utils
+from ev3.schema import ReplySchema
+from ev3.template import CommandTemplate, LC2
 
 
 DRIVE_TYPE_STRAIGHT = "straight"
@@ -36,6 +37,50 @@ DRIVE_TYPE_ROTATE_TO = "rotate_to"
 DRIVE_TYPE_DRIVE_TO = "drive_to"
 DRIVE_TYPE_STOP = "stop"
 
+# global memory of _ops_pos: positions of the wheels in degree
+POSITIONS = ReplySchema('Positions')
+POSITIONS.int32('left')
+POSITIONS.int32('right')
+
+# read positions of the wheels, parameters: input ports of the motors
+_OPS_POS = [
+    const.opInput_Device,
+    const.READY_RAW,
+    ev3.utils.LCX(0),                             # LAYER
+    LC2('no_left'),                               # NO
+    ev3.utils.LCX(7),                             # TYPE - EV3-Large-Motor
+    ev3.utils.LCX(1),                             # MODE - Degree
+    ev3.utils.LCX(1),                             # VALUES
+    POSITIONS.gvx('left'),                        # VALUE1
+    const.opInput_Device,
+    const.READY_RAW,
+    ev3.utils.LCX(0),                             # LAYER
+    LC2('no_right'),                              # NO
+    ev3.utils.LCX(7),                             # TYPE - EV3-Large-Motor
+    ev3.utils.LCX(0),                             # MODE - Degree
+    ev3.utils.LCX(1),                             # VALUES
+    POSITIONS.gvx('right')                        # VALUE1
+]
+_READ_POS = CommandTemplate(_OPS_POS, global_mem=POSITIONS.global_mem)
+_MOVE = CommandTemplate([
+    const.opOutput_Step_Sync,
+    ev3.utils.LCX(0),                             # LAYER
+    LC2('nos'),                                   # NOS
+    LC2('speed'),
+    LC2('turn'),
+    ev3.utils.LCX(0),                             # STEPS
+    ev3.utils.LCX(0),                             # BRAKE
+    const.opOutput_Start,
+    ev3.utils.LCX(0),                             # LAYER
+    LC2('nos')                                    # NOS
+] + _OPS_POS, global_mem=POSITIONS.global_mem)
+_STOP = CommandTemplate([
+    const.opOutput_Stop,
+    ev3.utils.LCX(0),                             # LAYER
+    LC2('nos'),                                   # NOS
+    LC2('brake')                                  # BRAKE
+] + _OPS_POS, global_mem=POSITIONS.global_mem)
+
 
 class TwoWheelVehicle(ev3.EV3):
     """
@@ -143,6 +188,14 @@ class TwoWheelVehicle(ev3.EV3):
         return o_tmp - 180
 
     def _reaction(self):
+        """
+        seconds from sending a command until the brick executes it,
+        half of the measured round trip time of the connection
+        (fixed values per protocol until replies were measured)
+        """
+        srtt = self.rtt.srtt
+        if srtt is not None:
+            return srtt / 2
         if self._protocol == const.BLUETOOTH:
             return 0.04
         elif self._protocol == const.WIFI:
@@ -190,24 +243,10 @@ class TwoWheelVehicle(ev3.EV3):
         """
         read positions of the wheels (returns operations)
         """
-        return b''.join([
-            const.opInput_Device,
-            const.READY_RAW,
-            ev3.utils.LCX(0),                             # LAYER
-            ev3.motor.port_motor_input(self._port_left),  # NO
-            ev3.utils.LCX(7),                             # TYPE - EV3-Large-Motor
-            ev3.utils.LCX(1),                             # MODE - Degree
-            ev3.utils.LCX(1),                             # VALUES
-            ev3.utils.GVX(0),                             # VALUE1
-            const.opInput_Device,
-            const.READY_RAW,
-            ev3.utils.LCX(0),                             # LAYER
-            ev3.motor.port_motor_input(self._port_right), # NO
-            ev3.utils.LCX(7),                             # TYPE - EV3-Large-Motor
-            ev3.utils.LCX(0),                             # MODE - Degree
-            ev3.utils.LCX(1),                             # VALUES
-            ev3.utils.GVX(4)                              # VALUE1
-        ])
+        return _READ_POS.ops(
+            no_left=ev3.motor.motor_input_no(self._port_left),
+            no_right=ev3.motor.motor_input_no(self._port_right)
+        )
 
     def _test_o(self) -> float:
         (direction, final_o, final_pos) = self._test_args
@@ -221,8 +260,9 @@ class TwoWheelVehicle(ev3.EV3):
             wait = 0.1
         else:
             first_call = False
-            reply = self.send_direct_cmd(self._ops_pos(), global_mem=8)
-            pos = struct.unpack('<ii', reply[5:])
+            reply = self.send_direct_cmd(self._ops_pos(),
+                                         global_mem=POSITIONS.global_mem)
+            pos = tuple(POSITIONS.decode(reply))
             self._update(pos)
             if direction > 0 and self._orientation >= final_o or \
                direction < 0 and self._orientation <= final_o:
@@ -265,8 +305,9 @@ class TwoWheelVehicle(ev3.EV3):
             wait = 0.3
         else:
             first_call = False
-            reply = self.send_direct_cmd(self._ops_pos(), global_mem=8)
-            pos = struct.unpack('<ii', reply[5:])
+            reply = self.send_direct_cmd(self._ops_pos(),
+                                         global_mem=POSITIONS.global_mem)
+            pos = tuple(POSITIONS.decode(reply))
             self._update(pos)
             if direction > 0 and self._pos[0] >= final_pos[0] or \
                direction < 0 and self._pos[0] <= final_pos[0]:
@@ -308,6 +349,10 @@ class TwoWheelVehicle(ev3.EV3):
            0  : straight
            100: turn left with unmoved left wheel
            200: circle left on place
+
+        A move, that still waits for its turn to be sent, is replaced
+        by a newer move or stop of the vehicle (f.i. from another thread),
+        only the newest one is sent.
         """
         assert self._sync_mode != const.SYNC, 'no unlimited operations allowed in sync_mode SYNC'
         assert isinstance(speed, int), "speed needs to be an integer value"
@@ -330,20 +375,19 @@ class TwoWheelVehicle(ev3.EV3):
             speed *= -1
         if self._port_left < self._port_right:
             turn *= -1
-        ops = b''.join([
-            const.opOutput_Step_Sync,
-            ev3.utils.LCX(0),                                  # LAYER
-            ev3.utils.LCX(self._port_left + self._port_right), # NOS
-            ev3.utils.LCX(speed),
-            ev3.utils.LCX(turn),
-            ev3.utils.LCX(0),                                  # STEPS
-            ev3.utils.LCX(0),                                  # BRAKE
-            const.opOutput_Start,
-            ev3.utils.LCX(0),                                  # LAYER
-            ev3.utils.LCX(self._port_left + self._port_right)  # NOS
-        ])
-        reply = self.send_direct_cmd(ops + self._ops_pos(), global_mem=8)
-        pos = struct.unpack('<ii', reply[5:])
+        reply = self.send_template(
+            _MOVE,
+            mailbox=self._port_left + self._port_right,
+            nos=self._port_left + self._port_right,
+            speed=speed,
+            turn=turn,
+            no_left=ev3.motor.motor_input_no(self._port_left),
+            no_right=ev3.motor.motor_input_no(self._port_right)
+        )
+        if reply is None:
+            # superseded by a newer move or stop, that was not yet sent
+            return
+        pos = tuple(POSITIONS.decode(reply))
         if self._port_left < self._port_right:
             turn *= -1
         self._update(pos)
@@ -363,14 +407,15 @@ class TwoWheelVehicle(ev3.EV3):
             brake_int = 1
         else:
             brake_int = 0
-        ops = b''.join([
-            const.opOutput_Stop,
-            ev3.utils.LCX(0),                                  # LAYER
-            ev3.utils.LCX(self._port_left + self._port_right), # NOS
-            ev3.utils.LCX(brake_int)                           # BRAKE
-        ])
-        reply = self.send_direct_cmd(ops + self._ops_pos(), global_mem=8)
-        pos = struct.unpack('<ii', reply[5:])
+        reply = self.send_template(
+            _STOP,
+            mailbox=self._port_left + self._port_right,
+            nos=self._port_left + self._port_right,
+            brake=brake_int,
+            no_left=ev3.motor.motor_input_no(self._port_left),
+            no_right=ev3.motor.motor_input_no(self._port_right)
+        )
+        pos = tuple(POSITIONS.decode(reply))
         self._update(pos)
         self._moves = False
 
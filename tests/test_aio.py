@@ -0,0 +1,107 @@
+"""Tests of the asyncio client against the emulator."""
+
+import asyncio
+import threading
+import time
+import unittest
+
+import ev3
+from ev3.emulator import Emulator
+from ev3.transport import LoopbackTransport
+
+
+class HeldTransport(LoopbackTransport):
+    """
+    Loopback, that holds back the replies until release is called
+    """
+
+    def __init__(self):
+        super().__init__(Emulator().handle)
+        self.hold = True
+        self.held = []
+
+    def _write(self, frame: bytes) -> None:
+        if not self.hold:
+            super()._write(frame)
+            return
+        reply = self._handler(bytes(frame))
+        if reply is not None:
+            self.held.append(reply)
+
+    def release(self) -> None:
+        self.hold = False
+        with self._cond:
+            self._replies.extend(self.held)
+            self.held.clear()
+            self._cond.notify()
+
+
+class BlockingTransport(LoopbackTransport):
+    """
+    Loopback, whose first write blocks until the gate is opened
+    """
+
+    def __init__(self):
+        super().__init__(Emulator().handle)
+        self.gate = threading.Event()
+        self.writing = threading.Event()
+
+    def _write(self, frame: bytes) -> None:
+        if not self.writing.is_set():
+            self.writing.set()
+            self.gate.wait()
+        super()._write(frame)
+
+
+class TestAsyncEV3(unittest.TestCase):
+
+    def test_write_does_not_block_loop(self):
+        transport = BlockingTransport()
+        ev3_obj = ev3.EV3(transport=transport)
+        # another thread's write holds the gate of the connection
+        thread = threading.Thread(target=ev3_obj.send_direct_cmd,
+                                  args=(ev3.opNop,))
+        thread.start()
+        transport.writing.wait(2)
+        # safety net, if the loop is blocked
+        timer = threading.Timer(1, transport.gate.set)
+        timer.start()
+
+        async def send() -> tuple:
+            async_ev3 = ev3.AsyncEV3(ev3_obj=ev3_obj)
+            task = asyncio.ensure_future(
+                async_ev3.send_direct_cmd(ev3.opNop, global_mem=1))
+            start = time.monotonic()
+            await asyncio.sleep(0.05)
+            lag = time.monotonic() - start
+            waited = not task.done()
+            transport.gate.set()
+            return lag, waited, await asyncio.wait_for(task, 2)
+
+        lag, waited, reply = asyncio.run(send())
+        timer.cancel()
+        thread.join()
+        self.assertLess(lag, 0.5)
+        self.assertTrue(waited)
+        self.assertEqual(reply[4:5], ev3.DIRECT_REPLY)
+
+    def test_reply_after_loop_closed(self):
+        transport = HeldTransport()
+        ev3_obj = ev3.EV3(transport=transport)
+
+        async def send() -> bytes:
+            async_ev3 = ev3.AsyncEV3(ev3_obj=ev3_obj)
+            async_ev3.sync_mode = ev3.ASYNC
+            return await async_ev3.send_direct_cmd(ev3.opNop, global_mem=1)
+
+        asyncio.run(send())
+        transport.release()
+
+        # the receiver survived the late reply
+        reply = ev3_obj.send_direct_cmd(ev3.opNop, global_mem=1, timeout=2)
+        self.assertEqual(reply[4:5], ev3.DIRECT_REPLY)
+        self.assertEqual(ev3_obj._session.receiver.store.orphaned, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+"""Tests of the splitting of received bytes into frames."""
+
+import struct
+import unittest
+
+from ev3.framing import FrameReader
+
+
+def _frame(counter: int, payload: bytes) -> bytes:
+    return struct.pack('<HH', len(payload) + 2, counter) + payload
+
+
+class Chunks:
+    """
+    read_into, that returns the given chunks, one per call
+    """
+
+    def __init__(self, *chunks: bytes):
+        self._chunks = list(chunks)
+
+    def __call__(self, view: memoryview) -> int:
+        data = self._chunks.pop(0)
+        assert len(data) <= len(view)
+        view[:len(data)] = data
+        return len(data)
+
+
+def _read_all(reader: FrameReader, reads: int) -> list:
+    frames = []
+    for _ in range(reads):
+        frames += [bytes(frame) for frame in reader.read()]
+    return frames
+
+
+class TestFrameReader(unittest.TestCase):
+
+    def test_partial_frame(self):
+        frame = _frame(42, b'\x02\x01\x02\x03')
+        reader = FrameReader(Chunks(frame[:1], frame[1:5], frame[5:]))
+        self.assertEqual(list(reader.read()), [])
+        self.assertEqual(list(reader.read()), [])
+        self.assertEqual(_read_all(reader, 1), [frame])
+
+    def test_coalesced_frames(self):
+        first = _frame(1, b'\x02\x00')
+        second = _frame(2, b'\x02\x00\xff')
+        third = _frame(3, b'\x04')
+        reader = FrameReader(Chunks(first + second + third[:3], third[3:]))
+        self.assertEqual(_read_all(reader, 1), [first, second])
+        self.assertEqual(_read_all(reader, 1), [third])
+
+    def test_frame_larger_than_buffer(self):
+        frame = _frame(7, bytes(range(256)) * 4)
+        chunks = [frame[pos:pos + 100] for pos in range(0, len(frame), 100)]
+        reader = FrameReader(Chunks(*chunks), size=128, max_read=100)
+        self.assertEqual(_read_all(reader, len(chunks)), [frame])
+
+    def test_datagram_drops_padding(self):
+        frame = _frame(9, b'\x02\x05')
+        reader = FrameReader(Chunks(frame + bytes(20), frame + bytes(20)),
+                             datagram=True)
+        self.assertEqual(_read_all(reader, 2), [frame, frame])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+"""Tests of the receiver and the store of parked replies."""
+
+import struct
+import time
+import unittest
+from unittest import mock
+
+import ev3
+from ev3.emulator import Emulator
+from ev3.receiver import ReplyStore
+from ev3.session import Session
+from ev3.transport import LoopbackTransport
+
+
+class BreakingTransport(LoopbackTransport):
+    """
+    Loopback, that breaks on demand (reconnect works)
+    and loses the replies, while hold is set
+    """
+
+    def __init__(self):
+        super().__init__(Emulator().handle)
+        self.hold = False
+        self.broken = False
+
+    def recv_into(self, view: memoryview) -> int:
+        with self._cond:
+            self._cond.wait_for(lambda: self.broken or self.closed or
+                                self._replies or self._pending)
+            if self.broken:
+                self.broken = False
+                raise ConnectionError('connection to EV3 broke')
+        return super().recv_into(view)
+
+    def break_(self) -> None:
+        with self._cond:
+            self.broken = True
+            self._cond.notify_all()
+
+    def _write(self, frame: bytes) -> None:
+        if self.hold:
+            self._handler(bytes(frame))
+            return
+        super()._write(frame)
+
+
+def _nop(msg_cnt: int) -> bytes:
+    """
+    opNop with reply and one byte of global memory
+    """
+    return struct.pack('<HHcH', 6, msg_cnt, ev3.DIRECT_COMMAND_REPLY, 1) \
+        + ev3.opNop
+
+
+class TestReceiver(unittest.TestCase):
+
+    def setUp(self):
+        self.ev3 = ev3.EV3(transport=LoopbackTransport(Emulator().handle))
+        self.receiver = self.ev3._session.receiver
+
+    def test_failing_callback(self):
+        def callback(reply: bytes, exc: Exception) -> None:
+            raise ValueError('bug of the caller')
+
+        counter = struct.pack('<H', 1000)
+        with self.assertLogs('ev3.receiver', 'ERROR'):
+            self.receiver.expect(counter, callback=callback)
+            self.ev3._session.transport.send(_nop(1000))
+            # the receiver keeps routing the replies
+            reply = self.ev3.send_direct_cmd(ev3.opNop, global_mem=1,
+                                             timeout=2)
+        self.assertEqual(reply[4:5], ev3.DIRECT_REPLY)
+        self.assertEqual(self.receiver.outages, [])
+
+    def test_failed_command_of_outage(self):
+        def callback(outage: ev3.Outage) -> None:
+            raise ValueError('bug of the caller')
+
+        transport = BreakingTransport()
+        ev3_obj = ev3.EV3(transport=transport)
+        ev3_obj.reconnect = ev3.Reconnect(delay=0, callback=callback)
+        ev3_obj.sync_mode = ev3.ASYNC
+        transport.hold = True
+        counter = ev3_obj.send_direct_cmd(ev3.opNop, global_mem=1)
+        transport.hold = False
+        with self.assertLogs('ev3.receiver', 'ERROR'):
+            transport.break_()
+            deadline = time.monotonic() + 2
+            while not ev3_obj.outages and time.monotonic() < deadline:
+                time.sleep(0.01)
+        self.assertTrue(ev3_obj.outages[0].recovered)
+        receiver = ev3_obj._session.receiver
+        self.assertEqual(receiver._waiters, {})
+        with self.assertRaises(ev3.error.ConnectionLostError):
+            ev3_obj.wait_for_reply(counter, timeout=2)
+        # the receiver survived the failing callback
+        ev3_obj.sync_mode = ev3.STD
+        reply = ev3_obj.send_direct_cmd(ev3.opNop, global_mem=1, timeout=2)
+        self.assertEqual(reply[4:5], ev3.DIRECT_REPLY)
+
+
+class Clock:
+    """
+    replaces the time module of the receiver (only its own monotonic)
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+class TestReplyStore(unittest.TestCase):
+
+    def test_capacity(self):
+        store = ReplyStore(capacity=2, max_age=None)
+        for num in range(3):
+            store.put(struct.pack('<H', num), b'reply' + bytes([num]))
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store.evicted, 1)
+        self.assertIsNone(store.pop(struct.pack('<H', 0)))  # the oldest
+        self.assertEqual(store.pop(struct.pack('<H', 2)), b'reply\x02')
+
+    def test_max_age(self):
+        clock = Clock()
+        with mock.patch('ev3.receiver.time', clock):
+            store = ReplyStore(max_age=10)
+            store.put(b'\x01\x00', b'old')
+            clock.now += 6
+            store.put(b'\x02\x00', b'young')
+            clock.now += 5
+            self.assertIsNone(store.pop(b'\x01\x00'))
+            self.assertEqual(store.pop(b'\x02\x00'), b'young')
+        self.assertEqual(store.evicted, 1)
+        self.assertEqual(len(store), 0)
+
+    def test_counter_wrap(self):
+        session = Session(LoopbackTransport())
+        session._msg_cnt = 65534
+        self.assertEqual([session.next_counter() for _ in range(3)],
+                         [65535, 1, 2])
+        # an uncollected reply of the same counter is evicted
+        store = ReplyStore()
+        store.put(b'\x01\x00', b'before the wrap')
+        store.put(b'\x01\x00', b'after the wrap')
+        self.assertEqual(store.evicted, 1)
+        self.assertEqual(store.pop(b'\x01\x00'), b'after the wrap')
+
+
+if __name__ == '__main__':
+    unittest.main()
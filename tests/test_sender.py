@@ -0,0 +1,119 @@
+"""Tests of the order of the writes, credits and supersession."""
+
+import threading
+import time
+import unittest
+
+from ev3 import constants as const
+from ev3.sender import Credits, Sender, SUPERSEDED, WRITTEN
+
+
+def _wait_until(predicate, timeout: float = 2) -> None:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, 'timeout'
+        time.sleep(0.001)
+
+
+class Writes:
+    """
+    records the writes, the first one blocks until release is called
+    """
+
+    def __init__(self):
+        self.written = []
+        self.writing = threading.Event()
+        self._gate = threading.Event()
+
+    def write(self, value) -> None:
+        if not self.writing.is_set():
+            self.writing.set()
+            self._gate.wait(2)
+        self.written.append(value)
+
+    def release(self) -> None:
+        self._gate.set()
+
+
+class TestSupersede(unittest.TestCase):
+
+    def setUp(self):
+        self.sender = Sender()
+        self.writes = Writes()
+        self.results = {}
+        self.threads = []
+        # the first write holds the gate, the others wait
+        self._start('blocker', const.NORMAL, None)
+        self.writes.writing.wait(2)
+
+    def _start(self, value, priority: str, mailbox) -> None:
+        def write():
+            self.results[value] = self.sender.write(
+                priority, self.writes.write, value, mailbox=mailbox)
+
+        waiting = self.sender.waiting
+        thread = threading.Thread(target=write)
+        thread.start()
+        self.threads.append(thread)
+        if value != 'blocker':
+            # queued (or the waiting one of its mailbox is replaced)
+            _wait_until(lambda: self.sender.waiting != waiting or
+                        any(result == SUPERSEDED
+                            for result in self.results.values()))
+
+    def _finish(self) -> None:
+        self.writes.release()
+        for thread in self.threads:
+            thread.join(2)
+
+    def test_newest_value_in_place(self):
+        self._start('left 10', const.NORMAL, 'left')
+        self._start('right 10', const.NORMAL, 'right')
+        self._start('left 20', const.NORMAL, 'left')
+        self._finish()
+        self.assertEqual(self.writes.written,
+                         ['blocker', 'left 20', 'right 10'])
+        self.assertEqual(self.results['left 10'], SUPERSEDED)
+        self.assertEqual(self.results['left 20'], WRITTEN)
+
+    def test_high_removes_waiting(self):
+        self._start('left 10', const.NORMAL, 'left')
+        self._start('right 10', const.NORMAL, 'right')
+        self._start('stop left', const.HIGH, 'left')
+        self._finish()
+        self.assertEqual(self.writes.written,
+                         ['blocker', 'stop left', 'right 10'])
+        self.assertEqual(self.results['left 10'], SUPERSEDED)
+
+    def test_without_mailbox(self):
+        self._start('first', const.NORMAL, None)
+        self._start('second', const.NORMAL, None)
+        self._finish()
+        self.assertEqual(self.writes.written,
+                         ['blocker', 'first', 'second'])
+
+
+class TestCredits(unittest.TestCase):
+
+    def test_probe_outside_lock(self):
+        observed = []
+
+        def probe(callback) -> None:
+            # the gate is taken, but the lock is free
+            other = threading.Thread(target=lambda: sender.waiting)
+            other.start()
+            other.join(1)
+            observed.append((sender._busy, other.is_alive()))
+            callback(True)
+
+        sender = Sender(probe=probe)
+        sender.credits = Credits(window=2, min_window=1, probe_every=2)
+        for value in range(4):
+            sender.write(const.NORMAL, lambda value: None, value,
+                         counted=True)
+        self.assertEqual(observed, [(True, False), (True, False)])
+        self.assertEqual(sender.credits.in_flight, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+"""Tests of the WiFi transport against a fake brick on localhost."""
+
+import socket
+import threading
+import unittest
+
+from ev3.discovery import Discovery
+from ev3.transport import TcpTransport
+
+SERIAL_NUMBER = '0016535D7E2D'
+
+
+def _free_port(kind: int) -> int:
+    with socket.socket(socket.AF_INET, kind) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class FakeBrick:
+    """
+    Sends beacons, counts their answers (UDP) and accepts unlocked
+    TCP connections on the same port (it has 4 digits, as in a beacon)
+    """
+
+    def __init__(self):
+        for port in range(5555, 9999):
+            tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                tcp.bind(('127.0.0.1', port))
+                udp.bind(('127.0.0.1', port))
+            except OSError:
+                tcp.close()
+                udp.close()
+                continue
+            break
+        self.port = port
+        self.tcp = tcp
+        self.udp = udp
+        self.udp.settimeout(2)
+        self.tcp.listen()
+        self.conns = []
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.tcp.accept()
+            except OSError:
+                return
+            conn.recv(1024)  # the unlock message
+            conn.send(b'Accept:EV340\r\n\r\n')
+            self.conns.append(conn)
+
+    def beacon(self, port: int):
+        self.udp.sendto(
+            ('Serial-Number: ' + SERIAL_NUMBER + '\r\n'
+             + 'Port: ' + str(self.port) + '\r\n'
+             + 'Name: EV3\r\n'
+             + 'Protocol: EV3\r\n').encode('utf-8'),
+            ('127.0.0.1', port)
+        )
+
+    def wake(self) -> bytes:
+        """
+        the next answer of a beacon (raises socket.timeout)
+        """
+        return self.udp.recvfrom(16)[0]
+
+    def close(self):
+        for conn in self.conns:
+            conn.close()
+        self.tcp.close()
+        self.udp.close()
+
+
+class TestTcpTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.brick = FakeBrick()
+        self.discovery = Discovery(port=_free_port(socket.SOCK_DGRAM))
+        self.discovery.start()
+        self.brick.beacon(self.discovery.port)
+
+    def tearDown(self):
+        self.discovery.stop()
+        self.brick.close()
+
+    def test_open_answers_beacon(self):
+        transport = TcpTransport.open(SERIAL_NUMBER, timeout=2,
+                                      discovery=self.discovery)
+        try:
+            self.assertEqual(self.brick.wake(), b' ')
+            self.assertEqual(len(self.brick.conns), 1)
+        finally:
+            transport.close()
+
+    def test_reconnect_answers_beacon(self):
+        transport = TcpTransport.open(SERIAL_NUMBER, timeout=2,
+                                      discovery=self.discovery)
+        try:
+            self.brick.wake()
+            transport.reconnect()
+            self.assertEqual(self.brick.wake(), b' ')
+            self.assertEqual(transport.address,
+                             ('127.0.0.1', self.brick.port))
+        finally:
+            transport.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+"""Tests of the table driven encoders against the former if-chains."""
+
+import struct
+import unittest
+
+from ev3.utils import LCX, LVX, GVX, LCX_array, TABLE_SIZE
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def lcx_chain(value: int) -> bytes:
+    """LCX, as it was encoded before the tables"""
+    if value >= -32 and value < 0:
+        return struct.pack('b', 0x3F & (value + 64))
+    if value >= 0 and value < 32:
+        return struct.pack('b', value)
+    if value >= -127 and value <= 127:
+        return b'\x81' + struct.pack('<b', value)
+    if value >= -32767 and value <= 32767:
+        return b'\x82' + struct.pack('<h', value)
+    return b'\x83' + struct.pack('<i', value)
+
+
+def var_chain(value: int, short: int, prefix: int) -> bytes:
+    """LVX (short 0x40) and GVX (short 0x60), as they were encoded before"""
+    if value < 32:
+        return struct.pack('b', short | value)
+    if value < 256:
+        return bytes([prefix | 1]) + struct.pack('<b', value)
+    if value < 65536:
+        return bytes([prefix | 2]) + struct.pack('<h', value)
+    return bytes([prefix | 3]) + struct.pack('<i', value)
+
+
+def _values(limit: int) -> list:
+    """all values of the tables and around the limits of the widths"""
+    values = list(range(-TABLE_SIZE - 2, TABLE_SIZE + 2))
+    for border in (127, 128, 255, 256, 32767, 32768, 65535, 65536):
+        values += [border - 1, border, border + 1,
+                   -border - 1, -border, -border + 1]
+    return [value for value in values if -limit <= value <= limit]
+
+
+class TestEncoders(unittest.TestCase):
+
+    def test_lcx(self):
+        for value in _values(2**31 - 1):
+            self.assertEqual(LCX(value), lcx_chain(value), value)
+
+    def test_lvx_gvx(self):
+        for value in _values(2**31 - 1):
+            if value < 0:
+                continue
+            if 128 <= value < 256 or 32768 <= value < 65536:
+                # the former raised struct.error
+                continue
+            self.assertEqual(LVX(value), var_chain(value, 0x40, 0xc0), value)
+            self.assertEqual(GVX(value), var_chain(value, 0x60, 0xe0), value)
+
+    def test_next_width(self):
+        # unsigned values, that don't fit the signed width, take the next
+        self.assertEqual(LVX(127), b'\xc1\x7f')
+        self.assertEqual(LVX(128), b'\xc2\x80\x00')
+        self.assertEqual(GVX(255), b'\xe2\xff\x00')
+        self.assertEqual(GVX(256), b'\xe2\x00\x01')
+        self.assertEqual(LVX(32767), b'\xc2\xff\x7f')
+        self.assertEqual(LVX(32768), b'\xc3\x00\x80\x00\x00')
+        self.assertEqual(GVX(65535), b'\xe3\xff\xff\x00\x00')
+
+    @unittest.skipIf(numpy is None, 'needs numpy')
+    def test_lcx_array(self):
+        values = _values(2**31 - 1)
+        self.assertEqual(LCX_array(values),
+                         b''.join([lcx_chain(value) for value in values]))
+
+
+if __name__ == '__main__':
+    unittest.main()